@@ -0,0 +1,214 @@
+'''
+Generate a synthetic workspace for benchmarking: bom programs (.pp, .pp7 and .pp7.zip) in recipe-bom and matching SWR.xlsx workloads
+Run from the project folder: python -m benchmark.generate_recipes <workspace> --components 20000
+'''
+
+import os
+import json
+import zipfile
+import argparse
+import pandas as pd
+
+PP_NAMESPACE = 'http://api.assembleon.com/pp/v2'
+PP7_NAMESPACE = 'http://api.assembleon.com/pp7/v1'
+ROBOTS_PER_SECTION = 4
+HEADS_PER_ROBOT = 2
+PICKS_PER_INDEX = 8
+ACTIONS_PER_BOARD_LOCATION = 6000
+SHAPES = ['SMR0201', 'SMC0201', 'SMR0402', 'SMC0805']
+
+
+class Recipe:
+    '''Parts, components and feeder assignment shared by the .pp and .pp7 of a synthetic program'''
+
+    def __init__(self, name, components, parts, sections):
+        self.name = name
+        self.sections = sections
+        self.parts = [f"5{10 + p % 2}-{700000 + p}" for p in range(parts)]
+        # Components of a part are numbered contiguously, so designators can be given as ranges
+        self.components = [(f"R{c + 1}", c * parts // components) for c in range(components)]
+
+    def section_of(self, p):
+        return p % self.sections + 1
+
+    def feeder_of(self, p):
+        return p // self.sections + 1
+
+    def robot_of(self, c, p):
+        '''Components are placed by one of the robots of the section holding their feeder'''
+        return (self.section_of(p) - 1) * ROBOTS_PER_SECTION + c % ROBOTS_PER_SECTION + 1
+
+    def designators(self, p):
+        return [refDes for refDes, part in self.components if part == p]
+
+
+def _pp(recipe):
+    lines = ['<?xml version="1.0"?>', f'<PlacementProgram xmlns="{PP_NAMESPACE}">',
+             '\t<General syntaxVersion="2.0" lastModified="2024-01-01T00:00:00Z" positionInLine="1" machineModel="AX-501" operationMode="LOCAL" cycleTime="0">',
+             '\t\t<Setting key="PPS_Product" value="Synthetic"/>',
+             '\t</General>',
+             f'\t<Board id="{recipe.name}" length="269.737" width="220.917" thickness="1.250" cadOriginX="0.000" cadOriginY="0.000" handlingClass="HIGH">',
+             '\t\t<Fiducial modelId="r1016" x="-256.838" y="166.959" z="0.000" rz="0.00" refDes="F0_0" circuitNumber="1"/>']
+    for c, (refDes, p) in enumerate(recipe.components):
+        lines.append(f'\t\t<Component partNumber="{recipe.parts[p]}" refDes="{refDes}" circuitNumber="1" x="{c % 500 * 0.5:.3f}" y="{c // 500 * 0.5:.3f}" z="0.000" rz="0.00"/>')
+    lines += ['\t\t<Model id="r1016">', f'\t\t\t<Model xmlns="" xmlns:ns2="{PP_NAMESPACE}">', '\t\t\t\t<General>',
+              '\t\t\t\t\t<ModelId>r1016</ModelId>', '\t\t\t\t</General>', '\t\t\t</Model>', '\t\t</Model>', '\t</Board>']
+
+    lines += ['\t<Setup>']
+    for s in range(1, recipe.sections + 1):
+        lines += [f'\t\t<Section number="{s}">', '\t\t\t<Trolley type="A_SERIES_FDR_TROLLEY">']
+        for p in range(s - 1, len(recipe.parts), recipe.sections):
+            lines += [f'\t\t\t\t<Feeder number="{recipe.feeder_of(p)}" type="ITF2_08">',
+                      f'\t\t\t\t\t<Lane number="1" partNumber="{recipe.parts[p]}" shapeId="{SHAPES[p % len(SHAPES)]}"/>',
+                      '\t\t\t\t</Feeder>']
+        lines += ['\t\t\t</Trolley>']
+        for r in range((s - 1) * ROBOTS_PER_SECTION + 1, s * ROBOTS_PER_SECTION + 1):
+            lines.append(f'\t\t\t<Robot number="{r}" type="CPR"/>')
+        lines += ['\t\t</Section>']
+    lines += ['\t</Setup>']
+
+    picks = {}
+    for c, (refDes, p) in enumerate(recipe.components):
+        picks.setdefault(recipe.robot_of(c, p), []).append((refDes, p))
+    for r in range(1, recipe.sections * ROBOTS_PER_SECTION + 1):
+        lines.append(f'\t<Actions robotNumber="{r}">')
+        robot_picks = picks.get(r, [])
+        for k in range(0, len(robot_picks), PICKS_PER_INDEX):
+            lines += ['\t\t<Index minBoardNumber="1" maxBoardNumber="1">', '\t\t\t<ToolbitExchange toolbitType="CPL2"/>']
+            for refDes, p in robot_picks[k:k + PICKS_PER_INDEX]:
+                lines += [f'\t\t\t<Pick boardNumber="1" alignWith="AM_1" refDes="{refDes}" circuitNumber="1" feederNumber="{recipe.feeder_of(p)}" laneNumber="1">',
+                          '\t\t\t\t<BadmarkReference refDes="B0" circuitNumber="1"/>',
+                          '\t\t\t</Pick>',
+                          '\t\t\t<Align moduleId="NCLA"/>',
+                          '\t\t\t<ReadFiducial refId="0_0_0_F0_0_1" boardNumber="1" refDes="F0_0" circuitNumber="1"/>',
+                          '\t\t\t<Place/>']
+            lines.append('\t\t</Index>')
+        lines.append('\t</Actions>')
+    lines.append('</PlacementProgram>')
+    return '\n'.join(lines) + '\n'
+
+
+def _pp7(recipe):
+    lines = [f'<PlacementProgram xmlns="{PP7_NAMESPACE}">',
+             '\t<General syntaxVersion="1.1" lastModified="2024-01-01T00:00:00Z" positionInLine="1" dualLaneMode="SINGLE" fiducialSharing="LOCAL" transportDirection="LEFT_TO_RIGHT" cycleTime="0">',
+             '\t\t<Setting key="optimizerVersion" value="Synthetic"/>',
+             '\t</General>',
+             f'\t<Board id="{recipe.name}" length="269.737" width="220.917" thickness="1.250" cadOriginX="0.000" cadOriginY="0.000" cadOriginRz="0.0" handlingClass="HIGH">']
+    for c, (refDes, p) in enumerate(recipe.components):
+        lines.append(f'\t\t<Component partNumber="{recipe.parts[p]}" refDes="{refDes}" circuitNumber="1" x="{c % 500 * 0.5:.3f}" y="{c // 500 * 0.5:.3f}" z="0.000" rz="0.0"/>')
+    lines += ['\t</Board>', '\t<BoardAllocation>', f'\t\t<TransportLane number="1" boardId="{recipe.name}"/>', '\t</BoardAllocation>',
+              '\t<Segment number="1" type="H1">', '\t\t<Setup>']
+    for s in range(1, recipe.sections + 1):
+        lines.append(f'\t\t\t<FeedSection number="{s}" type="A_Series_Trolley">')
+        for p in range(s - 1, len(recipe.parts), recipe.sections):
+            lines += [f'\t\t\t\t<Feeder slotNumber="{recipe.feeder_of(p)}" type="iFeeder_08">',
+                      f'\t\t\t\t\t<FeederLane number="1" partNumber="{recipe.parts[p]}" shapeId="{SHAPES[p % len(SHAPES)]}"/>',
+                      '\t\t\t\t</Feeder>']
+        lines.append('\t\t\t</FeedSection>')
+    for r in range(1, recipe.sections * ROBOTS_PER_SECTION + 1):
+        lines.append(f'\t\t\t<Robot number="{r}">')
+        for h in range(1, HEADS_PER_ROBOT + 1):
+            lines.append(f'\t\t\t\t<PlacementHead number="{h}" type="PH5"/>')
+        lines.append('\t\t\t</Robot>')
+    lines += ['\t\t</Setup>', '\t\t<Processing>']
+
+    # Each robot picks a component per head, then aligns and places them
+    cycles = {}
+    for c, (refDes, p) in enumerate(recipe.components):
+        cycles.setdefault(recipe.robot_of(c, p), []).append((refDes, p))
+    actions = []
+    for r, robot_picks in sorted(cycles.items()):
+        for k in range(0, len(robot_picks), HEADS_PER_ROBOT):
+            group = list(enumerate(robot_picks[k:k + HEADS_PER_ROBOT], 1))
+            for h, (refDes, p) in group:
+                actions.append(f'\t\t\t\t\t<Pick alignmentMatrixId="1-0" refDes="{refDes}" circuitNumber="1" feedSectionNumber="{recipe.section_of(p)}" feederSlotNumber="{recipe.feeder_of(p)}" feederLaneNumber="1" robotNumber="{r}" headNumber="{h}"/>')
+            for h, item in group:
+                actions.append(f'\t\t\t\t\t<Align robotNumber="{r}" headNumber="{h}">\n\t\t\t\t\t\t<AlignmentModule type="BOTTOM_VIEW" cameraNumber="1"/>\n\t\t\t\t\t</Align>')
+            for h, item in group:
+                actions.append(f'\t\t\t\t\t<Place robotNumber="{r}" headNumber="{h}"/>')
+    for b, k in enumerate(range(0, max(len(actions), 1), ACTIONS_PER_BOARD_LOCATION), 1):
+        lines.append(f'\t\t\t<BoardLocation number="{b}" stopperPosition="160.000" stopperAlignment="LEADING_EDGE">')
+        for action in actions[k:k + ACTIONS_PER_BOARD_LOCATION]:
+            lines += ['\t\t\t\t<Action>', action, '\t\t\t\t</Action>']
+        lines.append('\t\t\t</BoardLocation>')
+    lines += ['\t\t</Processing>', '\t</Segment>', '</PlacementProgram>']
+    return '\n'.join(lines)
+
+
+def _pp7_zip(recipe, path, pp7_name, pp7_data):
+    with zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for p, part in enumerate(recipe.parts):
+            zf.writestr(f"{part}.PRT", f'<Part partId="{part}" lastModified="2024-01-01T00:00:00Z" syntaxVersion="1.1" shapeId="{SHAPES[p % len(SHAPES)]}" supplyFormId="R.8.P.4" electricalPolarity="false" orientation="0"/>\n')
+        for shape in SHAPES:
+            zf.writestr(f"{shape}.SHP", f'<Shape shapeId="{shape}" syntaxVersion="1.1">\n' + '\t<Body x="0.600" y="0.300" z="0.300"/>\n' * 20 + '</Shape>\n')
+        zf.writestr('R.8.P.4.SFM', '<SupplyForm supplyFormId="R.8.P.4" type="REEL" width="8" pitch="4"/>\n')
+        zf.writestr(pp7_name, pp7_data)
+
+
+def _swr_rows(recipes, bom, swr_parts):
+    '''SWR workloads over the first swr_parts parts: part sub ALL, part sub by designator ranges, partial no place and no place ALL'''
+    side1 = recipes[0].name
+    side2 = recipes[1].name if len(recipes) > 1 else ''
+    recipe = recipes[0]
+    parts = range(min(swr_parts, len(recipe.parts)))
+    ranges = lambda designators: f"{designators[0]}-{designators[-1]}" if len(designators) > 1 else designators[0]
+
+    rows = []
+    def row(cbid, partIs, partWas, designators):
+        rows.append({'CBID': cbid, 'BOM': bom, 'PNP_PROGRAM_SIDE1': side1, 'PNP_PROGRAM_SIDE2': side2,
+                     'PART NUMBER (IS)': '\n'.join(partIs), 'PART DESCRIPTION (IS)': '',
+                     'PART NUMBER (WAS)': '\n'.join(partWas), 'PART DESCRIPTION (WAS)': '',
+                     'DESIGNATOR': '\n'.join(designators)})
+
+    row('900001-PARTSUB-ALL', [f"{recipe.parts[p]}A" for p in parts], [recipe.parts[p] for p in parts], ['ALL' for p in parts])
+    row('900002-PARTSUB-RANGE', [f"{recipe.parts[p]}B" for p in parts], [recipe.parts[p] for p in parts], [ranges(recipe.designators(p)) for p in parts])
+    partial = [p for p in parts if len(recipe.designators(p)) > 1]
+    row('900003-NOPLACE-PARTIAL', ['NO PLACE' for p in partial], [recipe.parts[p] for p in partial], [ranges(recipe.designators(p)[:len(recipe.designators(p)) // 2]) for p in partial])
+    row('900004-NOPLACE-ALL', ['NO PLACE' for p in parts], [recipe.parts[p] for p in parts], ['ALL' for p in parts])
+    return rows
+
+
+def generate(workspace, components=2000, parts=None, sections=2, sides=2, swr_parts=None, bom='590-900000'):
+    '''Write the synthetic recipe-bom programs and SWR.xlsx into workspace, return the generated config'''
+    parts = parts or max(1, components // 20)
+    swr_parts = swr_parts or max(1, parts // 20)
+    path_bom = os.path.join(workspace, 'recipe-bom', bom)
+    os.makedirs(path_bom, exist_ok=True)
+
+    recipes = []
+    for side in range(1, sides + 1):
+        recipe = Recipe(f"SYN{components}-{'PD' if side == 1 else 'SD'}9-M5-IT", components, parts, sections)
+        recipes.append(recipe)
+        with open(os.path.join(path_bom, f"1-{recipe.name}.pp"), 'w', encoding='utf-8', newline='\n') as f:
+            f.write(_pp(recipe))
+        pp7_name = f"3-{recipe.name}-IFLEX.pp7"
+        pp7_data = _pp7(recipe)
+        with open(os.path.join(path_bom, pp7_name), 'w', encoding='us-ascii', newline='\n') as f:
+            f.write(pp7_data)
+        _pp7_zip(recipe, os.path.join(path_bom, f"{pp7_name}.zip"), pp7_name, pp7_data)
+
+    with pd.ExcelWriter(os.path.join(workspace, 'SWR.xlsx')) as writer:
+        pd.DataFrame(_swr_rows(recipes, bom, swr_parts)).to_excel(writer, sheet_name='SWR', index=False)
+        pd.DataFrame({'LOG_LEVEL': ['INFO']}).to_excel(writer, sheet_name='settings', index=False)
+
+    config = {'components': components, 'parts': parts, 'sections': sections, 'sides': sides, 'swr_parts': swr_parts}
+    with open(os.path.join(workspace, 'benchmark.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=1)
+    return config
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate synthetic bom programs and SWR.xlsx workloads for benchmarking')
+    parser.add_argument('workspace', help='Folder to generate recipe-bom and SWR.xlsx into')
+    parser.add_argument('--components', type=int, default=2000, help='Components per program, default 2000')
+    parser.add_argument('--parts', type=int, default=None, help='Distinct part numbers (feeders) per program, default components/20')
+    parser.add_argument('--sections', type=int, default=2, help='Feeder sections per program, 4 robots each, default 2')
+    parser.add_argument('--sides', type=int, default=2, choices=[1, 2], help='Programs per board side, default 2')
+    parser.add_argument('--swr-parts', type=int, default=None, help='Part numbers changed per SWR row, default parts/20')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    config = generate(args.workspace, args.components, args.parts, args.sections, args.sides, args.swr_parts)
+    print(f"Generated {args.workspace} with {config}")
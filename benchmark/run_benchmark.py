@@ -0,0 +1,130 @@
+'''
+Time the SWR pipeline stages separately on a workspace from benchmark.generate_recipes, and record the results for comparison across commits
+Stages are timed by the RunMetrics of main.run_swr(), so the benchmark runs the same code paths as main.py
+Run from the project folder: python -m benchmark.run_benchmark <workspace> --repeat 3
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import subprocess
+
+from main import read_swr, run_swr
+from utils.recipe_catalog import RecipeCatalog
+from utils.program_cache import ProgramCache
+from utils.swr_manifest import SWRManifest
+from utils.swr_metrics import RunMetrics
+from utils.swr_pipeline import IOPipeline
+
+STAGES = ['scan', 'read_swr', 'expand', 'parse', 'transform', 'serialize', 'zip']
+PATH_RESULTS = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results.jsonl')
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_once(workspace, path_out, log, workers=1, stream=False, pipeline=False):
+    '''Run all SWR rows of the workspace once through read_swr() and run_swr() of main.py, return (seconds per stage, counters)'''
+    metrics = RunMetrics()
+    settings = {'CACHE_MAX_MB': 4096, 'CATALOG_CACHE': False, 'PIPELINE_MAX_MB': 256}
+
+    with metrics.span('scan'):
+        catalog = RecipeCatalog(os.path.join(workspace, 'recipe-bom'))
+    rows = read_swr(log, os.path.join(workspace, 'SWR.xlsx'), metrics)
+    program_cache = ProgramCache(settings['CACHE_MAX_MB'])
+    manifest = SWRManifest(path_out, log)
+
+    # All rows are generated, the manifest is never saved
+    io_pipeline = IOPipeline(settings['PIPELINE_MAX_MB']) if pipeline and workers <= 1 else None
+    try:
+        status = run_swr(log, rows, path_out, catalog, program_cache, manifest, metrics, settings, workers, stream, True, io_pipeline)
+    finally:
+        if io_pipeline is not None:
+            io_pipeline.close()
+        program_cache.release_splicers()
+
+    timings = {stage: metrics.stages.get(stage, [0, 0.0])[1] for stage in STAGES}
+    counters = {'cbids': len(status), 'failed': sum(1 for cbid_status in status.values() if cbid_status in ('failed', 'not_found')),
+                'files': len(metrics.files), 'bytes_read': metrics.counters.get('bytes_read', 0), 'bytes_written': metrics.counters.get('bytes_written', 0)}
+    return timings, counters
+
+
+def _previous(config, options):
+    '''Last recorded result of the same workspace config and run options'''
+    if not os.path.exists(PATH_RESULTS):
+        return None
+    previous = None
+    with open(PATH_RESULTS, 'r', encoding='utf-8') as f:
+        for line in f:
+            result = json.loads(line)
+            if result.get('config') == config and result.get('options', {}) == options:
+                previous = result
+    return previous
+
+
+def main(workspace, repeat=3, label='', workers=1, stream=False, pipeline=False):
+    log = logging.getLogger('benchmark')
+    log.setLevel(logging.WARNING)
+    with open(os.path.join(workspace, 'benchmark.json'), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    # Keep the best of the repeats for each stage, outputs are written into a scratch folder of the workspace
+    path_out = os.path.join(workspace, 'recipe-swr-benchmark')
+    best, counters = None, None
+    for n in range(repeat):
+        shutil.rmtree(path_out, ignore_errors=True)
+        timings, counters = run_once(workspace, path_out, log, workers, stream, pipeline)
+        best = timings if best is None else {stage: min(best[stage], timings[stage]) for stage in STAGES}
+    shutil.rmtree(path_out, ignore_errors=True)
+
+    # Options are recorded only when set, so results of default runs compare with those recorded before them
+    options = {}
+    if workers > 1:
+        options['workers'] = workers
+    if stream:
+        options['stream'] = True
+    if pipeline:
+        options['pipeline'] = True
+    previous = _previous(config, options)
+    result = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': _commit(), 'label': label, 'python': sys.version.split()[0],
+              'config': config, 'options': options, 'repeat': repeat, 'seconds': {stage: round(best[stage], 6) for stage in STAGES}, 'counters': counters}
+    with open(PATH_RESULTS, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+
+    print(f"config = {config}, options = {options}, commit = {result['commit']}, best of {repeat}")
+    print(f"{'stage':<12}{'seconds':>12}{'previous':>12}{'change':>10}")
+    for stage in STAGES + ['total']:
+        seconds = sum(best.values()) if stage == 'total' else best[stage]
+        if previous is not None:
+            before = sum(previous['seconds'].values()) if stage == 'total' else previous['seconds'].get(stage, 0.0)
+            change = f"{(seconds - before) / before * 100:+.1f}%" if before > 0 else ''
+            print(f"{stage:<12}{seconds:>12.4f}{before:>12.4f}{change:>10}")
+        else:
+            print(f"{stage:<12}{seconds:>12.4f}")
+    print(f"counters = {counters}")
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the SWR pipeline stages on a generated workspace')
+    parser.add_argument('workspace', help='Folder generated by benchmark.generate_recipes')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs to take the best timing of each stage from, default 3')
+    parser.add_argument('--label', default='', help='Free text recorded with the results')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes, as main.py --workers')
+    parser.add_argument('--stream', action='store_true', help='Stream .pp/.pp7 programs, as main.py --stream')
+    parser.add_argument('--pipeline', action='store_true', help='Read ahead and write behind, as main.py --pipeline')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args.workspace, args.repeat, args.label, args.workers, args.stream, args.pipeline)
@@ -1,604 +1,708 @@
 try:
     import time
     import os
+    import json
     import sys
+    import argparse
+    import functools
+    from collections import Counter
     import getpass
-    import pandas as pd
-    import numpy as np
+    from contextlib import nullcontext
     import xml.etree.ElementTree as ETree
     import zipfile
     from utils.logger import logger_init
-    from utils.Common_Functions_64 import ExpandSeries, delete_file
+    from utils.Common_Functions_64 import DesignatorRanges, delete_file
+    from utils.swr_engine import apply_swr
+    from utils.program_cache import ProgramCache
+    from utils.swr_serializer import write_program, render_program
+    from utils.swr_memory import peak_rss
+    from utils.swr_zip import build_pp7_zip, PRT_LIBRARY
+    from utils.recipe_catalog import RecipeCatalog
+    from utils.swr_manifest import SWRManifest
+    from utils.swr_metrics import RunMetrics
+    from utils.swr_workbook import read_workbook
+
+    # Modules of the optional modes (workers, stream, splice, dedup, pipeline, max-memory, profile, serve) are imported where used
 
 except ImportError as IE:
     print(f"Import Error: {str(IE)}")
-    time.sleep(5)
+    sys.exit(1)
 
+INPUT_COLUMNS = ['CBID', 'PNP_PROGRAM_SIDE1', 'PNP_PROGRAM_SIDE2', 'PART NUMBER (IS)', 'PART NUMBER (WAS)', 'DESIGNATOR']
 
-def init():
-    '''init'''
 
-    # Get path_main and transform into absolute path (so it works for onedrive path too)
-    sharepoint_online_path = f"https://microncorp-my.sharepoint.com/personal/{getpass.getuser()}_micron.com/Documents/"
-    sharepoint_local_path = f"C:\\Users\\{getpass.getuser()}\\OneDrive - Micron Technology, Inc\\"
-    path_main = os.path.dirname(os.path.realpath(sys.argv[0]))
-    path_main = path_main.replace(sharepoint_online_path, sharepoint_local_path)
-    path_main = path_main.replace("/", "\\")
+def init(path_swr=None, path_recipe_bom=None, path_recipe_swr=None, path_log=None):
+    '''
+    init, reading the settings and SWR sheets of the swr file at once
+    Paths not given are taken next to the swr file, by default SWR.xlsx next to main.py (in the OneDrive folder if synced from SharePoint)
+    Return log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings and the SWR rows
+    '''
+
+    if path_swr is None:
+        # Get path_main and transform into absolute path (so it works for onedrive path too)
+        sharepoint_online_path = f"https://microncorp-my.sharepoint.com/personal/{getpass.getuser()}_micron.com/Documents/"
+        sharepoint_local_path = f"C:\\Users\\{getpass.getuser()}\\OneDrive - Micron Technology, Inc\\"
+        path_main = os.path.dirname(os.path.realpath(sys.argv[0]))
+        path_main = path_main.replace(sharepoint_online_path, sharepoint_local_path)
+        path_main = path_main.replace("/", "\\")
+        path_swr = os.path.join(path_main, 'SWR.xlsx')
+    else:
+        path_main = os.path.dirname(os.path.abspath(path_swr))
 
     # Define working folder paths
-    path_recipe_bom = f"{path_main}\\recipe-bom"
-    path_recipe_swr = f"{path_main}\\recipe-swr"
-    filename_swr = 'SWR.xlsx'
-    path_swr = f"{path_main}\\{filename_swr}"
+    path_recipe_bom = path_recipe_bom or os.path.join(path_main, 'recipe-bom')
+    path_recipe_swr = path_recipe_swr or os.path.join(path_main, 'recipe-swr')
+    path_log = path_log or os.path.join(path_main, 'Log')
+
+    workbook = read_workbook(path_swr, ['settings', 'SWR'])
+    settings_row = workbook['settings'][0] if len(workbook.get('settings', [])) > 0 else {}
 
     # Init logger
-    try:
-        df_settings = pd.read_excel(path_swr, sheet_name='settings')
-        loglevel = list(df_settings['LOG_LEVEL'])[0]
-        loglevel_error = False 
-    except (ValueError, KeyError):
-        loglevel_error = True
+    loglevel = settings_row.get('LOG_LEVEL')
+    loglevel_error = not isinstance(loglevel, str)
+    if loglevel_error:
         loglevel = 'INFO'
 
+    # Memory ceiling of parsed bom programs cached across CBIDs
+    try:
+        cache_max_mb = float(settings_row['CACHE_MAX_MB'])
+    except (ValueError, KeyError, TypeError):
+        cache_max_mb = 1024
+
+    # Keep the recipe-bom catalog across runs, rescanned once any of its folders is modified
+    catalog_cache = str(settings_row.get('CATALOG_CACHE', 'Y')).strip().upper() not in ('N', 'NO', 'FALSE', '0')
+
+    log = logger_init('SWR_PROGRAM_CREATE.log', path_log, 'w', loglevel, queued=True)
+    log.info(f"Running main.py in {path_main} with loglevel = {loglevel}")
+
     if loglevel_error:
         log.warning('LOG_LEVEL is not defined in settings, setting to INFO...')
 
-    log = logger_init('SWR_PROGRAM_CREATE.log', f"{path_main}\\Log", 'w', loglevel)
-    log.info(f"Running main.py in {path_main} with loglevel = {loglevel}")
+    # Bytes of bom programs read ahead, and of outputs queued to be written, in --pipeline mode
+    try:
+        pipeline_max_mb = float(settings_row['PIPELINE_MAX_MB'])
+    except (ValueError, KeyError, TypeError):
+        pipeline_max_mb = 256
 
-    return log, path_main, path_recipe_bom, path_recipe_swr, path_swr
+    settings = {'CACHE_MAX_MB': cache_max_mb, 'CATALOG_CACHE': catalog_cache, 'PIPELINE_MAX_MB': pipeline_max_mb}
 
+    if 'SWR' not in workbook:
+        raise ValueError(f"Worksheet named 'SWR' not found in {path_swr}")
 
-def main(log, path_main, path_recipe_bom, path_recipe_swr, path_swr):
-    '''main'''
-    
-    log.info(f"path_recipe_bom = {path_recipe_bom}")
-    log.info(f"path_recipe_swr = {path_recipe_swr}")
-    log.info(f"path_swr = {path_swr}")
+    return log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings, workbook['SWR']
+
+
+def cleanup_cbid(log, path_recipe_swr, cbid, error):
+    '''Warn and delete the output folder of the CBID which cannot be handled'''
+    log.warning(f"{str(error)}")
+    output_folder = os.path.join(path_recipe_swr, cbid)
+    if os.path.exists(output_folder):
+        log.warning(f"Found output folder with warning CBID, deleting {output_folder} ...")
+        delete_file(output_folder)
+
+
+def process_files(log, program_cache, path_recipe_swr, cbid, files, lineItems, partIsList, partWasList, stream=False, metrics=None, pipeline=None, store=None, prefetch_next=()):
+    '''
+    Generate the SWR programs of the given CBID from the matched bom program files, raise AssertionError if the SWR cannot be handled
+    With an IOPipeline, uncached bom programs are read ahead and outputs are written behind, all written before returning,
+    the bom programs of prefetch_next (those of the next CBID) are read ahead once those of this CBID are queued
+    With an OutputStore, outputs are written into the store once and hard linked into the CBID folder
+    '''
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    # Output .pp7 kept in memory until packed into its .pp7.zip
+    pp7_outputs = {}
+    outputs = []
+
+    if pipeline is not None and not stream:
+        upcoming = list(files) + [file for file in prefetch_next if file not in files]
+        # Read-ahead of a CBID skipped or failed since is not taken anymore
+        pipeline.discard(upcoming)
+        prefetch = [file for file in upcoming if file.rsplit('.', 1)[-1].lower() in ('pp', 'pp7') and not program_cache.is_cached(file)]
+        pipeline.prefetch(prefetch, [os.path.getsize(file) for file in prefetch])
+
+    try:
+        # Loop through matched program files
+        for file in files:
+
+            log.info(f"Processing: {file}...")
+
+            filename = os.path.basename(file)
+            log.debug(f"filename = {filename}")
+
+            if filename[-8:].lower() == '.pp7.zip':
+                file_ext = 'pp7.zip'
+                filename_without_ext = filename.rsplit('.pp7.zip', 1)[0]
+
+            else:
+                filename_without_ext = filename.rsplit('.', 1)[0]
+                file_ext = filename.rsplit('.', 1)[-1]
+
+            log.debug(f"filename_without_ext = {filename_without_ext}")
+            log.debug(f"file_ext = {file_ext}")
+
+            xmldata = file
+            metrics.count('bytes_read', os.path.getsize(file), cbid, filename)
+
+            # Register namespaces
+            if file_ext.lower() == 'pp7':
+                ETree.register_namespace('', 'http://api.assembleon.com/pp7/v1')
+
+            elif file_ext.lower() == 'pp':
+                ETree.register_namespace('', 'http://api.assembleon.com/pp/v2')
+
+            # In streaming mode, pre-scan the program and apply all line items, the output is written while reading the program
+            plan, streamed = None, False
+            if stream and file_ext.lower() in ('pp', 'pp7'):
+                from utils.swr_stream import plan_stream, rewrite_program
+                try:
+                    with metrics.span('transform', cbid, filename):
+                        plan = plan_stream(xmldata, file_ext, cbid, lineItems, log)
+                    streamed = True
+                except ValueError as e:
+                    log.warning(f"Unable to stream {file}, falling back to full tree: {str(e)}")
+
+            # The cached tree is changed from plan.apply() until plan.revert(), it is dropped from program_cache if anything fails in between
+            applied = False
+            try:
+                # Get the parsed and indexed program from program_cache, then apply all line items through the indexes
+                # A program used by several CBIDs is spliced from its bom program bytes instead, without changing the tree
+                pieces = None
+                if not streamed and file_ext.lower() in ('pp', 'pp7'):
+                    data = pipeline.take(xmldata, cbid, filename) if pipeline is not None else None
+                    with metrics.span('parse', cbid, filename):
+                        prstree, index = program_cache.get(xmldata, file_ext, data)
+                        splicer = program_cache.splicer(xmldata)
+                    with metrics.span('transform', cbid, filename):
+                        plan = apply_swr(index, cbid, lineItems, log)
+                        if splicer is not None:
+                            pieces = splicer.splice(plan)
+                        if pieces is None:
+                            applied = True
+                            plan.apply()
+
+                if plan is not None:
+                    for kind, n in plan.counts.items():
+                        metrics.count(kind, n, cbid, filename)
+
+                # Make output folder
+                output_folder = os.path.join(path_recipe_swr, cbid)
+                if not os.path.exists(output_folder):
+                    log.info(f"Making folder = {output_folder} ...")
+                    os.makedirs(output_folder)
+                output_path = os.path.join(output_folder, f"{filename_without_ext}-{cbid}.{file_ext}")
+                log.info(f"Writing into {output_path}...")
+
+                # Unlink an output hard linked to the store by a --dedup run, as it is written in place unless written through the store
+                if os.path.exists(output_path) and os.stat(output_path).st_nlink > 1:
+                    os.remove(output_path)
+
+                # Stream output .pp or .pp7
+                if streamed:
+                    log.info(f"Streaming output .{file_ext} file...")
+                    with metrics.span('serialize', cbid, filename):
+                        rewrite_program(xmldata, output_path, file_ext, plan)
+                        if store is not None:
+                            store.adopt(output_path)
+
+                # Splice output .pp or .pp7 from the bom program bytes
+                elif pieces is not None:
+                    log.info(f"Splicing output .{file_ext} file...")
+                    keep = file_ext.lower() == 'pp7' and f"{file}.zip" in files
+                    with metrics.span('serialize', cbid, filename):
+                        if pipeline is None and store is None:
+                            from utils.swr_splice import write_spliced
+                            data = write_spliced(pieces, output_path, keep)
+                        else:
+                            data = b''.join(pieces)
+                            if pipeline is None:
+                                store.write(output_path, data)
+                    pieces = None
+                    if pipeline is not None:
+                        pipeline.write(output_path, data, cbid, filename, store)
+                    if data is not None and keep:
+                        pp7_outputs[output_path] = data
+
+                # Render output .pp or .pp7 in memory, written behind by the pipeline
+                elif file_ext.lower() in ('pp', 'pp7') and pipeline is not None:
+                    log.info(f"Writing output .{file_ext} file...")
+                    with metrics.span('serialize', cbid, filename):
+                        data = render_program(prstree.getroot(), file_ext)
+                    pipeline.write(output_path, data, cbid, filename, store)
+                    if file_ext.lower() == 'pp7' and f"{file}.zip" in files:
+                        pp7_outputs[output_path] = data
+
+                # Write output .pp or .pp7 in a single pass
+                elif file_ext.lower() in ('pp', 'pp7'):
+                    log.info(f"Writing output .{file_ext} file...")
+                    keep = file_ext.lower() == 'pp7' and f"{file}.zip" in files
+                    with metrics.span('serialize', cbid, filename):
+                        if store is not None:
+                            data = render_program(prstree.getroot(), file_ext)
+                            store.write(output_path, data)
+                            data = data if keep else None
+                        else:
+                            data = write_program(prstree.getroot(), output_path, file_ext, keep=keep)
+                    if data is not None:
+                        pp7_outputs[output_path] = data
+
+            except BaseException:
+                pieces = None
+                if applied:
+                    log.warning(f"Dropping cached program {file} changed by the failed CBID = {cbid} ...")
+                    program_cache.discard(xmldata)
+                raise
+
+            # Restore the cached program for the next CBID
+            if applied:
+                try:
+                    plan.revert()
+                except BaseException:
+                    program_cache.discard(xmldata)
+                    raise
+
+            # Write output .pp7.zip, packing the output .pp7 kept in memory if any
+            if file_ext.lower() == 'pp7.zip' and zipfile.is_zipfile(file):
+                log.info('Writing output .pp7.zip files...')
+                pp7_data = pp7_outputs.pop(output_path.replace('.zip', ''), None)
+                if pipeline is not None:
+                    pipeline.submit(build_pp7_zip, file, output_path, partIsList, partWasList, pp7_data, store, size=len(pp7_data or b''), timing=('zip', cbid, filename))
+                else:
+                    with metrics.span('zip', cbid, filename):
+                        build_pp7_zip(file, output_path, partIsList, partWasList, pp7_data, store)
+
+            outputs.append((filename, output_path))
+
+    except BaseException:
+        if pipeline is not None:
+            pipeline.discard()
+        raise
 
-    # Read main excel workbook
-    log.info('Reading swr file...')
-    input_columns = ['CBID', 'PNP_PROGRAM_SIDE1', 'PNP_PROGRAM_SIDE2', 'PART NUMBER (IS)', 'PART NUMBER (WAS)', 'DESIGNATOR']
+    finally:
+        if pipeline is not None:
+            pipeline.drain(metrics)
 
-    # Create df_input for input sheet
-    log.info('Creating dataframe for input sheet...')
-    df_input = pd.read_excel(path_swr, sheet_name='SWR')
-    log.debug(f"\n{df_input.head(5).to_string(index=False)}")
+    for filename, output_path in outputs:
+        if os.path.exists(output_path):
+            metrics.count('bytes_written', os.path.getsize(output_path), cbid, filename)
+
+    return
+
+
+def plan_files(log, program_cache, cbid, files, lineItems, metrics=None):
+    '''
+    Validate all line items of the given CBID against the matched bom program files, without writing any output
+    Return {'status': 'valid' or 'rejected', 'errors': [...], 'warnings': [...], 'files': {filename: [line item report of apply_swr(validate=True)]}}
+    '''
+
+    if metrics is None:
+        metrics = RunMetrics()
+
+    report = {'status': 'valid', 'errors': [], 'warnings': [], 'files': {}}
+    for file in files:
+        filename = os.path.basename(file)
+
+        # The output .pp7.zip is packed with the output .pp7, so its .pp7 must be matched too
+        if filename[-8:].lower() == '.pp7.zip':
+            if file[:-4] not in files:
+                report['errors'].append(f"{filename}: .pp7.zip files are provided, but .pp7 files are missing. Do extract and provide .pp7 together with .pp7.zip files.")
+            continue
+
+        file_ext = filename.rsplit('.', 1)[-1]
+        if file_ext.lower() not in ('pp', 'pp7'):
+            continue
+
+        log.info(f"Validating: {file}...")
+        with metrics.span('parse', cbid, filename):
+            prstree, index = program_cache.get(file, file_ext)
+        with metrics.span('transform', cbid, filename):
+            plan = apply_swr(index, cbid, lineItems, log, validate=True)
+        for kind, n in plan.counts.items():
+            metrics.count(kind, n, cbid, filename)
+
+        for detail in plan.details:
+            if len(detail['conflicts']) > 0:
+                report['errors'].append(f"{filename}: Same feeder is sharing for impacted and non-impacted designators, unable to modify feeder {detail['conflicts']} of {detail['partWas']}")
+            if len(detail['missing']) > 0:
+                report['warnings'].append(f"{filename}: Designators {detail['missing']} of {detail['partWas']} are not found")
+        report['files'][filename] = plan.details
+
+    if len(report['errors']) > 0:
+        report['status'] = 'rejected'
+        for error in report['errors']:
+            log.warning(f"CBID = {cbid} is rejected, {error}")
+    else:
+        log.info(f"CBID = {cbid} is valid with {metrics.cbid_summary(cbid)} planned.")
+    for warning in report['warnings']:
+        log.warning(f"CBID = {cbid}, {warning}")
+    return report
+
+
+def _cell_text(value):
+    '''Text of a cell read by read_workbook(), empty cells as the empty text'''
+    return '' if value is None else str(value)
+
+
+def _rows_text(rows, n=5):
+    '''Text of the first n rows, for debugging'''
+    return '\n'.join(' | '.join(_cell_text(row.get(column)) for column in INPUT_COLUMNS) for row in rows[:n])
+
+
+def normalize_swr(log, rows):
+    '''
+    Trim the input columns of the SWR rows [{column: value}], drop incomplete rows and CBID duplicates, raise ConnectionAbortedError if there is no input left
+    Return the rows of the input columns, an empty column is None
+    '''
 
     log.debug('Trimming all input columns...')
-    for input_column in input_columns:
-        df_input[input_column] = df_input[input_column].astype(str)
-        df_input[input_column] = df_input[input_column].str.strip().str.upper().str.lstrip('0')
-    df_input = df_input.replace([' '], ['']).replace(['NAN'], ['']).replace([''], [np.NaN], regex=True)
-    log.debug(f"\n{df_input.head(5).to_string(index=False)}")
+    normalized = []
+    for row in rows:
+        row_input = {}
+        for input_column in INPUT_COLUMNS:
+            value = _cell_text(row[input_column]).strip().upper().lstrip('0')
+            row_input[input_column] = None if value in ('', 'NAN') else value
+        normalized.append(row_input)
+    log.debug(f"\n{_rows_text(normalized)}")
 
     log.debug('Dropping null rows...')
-    df_input.dropna(how='any', subset=['CBID', 'PNP_PROGRAM_SIDE1', 'PART NUMBER (IS)', 'PART NUMBER (WAS)', 'DESIGNATOR'], inplace=True)
-    log.debug(f"\n{df_input.head(5).to_string(index=False)}")
+    normalized = [row for row in normalized if all(row[column] is not None for column in ['CBID', 'PNP_PROGRAM_SIDE1', 'PART NUMBER (IS)', 'PART NUMBER (WAS)', 'DESIGNATOR'])]
+    log.debug(f"\n{_rows_text(normalized)}")
 
-    if len(df_input) < 1:
+    if len(normalized) < 1:
         raise ConnectionAbortedError ('There is no input to be processed, force exiting application...')
 
     log.debug('Dropping CBID duplicates...')
-    df_input.drop_duplicates(subset=['CBID'], keep='first', inplace=True)
-    log.debug(f"\n{df_input.head(5).to_string(index=False)}")
-
-    log.info('Starting to loop through df_input...')
-    for i in range(len(df_input)):
+    cbids = set()
+    rows_input = []
+    for row in normalized:
+        if row['CBID'] not in cbids:
+            cbids.add(row['CBID'])
+            rows_input.append(row)
+    log.debug(f"\n{_rows_text(rows_input)}")
+
+    return rows_input
+
+
+def read_swr(log, path_swr, metrics, rows=None):
+    '''Read the SWR sheet of the swr file, normalized by normalize_swr(), rows already read from the SWR sheet are normalized only'''
+
+    if rows is None:
+        # Read main excel workbook
+        log.info('Reading swr file...')
+        with metrics.span('read_swr'):
+            rows = read_workbook(path_swr, ['SWR'])['SWR']
+
+    return normalize_swr(log, rows)
+
+
+def run_swr(log, rows, path_recipe_swr, catalog, program_cache, manifest, metrics, settings, workers=1, stream=False, force=False, pipeline=None, budget=None, plans=None, profiler=None, store=None):
+    '''
+    Generate the SWR programs of all normalized rows with the given catalog, program_cache and manifest
+    Return {CBID: status}, status is one of 'generated', 'skipped' (unchanged since the last run), 'not_found' (no program file) or 'failed'
+    If plans is given, the rows are validated only: the plan_files() report of each CBID is put into plans, with status 'valid' or 'rejected'
+    With a SWRProfiler, the processing of each CBID (or each of its jobs with worker processes) is profiled
+    With an OutputStore, identical outputs are kept once in the store and hard linked into the CBID folders
+    '''
+
+    # Schedule rows grouped by program, so each bom program is parsed once and reused from program_cache
+    log.debug('Grouping rows by PNP_PROGRAM_SIDE1 and PNP_PROGRAM_SIDE2...')
+    schedule = sorted(range(len(rows)), key=lambda i: (rows[i]['PNP_PROGRAM_SIDE1'], rows[i]['PNP_PROGRAM_SIDE2'] is None, rows[i]['PNP_PROGRAM_SIDE2'] or ''))
+    jobs, job_keys, status = [], {}, {}
+
+    # Program files matched per (PNP_PROGRAM_SIDE1, PNP_PROGRAM_SIDE2), also looked up ahead for the read-ahead of the next row
+    matched = {}
+
+    def match(selected_program):
+        key = tuple(selected_program)
+        if key not in matched:
+            matched[key] = catalog.match(selected_program)
+        return matched[key]
+
+    def next_files(position):
+        '''Program files of the row scheduled after position, read ahead by the pipeline while the current row is processed'''
+        if pipeline is None or position + 1 >= len(schedule):
+            return ()
+        j = schedule[position + 1]
+        return match([rows[j]['PNP_PROGRAM_SIDE1'], rows[j]['PNP_PROGRAM_SIDE2']])
+
+    # Uses of each program file by the rows not reached yet, so program_cache builds splicers only for programs used again,
+    # and within a memory budget the programs are released after their last use
+    # (none in validate-only mode, worker processes build them once a program is reused)
+    pending = Counter()
+    if plans is None and workers <= 1:
+        for j in schedule:
+            pending.update(match([rows[j]['PNP_PROGRAM_SIDE1'], rows[j]['PNP_PROGRAM_SIDE2']]))
+    program_cache.expect(pending)
+
+    log.info('Starting to loop through SWR rows...')
+    for position, i in enumerate(schedule):
 
         try:
 
-            log.info(f"Reading row #{i+1} with CBID = {df_input.loc[i, 'CBID']}, PNP_PROGRAM_SIDE1 = {df_input.loc[i, 'PNP_PROGRAM_SIDE1']}, PNP_PROGRAM_SIDE2 = {df_input.loc[i, 'PNP_PROGRAM_SIDE2']}")
-            log.debug(f"\n{df_input.take([i]).to_string(index=False)}")
+            log.info(f"Reading row #{i+1} with CBID = {rows[i]['CBID']}, PNP_PROGRAM_SIDE1 = {rows[i]['PNP_PROGRAM_SIDE1']}, PNP_PROGRAM_SIDE2 = {rows[i]['PNP_PROGRAM_SIDE2']}")
+            log.debug(f"\n{_rows_text([rows[i]])}")
 
             try:
-                selected_program = [df_input.loc[i, 'PNP_PROGRAM_SIDE1'], df_input.loc[i, 'PNP_PROGRAM_SIDE2']].remove('')
+                selected_program = [rows[i]['PNP_PROGRAM_SIDE1'], rows[i]['PNP_PROGRAM_SIDE2']].remove('')
             except (KeyError, ValueError):
-                selected_program = [df_input.loc[i, 'PNP_PROGRAM_SIDE1'], df_input.loc[i, 'PNP_PROGRAM_SIDE2']]
+                selected_program = [rows[i]['PNP_PROGRAM_SIDE1'], rows[i]['PNP_PROGRAM_SIDE2']]
 
             # log.debug('Hardcoding selected files...')
             # selected_program = ['3440CB-PD0-M5-IT', '3440CB-SD0-M5-IT']
 
             log.info(f"Selected_program = {selected_program}")
 
-            log.debug("Initializing file_program dicts...")
-            file_program = {}
+            # Resolve program files from the recipe-bom catalog
+            with metrics.span('scan', rows[i]['CBID']):
+                file_program = match(selected_program)
+            pending.subtract(file_program)
 
-            # Recursively call scandir inclusive of subfolders for filename matching
-            def scan_dir_file(path):
-                for f in os.scandir(path):
-                    if f.is_file() and (f.name[-3:].lower() == '.pp' or f.name[-4:].lower() == '.pp7' or f.name[-8:].lower() == '.pp7.zip') and any (matcher in f.name for matcher in selected_program):
-                        yield f.path
-                    elif f.is_dir():
-                        yield from scan_dir_file(f.path)
-            file_program = {f for f in scan_dir_file(path_recipe_bom)}
-            file_program = sorted(file_program)
-
-            log.info(f"Matched file_program for CBID = {df_input.loc[i, 'CBID']} is {file_program}")
+            log.info(f"Matched file_program for CBID = {rows[i]['CBID']} is {file_program}")
 
             # Continue only if at least one program file is found
             if len(file_program) < 1:
                 log.warning('There is no selected program file found.')
-                log.warning(f"Force skipping row #{i+1} with CBID = {df_input.loc[i, 'CBID']}...")
+                log.warning(f"Force skipping row #{i+1} with CBID = {rows[i]['CBID']}...")
+                status[rows[i]['CBID']] = 'not_found'
+                if plans is not None:
+                    plans[rows[i]['CBID']] = {'status': 'not_found', 'errors': [f"There is no selected program file found for {selected_program}."], 'files': {}}
                 continue
 
             log.debug('Splitting part number and designator...')
-            partIsList =  df_input.loc[i, 'PART NUMBER (IS)'].split('\n')
-            partWasList =  df_input.loc[i, 'PART NUMBER (WAS)'].split('\n')
-            designatorsList =  df_input.loc[i, 'DESIGNATOR'].split('\n')
+            partIsList =  rows[i]['PART NUMBER (IS)'].split('\n')
+            partWasList =  rows[i]['PART NUMBER (WAS)'].split('\n')
+            designatorsList =  rows[i]['DESIGNATOR'].split('\n')
 
             if len(partIsList) != len(partWasList) or len(partIsList) != len(designatorsList) or len(partWasList) != len(designatorsList):
-                raise AssertionError(f"Number of partIs, partWas and designator does not tally, force skipping CBID = {df_input.loc[i, 'CBID']} !")
+                raise AssertionError(f"Number of partIs, partWas and designator does not tally, force skipping CBID = {rows[i]['CBID']} !")
 
             if 'NO PLACE' in (x.strip().upper() for x in partWasList):
-                raise AssertionError(f"NO PLACE is found in partWasList, unable to handle part addition, force skipping CBID = {df_input.loc[i, 'CBID']} !")
-
-            log.info(f"Total of {len(designatorsList)} line item(s) to be processed for CBID = {df_input.loc[i, 'CBID']}.")
-
-            # Loop through matched file_program
-            for file in file_program:
-
-                log.info(f"Processing: {file}...")
-
-                filename = file.rsplit('\\', 1)[-1]
-                log.debug(f"filename = {filename}")
-
-                if filename[-8:].lower() == '.pp7.zip':
-                    file_ext = 'pp7.zip'
-                    filename_without_ext = filename.rsplit('.pp7.zip', 1)[0]
-
-                else:
-                    filename_without_ext = filename.rsplit('.', 1)[0]
-                    file_ext = filename.rsplit('.', 1)[-1]
-
-                log.debug(f"filename_without_ext = {filename_without_ext}")
-                log.debug(f"file_ext = {file_ext}")
-
-                xmldata = file
-
-                # Register namespaces
-                if file_ext.lower() == 'pp7':
-                    ETree.register_namespace('', 'http://api.assembleon.com/pp7/v1')
-                    prstree = ETree.parse(xmldata)
-                    root = prstree.getroot()
-
-                elif file_ext.lower() == 'pp':
-                    ETree.register_namespace('', 'http://api.assembleon.com/pp/v2')
-                    prstree = ETree.parse(xmldata)
-                    root = prstree.getroot()
-            
-                # Loop through line items to be processed
-                for j in range(len(designatorsList)):
-                    partIs, partWas, designators = partIsList[j].strip().upper(), partWasList[j].strip().upper(), designatorsList[j].strip().upper()
-                    log.info(f"Processing partIs = {partIs}, partWas = {partWas}, designators = {designators} in {file} ...")
-                    
-                    # Expand and split designators
-                    log.info(f"Expanding and spliting {designators} ...")
-                    designators = ExpandSeries(designators)
-                    if '-' in designators:
-                        raise AssertionError(f"Designators {designators} not expanded and contains '-', force skipping CBID = {df_input.loc[i, 'CBID']} !")
-
-                    designatorList = designators.split(',')
-                    log.info(f"designatorList = {designatorList}")
-
-                    # Handle .pp7 file
-                    if file_ext.lower() == 'pp7':
-
-                        pp_url = '{http://api.assembleon.com/pp7/v1}'
-                        log.debug(f"Setting pp_url to {pp_url}...")
-
-                        feeder_whitelist, check_designator, all_designator, componentToRemove, feederToRemove, actionToRemove, robotHeadToRemove = set(), set(), set(), set(), set(), set(), set()
-                        for BoardInfo in root.iter(f"{pp_url}Board"):
-
-                            # Modify program names for the 1st time processing the file only
-                            if j == 0:
-                                sPROGRAM_NAME = BoardInfo.attrib.get('id')
-                                sPROGRAM_NAME_NEW = f"{sPROGRAM_NAME}-{df_input.loc[i, 'CBID']}"
-                                log.info(f"Modifying program name from {sPROGRAM_NAME} to {sPROGRAM_NAME_NEW} ...")
-                                BoardInfo.attrib['id'] = BoardInfo.attrib['id'].replace(sPROGRAM_NAME, sPROGRAM_NAME_NEW)
-
-                            for ComponentInfo in BoardInfo.iter(f"{pp_url}Component"):
-                                sPartNumber = ComponentInfo.attrib.get('partNumber')
-                                sREFDES = ComponentInfo.attrib.get('refDes')
-
-                                if sPartNumber == partWas and 'ALL' in designatorList: 
-                                    log.debug(f"Adding {sREFDES} into all_designator...")
-                                    all_designator.add(sREFDES)
-
-                                elif sPartNumber == partWas and 'ALL' not in designatorList:
-                                    log.debug(f"Adding {sREFDES} into check_designator...")
-                                    check_designator.add(sREFDES)
-
-                                for designator in designatorList:
-
-                                    # Handle part removal, store all component info of the given component PN & REFDES to be deleted
-                                    if partIs == 'NO PLACE' and sPartNumber == partWas and (sREFDES == designator or designator == 'ALL'):
-                                        log.debug(f"Storing {sREFDES} {ComponentInfo} to be deleted in componentToRemove...")
-                                        componentToRemove.add(ComponentInfo)
-
-                                    # Handle part sub, modify the component part number of the given REFDES
-                                    elif sPartNumber == partWas and (sREFDES == designator or designator == 'ALL'):
-                                        log.info(f"Modifying {sREFDES} componenet part number from {partWas} to {partIs} ...")
-                                        ComponentInfo.attrib['partNumber'] = ComponentInfo.attrib['partNumber'].replace(partWas, partIs)
-
-                            # Handle part removal, delete all component in componentToRemove
-                            for item in componentToRemove:
-                                log.info(f"Deleting {item} in componentToRemove...")
-                                BoardInfo.remove(item)
-                            componentToRemove = set()
-
-                        if len(all_designator) > 0:
-                            log.info(f"Replacing designatorList with all_designator = {all_designator} ...")
-                            designatorList = all_designator
-
-                        elif len(check_designator) > 0:
-                            log.info('Checking if all designators are included...')
-                            for designator in designatorList:
-                                if designator != 'ALL':
-                                    try:
-                                        check_designator.remove(designator)
-                                    except:
-                                        pass
-                            if len(check_designator) > 0:
-                                log.info(f"Not all designators are included, non-impacted designator = {check_designator}")
-                            else:
-                                log.info('All designators are included.')
-
-                        for SegmentInfo in root.iter(f"{pp_url}Segment"):
-                            for ProcessingInfo in SegmentInfo.iter(f"{pp_url}Processing"):
-                                for BoardLocationInfo in ProcessingInfo.iter(f"{pp_url}BoardLocation"):
-                                    for ActionInfo in BoardLocationInfo.iter(f"{pp_url}Action"):
-                                        for PickInfo in ActionInfo.iter(f"{pp_url}Pick"):
-                                            sREFDES = PickInfo.attrib.get('refDes')
-                                            sRobotNumber = PickInfo.attrib.get('robotNumber')
-                                            sHeadNumber = PickInfo.attrib.get('headNumber')
-
-                                            for designator in designatorList:
-                                                if partIs == 'NO PLACE' and sREFDES == designator:
-                                                    # Handle part removal, store action info to be deleted in actionToRemove
-                                                    log.debug(f"Storing {sREFDES} action with {PickInfo} in actionToRemove...")
-                                                    actionToRemove.add(ActionInfo)
-
-                                                    # Handle part removal, store robot and head to be deleted in robotHeadToRemove
-                                                    robotHeadToRemove.add((sRobotNumber, sHeadNumber))
-                                                    log.debug(f"Set of (RobotNumber, HeadNumber) to be removed = {robotHeadToRemove}.")
-
-                                            # Store feeder for non-impacted designator into feeder_whitelist
-                                            for non_impacted_designator in check_designator:
-                                                if sREFDES == non_impacted_designator:
-                                                    log.debug(f"Storing {sREFDES} Section {sSectionNumber}, Feeder {sFeederNumber}, Lane {sLaneNumber} into feeder_whitelist...")
-                                                    feeder_whitelist.add((sSectionNumber, sFeederNumber, sLaneNumber))
-
-                                    if len(robotHeadToRemove) > 0:
-                                        for ActionInfo in BoardLocationInfo.iter(f"{pp_url}Action"):
-                                            for AlignInfo in ActionInfo.iter(f"{pp_url}Align"):
-                                                for robotHead in robotHeadToRemove:
-                                                    if AlignInfo.attrib.get('robotNumber') == robotHead[0] and AlignInfo.attrib.get('headNumber') == robotHead[1]:
-                                                        # Handle part removal, store action info to be deleted in actionToRemove
-                                                        log.debug(f"Storing action with {AlignInfo} in actionToRemove...")
-                                                        actionToRemove.add(ActionInfo)
-
-                                            for PlaceInfo in ActionInfo.iter(f"{pp_url}Place"):
-                                                for robotHead in robotHeadToRemove:
-                                                    if PlaceInfo.attrib.get('robotNumber') == robotHead[0] and PlaceInfo.attrib.get('headNumber') == robotHead[1]:
-                                                        # Handle part removal, store action info to be deleted in actionToRemove
-                                                        log.debug(f"Storing action with {PlaceInfo} in actionToRemove...")
-                                                        actionToRemove.add(ActionInfo)
-
-                                    # Handle part removal, delete items in actionToRemove
-                                    for item in actionToRemove:
-                                        log.info(f"Deleting {item} in actionToRemove...")
-                                        BoardLocationInfo.remove(item)
-                                    actionToRemove = set()
-
-                            for SetupInfo in SegmentInfo.iter(f"{pp_url}Setup"):
-                                for FeedSectionInfo in SetupInfo.iter(f"{pp_url}FeedSection"):
-                                    sSectionNumber = FeedSectionInfo.attrib.get('number')
-                                    for FeederInfo in FeedSectionInfo.iter(f"{pp_url}Feeder"):
-                                        sFeederNumber = FeederInfo.attrib.get('slotNumber')
-                                        for LaneInfo in FeederInfo.iter(f"{pp_url}FeederLane"):
-                                            sLaneNumber = LaneInfo.attrib.get('number')
-                                            sPartNumber = LaneInfo.attrib.get('partNumber')
-
-                                            # Handle part removal, store all feeder info in feederToRemove
-                                            if partIs == 'NO PLACE' and sPartNumber == partWas:
-                                                if len(check_designator) <= 0:
-                                                    log.info('All designators included, good to delete the feeder.')
-                                                    log.debug(f"Storing {sPartNumber} {FeederInfo} to be deleted in feederToRemove...")
-                                                    feederToRemove.add(FeederInfo)
-                                                else:
-                                                    log.info('Not all designators are included, checking if the feeder is used on any non-impacted designator before deleting...')
-                                                    # Skip if the feeder is used on any non-impacted designator
-                                                    if (sSectionNumber, sFeederNumber, sLaneNumber) in feeder_whitelist:
-                                                        log.debug(f"Skipping {sPartNumber}, Section {sSectionNumber}, Feeder {sFeederNumber}, Lane {sLaneNumber} to be deleted.")
-                                                    else:
-                                                        log.debug(f"Feeder only used in impacted_designator, storing {sPartNumber}, Section {sSectionNumber}, Feeder {sFeederNumber}, Lane {sLaneNumber} {FeederInfo} to be deleted in feederToRemove...")
-                                                        feederToRemove.add(FeederInfo)
-
-                                            # Handle part sub, modify the feeder lane part number
-                                            elif sPartNumber == partWas:
-                                                if len(check_designator) <= 0:
-                                                    log.info('All designators included, good to modify the feeder.')
-                                                    log.info(f"Modifying {FeederInfo} from {partWas} to {partIs} ...")
-                                                    LaneInfo.attrib['partNumber'] = LaneInfo.attrib['partNumber'].replace(partWas, partIs)
-                                                else:
-                                                    log.info('Not all designators are included, checking if the feeder is used on any non-impacted designator before modifying...')
-                                                    # Skip if the feeder is used on any non-impacted designator
-                                                    if (sSectionNumber, sFeederNumber, sLaneNumber) in feeder_whitelist:
-                                                        raise AssertionError(f"Same feeder is sharing for impacted and non-impacted designators, unable to modify feeder, force skipping CBID = {df_input.loc[i, 'CBID']} !")
-                                                    else:
-                                                        log.info(f"Modifying {FeederInfo} from {partWas} to {partIs} ...")
-                                                        LaneInfo.attrib['partNumber'] = LaneInfo.attrib['partNumber'].replace(partWas, partIs)
-
-                                    # Handle part removal, delete all feeder in feederToRemove
-                                    for item in feederToRemove:
-                                        log.info(f"Deleting {item} in feederToRemove...")
-                                        FeedSectionInfo.remove(item)
-                                    feederToRemove = set()
-
-
-                    # Handle .pp file
-                    elif file_ext.lower() == 'pp':
-
-                        pp_url = '{http://api.assembleon.com/pp/v2}'
-                        log.debug(f"Setting pp_url to {pp_url}...")
-
-                        feeder_whitelist, check_designator, all_designator, componentToRemove, feederToRemove, actionToRemove = set(), set(), set(), set(), set(), set()
-                        for BoardInfo in root.iter(f"{pp_url}Board"):
-
-                            # Modify program names for the 1st time processing the file only
-                            if j == 0:
-                                sPROGRAM_NAME = BoardInfo.attrib.get('id')
-                                sPROGRAM_NAME_NEW = f"{sPROGRAM_NAME}-{df_input.loc[i, 'CBID']}"
-                                log.info(f"Modifying program name from {sPROGRAM_NAME} to {sPROGRAM_NAME_NEW} ...")
-                                BoardInfo.attrib['id'] = BoardInfo.attrib['id'].replace(sPROGRAM_NAME, sPROGRAM_NAME_NEW)
-
-                            for ComponentInfo in BoardInfo.iter(f"{pp_url}Component"):
-                                sPartNumber = ComponentInfo.attrib.get('partNumber')
-                                sREFDES = ComponentInfo.attrib.get('refDes')
-                                if sPartNumber == partWas and 'ALL' in designatorList: 
-                                    log.debug(f"Adding {sREFDES} into all_designator...")
-                                    all_designator.add(sREFDES)
-
-                                elif sPartNumber == partWas and 'ALL' not in designatorList:
-                                    log.debug(f"Adding {sREFDES} into check_designator...")
-                                    check_designator.add(sREFDES)
-                                
-                                for designator in designatorList:
-
-                                    # Handle part removal, store all component info of the given component PN & REFDES to be deleted
-                                    if partIs == 'NO PLACE' and sPartNumber == partWas and (sREFDES == designator or designator == 'ALL'):
-                                        log.debug(f"Storing {sREFDES} {ComponentInfo} to be deleted in componentToRemove...")
-                                        componentToRemove.add(ComponentInfo)
-
-                                    # Handle part sub, modify the component part number of the given REFDES
-                                    elif sPartNumber == partWas and (sREFDES == designator or designator == 'ALL'):
-                                        log.info(f"Modifying {sREFDES} componenet part number from {partWas} to {partIs} ...")
-                                        ComponentInfo.attrib['partNumber'] = ComponentInfo.attrib['partNumber'].replace(partWas, partIs)
-
-                            # Handle part removal, delete all component in componentToRemove
-                            for item in componentToRemove:
-                                log.info(f"Deleting {item} in componentToRemove...")
-                                BoardInfo.remove(item)
-                            componentToRemove = set()
-
-                        if len(all_designator) > 0:
-                            log.info(f"Replacing designatorList with all_designator = {all_designator} ...")
-                            designatorList = all_designator
-
-                        elif len(check_designator) > 0:
-                            log.info('Checking if all designators are included...')
-                            for designator in designatorList:
-                                if designator != 'ALL':
-                                    try:
-                                        check_designator.remove(designator)
-                                    except:
-                                        pass
-                            if len(check_designator) > 0:
-                                log.info(f"Not all designators are included, non-impacted designator = {check_designator}")
-                            else:
-                                log.info('All designators are included.')
-
-                        # Each section has 4 robots, total 5 sections with 20 robots, each with 1 head
-                        sHeadNumber = '1'
-                        robots_per_section = 4
-                        section_number = 1
-                        for a, ActionInfo in enumerate(root.iter(f"{pp_url}Actions")):
-                            sSectionNumber = str(int(section_number))
-                            if (a+1) % robots_per_section == 0:
-                                section_number += 1
-                            for IndexInfo in ActionInfo.iter(f"{pp_url}Index"):
-                                # Enumerate to find the group from pick to place (Pick, Align, ReadFiducial, Place)
-                                IndexInfoList = list(IndexInfo)
-                                for k, IndexItem in enumerate(IndexInfoList):
-
-                                    # Start whenever pick tag is found
-                                    if IndexItem.tag == f"{pp_url}Pick":
-                                        sREFDES = IndexItem.attrib.get('refDes')
-                                        sFeederNumber = IndexItem.attrib.get('feederNumber')
-                                        sLaneNumber = IndexItem.attrib.get('laneNumber')
-
-                                        for designator in designatorList:
-                                            # Handle part removal, store pick info in actionToRemove
-                                            if partIs == 'NO PLACE' and sREFDES == designator:
-                                                log.debug(f"Storing {sREFDES} {IndexItem} to be deleted in actionToRemove...")
-                                                actionToRemove.add(IndexItem)
-
-                                                # Handle part removal, store all subsequent tag after pick to place in actionToRemove
-                                                y = k+1
-                                                while y<len(IndexInfoList):
-                                                    log.debug(f"Storing {sREFDES} {IndexInfoList[y]} to be deleted in actionToRemove...")
-                                                    actionToRemove.add(IndexInfoList[y])
-
-                                                    # Break if place tag is found
-                                                    if IndexInfoList[y].tag == f"{pp_url}Place":
-                                                        break
-                                                    
-                                                    y+=1
-                                        
-                                        # Store feeder for non-impacted designator into feeder_whitelist
-                                        for non_impacted_designator in check_designator:
-                                            if sREFDES == non_impacted_designator:
-                                                log.debug(f"Storing {sREFDES}, Section {sSectionNumber}, Feeder {sFeederNumber}, Lane {sLaneNumber} into feeder_whitelist...")
-                                                feeder_whitelist.add((sSectionNumber, sFeederNumber, sLaneNumber))
-
-                                # Handle part removal, delete items in actionToRemove
-                                for item in actionToRemove:
-                                    try:
-                                        log.info(f"Deleting {item} in actionToRemove...")
-                                        IndexInfo.remove(item)
-                                    except:
-                                        # Skip item with no speciied info in it
-                                        pass
-                                actionToRemove = set()
-
-                        for SectionInfo in root.iter(f"{pp_url}Section"):
-                            sSectionNumber = SectionInfo.attrib.get('number')
-                            for TrolleyInfo in SectionInfo.iter(f"{pp_url}Trolley"):
-                                for FeederInfo in TrolleyInfo.iter(f"{pp_url}Feeder"):
-                                    sFeederNumber = FeederInfo.attrib.get('number')
-                                    for LaneInfo in FeederInfo.iter(f"{pp_url}Lane"):
-                                        sLaneNumber = LaneInfo.attrib.get('number')
-                                        sPartNumber = LaneInfo.attrib.get('partNumber')
-
-                                        # Handle part removal, store all feeder info in feederToRemove
-                                        if partIs == 'NO PLACE' and sPartNumber == partWas:
-                                            if len(check_designator) <= 0:
-                                                log.info('All designators included, good to delete the feeder.')
-                                                log.debug(f"Storing {sPartNumber} {FeederInfo} to be deleted in feederToRemove...")
-                                                feederToRemove.add(FeederInfo)
-                                            else:
-                                                log.info('Not all designators are included, checking if the feeder is used on any non-impacted designator before deleting...')
-                                                # Skip if the feeder is used on any non-impacted designator
-                                                if (sSectionNumber, sFeederNumber, sLaneNumber) in feeder_whitelist:
-                                                    log.debug(f"Skipping {sPartNumber}, Section {sSectionNumber}, Feeder {sFeederNumber}, Lane {sLaneNumber} to be deleted.")
-                                                else:
-                                                    log.debug(f"Feeder only used in impacted_designator, storing {sPartNumber}, Section {sSectionNumber}, Feeder {sFeederNumber}, Lane {sLaneNumber} {FeederInfo} to be deleted in feederToRemove...")
-                                                    feederToRemove.add(FeederInfo)
-
-                                        # Handle part sub, modify the feeder lane part number
-                                        elif sPartNumber == partWas:
-                                            if len(check_designator) <= 0:
-                                                log.info('All designators included, good to modify the feeder.')
-                                                log.info(f"Modifying {FeederInfo} from {partWas} to {partIs} ...")
-                                                LaneInfo.attrib['partNumber'] = LaneInfo.attrib['partNumber'].replace(partWas, partIs)
-                                            else:
-                                                log.info('Not all designators are included, checking if the feeder is used on any non-impacted designator before modifying...')
-                                                # Skip if the feeder is used on any non-impacted designator
-                                                if (sSectionNumber, sFeederNumber, sLaneNumber) in feeder_whitelist:
-                                                    raise AssertionError(f"Same feeder is sharing for impacted and non-impacted designators, unable to modify feeder, force skipping CBID = {df_input.loc[i, 'CBID']} !")
-                                                else:
-                                                    log.info(f"Modifying {FeederInfo} from {partWas} to {partIs} ...")
-                                                    LaneInfo.attrib['partNumber'] = LaneInfo.attrib['partNumber'].replace(partWas, partIs)
-
-                                # Handle part removal, delete all feeder in feederToRemove
-                                for item in feederToRemove:
-                                    log.info(f"Deleting {item} in feederToRemove...")
-                                    TrolleyInfo.remove(item)
-                                feederToRemove = set()
-
-
-                # Make output folder
-                output_folder = f"{path_main}\\recipe-swr\\{df_input.loc[i, 'CBID']}"
-                if not os.path.exists(output_folder):
-                    log.info(f"Making folder = {output_folder} ...")
-                    os.makedirs(output_folder)
-                output_path = f"{output_folder}\\{filename_without_ext}-{df_input.loc[i, 'CBID']}.{file_ext}"
-                log.info(f"Writing into {output_path}...")
-
-                # Write output .pp
-                if file_ext.lower() == 'pp':
-                    log.info('Writing output .pp and .pp7 files...')
-                    with open(f"{output_path}", 'wb') as f:
-                        prstree.write(f, method='xml', xml_declaration=True, encoding='utf-8')
-                        f.close()
-
-                    with open(f"{output_path}", 'r') as f:
-                        data = f.read().replace(' />', '/>').replace('''<?xml version='1.0' encoding='utf-8'?>''', '''<?xml version="1.0"?>''').replace('''<Model>\n				<General>''', '''<Model xmlns="" xmlns:ns2="http://api.assembleon.com/pp/v2">\n				<General>''').replace('''</PlacementProgram>''', '''</PlacementProgram>\n''')
-                        f.close()
-                        
-                    with open(f"{output_path}", 'w') as f:
-                        f.write(data)
-                        f.close()
-                
-                # Write output .pp7
-                if file_ext.lower() == 'pp7':
-                    with open(f"{output_path}", 'wb') as f:
-                        prstree.write(f, method='xml', xml_declaration=False)
-                        f.close()
-
-                    with open(f"{output_path}", 'r') as f:
-                        data = f.read().replace(' />', '/>').replace('''</PlacementProgram>''', '''</PlacementProgram>\n''')
-                        f.close()
-                        
-                    with open(f"{output_path}", 'w') as f:
-                        f.write(data)
-                        f.close()
-
-                # Write output .pp7.zip
-                if file_ext.lower() == 'pp7.zip' and zipfile.is_zipfile(file):
-                    log.info('Writing output .pp7.zip files...')
-                    old_filename_list = [partWas + '.PRT' for partWas in partWasList]
-                    new_filename_list = [partIs + '.PRT' for partIs in partIsList]
-                    data_dict = {}
-                    with zipfile.ZipFile(file, mode='r') as zin:
-                        with zipfile.ZipFile('tmp.zip', mode='w', compression=zipfile.ZIP_DEFLATED) as zout:
-                            zout.comment = zin.comment # preserve the comment
-                            for item in zin.infolist():
-                                if item.filename[-4:].lower() == '.pp7':
-                                    pass
-                                elif item.filename not in old_filename_list:
-                                    # write the unchanged file
-                                    zout.writestr(item, zin.read(item.filename))
-                                else:
-                                    # read and replace old to new text
-                                    for n in range(len(old_filename_list)):
-                                        if item.filename.upper() == old_filename_list[n] and partWasList[n].upper() != 'NO PLACE' and partIsList[n].upper() != 'NO PLACE':
-                                            data_dict[new_filename_list[n]] = zin.read(item.filename).decode(encoding='utf-8').replace(partWasList[n], partIsList[n])
-                            zout.close()
-                        zin.close()
-
-                    # replace tmp to new_zip
-                    if os.path.exists(output_path):
-                        delete_file(output_path)
-                    os.rename('tmp.zip', output_path)
-
-                    # write new data to new_zip
-                    with zipfile.ZipFile(output_path, mode='a', compression=zipfile.ZIP_DEFLATED) as zf:
-                        for f, d in data_dict.items():
-                            zf.writestr(f, d)
-                        try:
-                            zf.write(output_path.replace('.zip', ''), output_path.replace('.zip', '').rsplit('\\', 1)[-1])
-                        except FileNotFoundError:
-                            raise AssertionError ('.pp7.zip files are provided, but .pp7 files are missing. Do extract and provide .pp7 together with .pp7.zip files.')
-                        zf.close()
+                raise AssertionError(f"NO PLACE is found in partWasList, unable to handle part addition, force skipping CBID = {rows[i]['CBID']} !")
+
+            # Skip the CBID if its SWR row and bom programs are unchanged since the last run, and its outputs are intact
+            # (validate-only mode checks all rows)
+            if plans is None:
+                with metrics.span('manifest', rows[i]['CBID']):
+                    key = manifest.cbid_key([rows[i]['CBID'], selected_program, partIsList, partWasList, designatorsList], file_program)
+                    current = not force and manifest.is_current(rows[i]['CBID'], key)
+                if current:
+                    log.info(f"CBID = {rows[i]['CBID']} is unchanged since the last run, skipping...")
+                    manifest.skipped += 1
+                    metrics.count('cbids_skipped')
+                    status[rows[i]['CBID']] = 'skipped'
+                    continue
+                manifest.discard(rows[i]['CBID'])
+
+            log.info(f"Total of {len(designatorsList)} line item(s) to be processed for CBID = {rows[i]['CBID']}.")
+
+            # Parse designators into their ranges once for all matched file_program
+            lineItems = []
+            for j in range(len(designatorsList)):
+                partIs, partWas, designators = partIsList[j].strip().upper(), partWasList[j].strip().upper(), designatorsList[j].strip().upper()
+
+                log.info(f"Expanding and spliting {designators} ...")
+                try:
+                    with metrics.span('expand', rows[i]['CBID']):
+                        designatorList = DesignatorRanges(designators)
+                except ValueError:
+                    raise AssertionError(f"Designators {designators} not expanded and contains '-', force skipping CBID = {rows[i]['CBID']} !")
+
+                log.info(f"designatorList = {designatorList}, {len(designatorList)} designator(s)")
+                lineItems.append((partIs, partWas, designatorList))
+
+            # Validate matched file_program only, process them now, or queue them as (CBID, program files) jobs for the process pool
+            if plans is not None:
+                with nullcontext() if profiler is None else profiler.job(rows[i]['CBID']):
+                    plans[rows[i]['CBID']] = plan_files(log, program_cache, rows[i]['CBID'], file_program, lineItems, metrics)
+                status[rows[i]['CBID']] = plans[rows[i]['CBID']]['status']
+            elif workers > 1:
+                from utils.swr_pool import group_program_files, job_size
+                for files in group_program_files(file_program):
+                    jobs.append((rows[i]['CBID'], (path_recipe_swr, rows[i]['CBID'], files, lineItems, partIsList, partWasList, stream), job_size(files)))
+                job_keys[rows[i]['CBID']] = key
+            else:
+                if budget is not None:
+                    budget.admit(program_cache)
+                try:
+                    with nullcontext() if profiler is None else profiler.job(rows[i]['CBID']):
+                        process_files(log, program_cache, path_recipe_swr, rows[i]['CBID'], file_program, lineItems, partIsList, partWasList, stream, metrics, pipeline, store,
+                                      next_files(position))
+                finally:
+                    if budget is not None:
+                        # Within a memory budget, release the programs no row ahead uses right after their last outputs are written
+                        for file in file_program:
+                            if pending[file] <= 0:
+                                program_cache.discard(file)
+                manifest.record(rows[i]['CBID'], key)
+                metrics.count('cbids_generated')
+                status[rows[i]['CBID']] = 'generated'
+                log.info(f"CBID = {rows[i]['CBID']} is generated with {metrics.cbid_summary(rows[i]['CBID'])}.")
 
         except AssertionError as e:
-            log.warning(f"{str(e)}")
-            output_folder = f"{path_main}\\recipe-swr\\{df_input.loc[i, 'CBID']}"
-            if os.path.exists(output_folder):
-                log.warning(f"Found output folder with warning CBID, deleting {output_folder} ...")
-                delete_file(output_folder)
+            if plans is not None:
+                log.warning(f"{str(e)}")
+                plans[rows[i]['CBID']] = {'status': 'rejected', 'errors': [str(e)], 'files': {}}
+                status[rows[i]['CBID']] = 'rejected'
+                continue
+            cleanup_cbid(log, path_recipe_swr, rows[i]['CBID'], e)
+            metrics.count('cbids_failed')
+            status[rows[i]['CBID']] = 'failed'
             continue
 
+    if len(jobs) > 0:
+        from utils.swr_pool import run_jobs
+        failed = run_jobs(log, functools.partial(process_files, store=store), jobs, workers, settings['CACHE_MAX_MB'], lambda cbid, error: cleanup_cbid(log, path_recipe_swr, cbid, error), metrics,
+                          None if budget is None else budget.max_bytes / 1024 / 1024, profiler)
+        for cbid, key in job_keys.items():
+            if cbid not in failed:
+                manifest.record(cbid, key)
+                status[cbid] = 'generated'
+                log.info(f"CBID = {cbid} is generated with {metrics.cbid_summary(cbid)}.")
+            else:
+                status[cbid] = 'failed'
+        metrics.count('cbids_generated', len(job_keys) - len(failed))
+        metrics.count('cbids_failed', len(failed))
+
+    return status
+
+
+def main(log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings, workers=1, stream=False, force=False, pipeline=False, max_memory=None, validate=False, profile=None, rows=None, dedup=False):
+    '''main, rows already read from the SWR sheet are not read again'''
+    
+    log.info(f"path_recipe_bom = {path_recipe_bom}")
+    log.info(f"path_recipe_swr = {path_recipe_swr}")
+    log.info(f"path_swr = {path_swr}")
+    log.info(f"settings = {settings}")
+    metrics = RunMetrics()
+
+    # Validate-only mode checks the rows in this process, without writing any output
+    plans = None
+    if validate:
+        plans, workers, pipeline = {}, 1, False
+
+    # Keep the cached programs, the read-ahead and the queued writes within the memory budget
+    budget = None
+    if max_memory is not None:
+        from utils.swr_memory import MemoryBudget
+        budget = MemoryBudget(max_memory, log)
+        # Worker processes count against the budget as well, each with its own interpreter and program cache
+        if workers > 1 and budget.max_workers(workers) < workers:
+            log.warning(f"Memory budget of {max_memory} MB fits {budget.max_workers(workers)} worker process(es), running with them instead of {workers}.")
+            workers = budget.max_workers(workers)
+        settings = {**settings, 'CACHE_MAX_MB': min(settings['CACHE_MAX_MB'], max_memory / 2 / max(workers, 1)), 'PIPELINE_MAX_MB': min(settings['PIPELINE_MAX_MB'], max_memory / 4)}
+        log.info(f"Memory budget = {max_memory} MB, settings = {settings}")
+
+    # Profile each CBID job into Log/profile, given the number of top functions to log
+    profiler = None
+    if profile is not None:
+        from utils.swr_profile import SWRProfiler
+        profiler = SWRProfiler(os.path.join(path_log, 'profile'), log, profile)
+
+    # Keep identical outputs once in recipe-swr/.store, hard linked into the CBID folders
+    store = None
+    if dedup and plans is None:
+        from utils.swr_store import OutputStore
+        store = OutputStore(path_recipe_swr)
+
+    rows = read_swr(log, path_swr, metrics, rows)
+
+    program_cache = ProgramCache(settings['CACHE_MAX_MB'], log)
+    with metrics.span('scan'):
+        catalog = RecipeCatalog(path_recipe_bom, os.path.join(path_log, 'recipe_catalog.json') if settings['CATALOG_CACHE'] else None, log)
+    manifest = SWRManifest(path_recipe_swr, log)
+
+    # Read ahead and write behind in a single process only, worker processes keep their own file I/O
+    io_pipeline = None
+    if pipeline and workers <= 1:
+        from utils.swr_pipeline import IOPipeline
+        io_pipeline = IOPipeline(settings['PIPELINE_MAX_MB'])
+    try:
+        run_swr(log, rows, path_recipe_swr, catalog, program_cache, manifest, metrics, settings, workers, stream, force, io_pipeline, budget, plans, profiler, store)
+    finally:
+        if io_pipeline is not None:
+            io_pipeline.close()
+
+    if plans is not None:
+        path_plan = os.path.join(path_log, 'SWR_PROGRAM_CREATE_plan.json')
+        with open(path_plan, 'w', encoding='utf-8') as f:
+            json.dump(plans, f, indent=1)
+        rejected = [cbid for cbid, plan in plans.items() if plan['status'] != 'valid']
+        log.info(f"Plan: {len(plans) - len(rejected)} valid CBID(s), {len(rejected)} rejected or without program file {rejected}, see {path_plan}")
+    else:
+        manifest.save()
+        if manifest.skipped > 0:
+            log.info(f"Manifest: {manifest.skipped} unchanged CBID(s) skipped, run with --force to regenerate them.")
+
+    if workers <= 1:
+        log.info(f"Program cache: {program_cache.misses} program(s) parsed, {program_cache.hits} reused.")
+        if PRT_LIBRARY.misses > 0:
+            log.info(f"PRT library: {PRT_LIBRARY.misses} .PRT payload(s) rewritten, {PRT_LIBRARY.hits} reused.")
+    if budget is not None:
+        log.info(f"Memory budget: cached programs released {budget.releases} time(s), peak resident memory {(peak_rss() or 0) / 1024 / 1024:.0f} MB of {max_memory} MB"
+                 f"{' in the main process, see Worker memory for the workers' if workers > 1 else ''}.")
+    if store is not None:
+        store.log_summary(log, counted=workers <= 1)
+    metrics.log_summary(log)
+    if profiler is not None:
+        profiler.log_summary(log)
+    metrics.write_report(os.path.join(path_log, 'SWR_PROGRAM_CREATE_report.json'), workers=workers, stream=stream, pipeline=pipeline, max_memory_mb=max_memory,
+                         peak_rss_mb=round((peak_rss() or 0) / 1024 / 1024, 1))
     log.info('Successfully completed without any errors!!!')
     log.info('Closing application...')
-    time.sleep(5)
 
     return
 
 
+def parse_args():
+    '''parse command line arguments'''
+    parser = argparse.ArgumentParser(description='Create SWR programs based on bom programs, as per SWR.xlsx')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes to spread (CBID, program file) jobs over, default 1 to run in sequence')
+    parser.add_argument('--stream', action='store_true', help='Rewrite .pp/.pp7 programs while reading them, instead of loading the whole program in memory')
+    parser.add_argument('--force', action='store_true', help='Regenerate all CBIDs, including those unchanged since the last run')
+    parser.add_argument('--pipeline', action='store_true', help='Read bom programs ahead and write outputs behind on threads, overlapping file I/O with processing')
+    parser.add_argument('--max-memory', type=float, default=None, metavar='MB', help='Resident memory budget in MB: caches are sized within it, cached programs are released and new jobs are held back once near it')
+    parser.add_argument('--plan', action='store_true', help='Validate the SWR rows against the bom programs and write a report of the planned changes into Log, without writing any recipe')
+    parser.add_argument('--profile', type=int, nargs='?', const=20, default=None, metavar='TOP', help='Profile each CBID job into Log/profile (pstats and collapsed stacks for flame graphs) and log its TOP functions by own time, default 20')
+    parser.add_argument('--dedup', action='store_true', help='Keep outputs once in recipe-swr/.store, hard linked into the CBID folders, so outputs regenerated unchanged (e.g. with --force) are not written again')
+    parser.add_argument('--swr', default=None, metavar='PATH', help='Swr file to run, with recipe-bom, recipe-swr and Log next to it unless given, instead of SWR.xlsx next to main.py. Runs without pausing before exit')
+    parser.add_argument('--recipe-bom', default=None, metavar='DIR', help='Folder of the bom programs')
+    parser.add_argument('--recipe-swr', default=None, metavar='DIR', help='Folder of the generated SWR programs')
+    parser.add_argument('--log-dir', default=None, metavar='DIR', help='Folder of the log, reports and catalog cache')
+    parser.add_argument('--serve', action='store_true', help='Keep running as a local service, taking SWR jobs over HTTP and watching recipe-bom and the swr file')
+    parser.add_argument('--port', type=int, default=8765, help='Port of the local service, default 8765')
+    parser.add_argument('--watch-interval', type=float, default=2.0, help='Seconds between checks of recipe-bom and the swr file in service mode, default 2')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    # Explicit paths run as a batch command: no pause to read the console before closing, and exit code 1 on errors
+    batch = any(path is not None for path in (args.swr, args.recipe_bom, args.recipe_swr, args.log_dir))
+    log = None
     try:
-        log, path_main, path_recipe_bom, path_recipe_swr, path_swr = init()
-        main(log, path_main, path_recipe_bom, path_recipe_swr, path_swr)
+        log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings, rows = init(args.swr, args.recipe_bom, args.recipe_swr, args.log_dir)
+        if args.serve:
+            from utils.swr_service import SWRService, serve
+            service = SWRService(log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings, read_swr, normalize_swr, run_swr, args.stream)
+            serve(service, args.port, args.watch_interval)
+        else:
+            main(log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings, args.workers, args.stream, args.force, args.pipeline, args.max_memory, args.plan, args.profile, rows, args.dedup)
+            if not batch:
+                time.sleep(5)
 
     except ConnectionAbortedError as e:
         log.error(f"{str(e)}")
-        time.sleep(5)
+        if not batch:
+            time.sleep(5)
         sys.exit(0)
 
     except Exception as e:
+        if log is None:
+            raise
         log.critical('Force exiting application...')
         log.exception(f"Unexpected Error: {str(e)}")
-        time.sleep(5)
\ No newline at end of file
+        if not batch:
+            time.sleep(5)
+        sys.exit(1)
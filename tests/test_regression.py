@@ -0,0 +1,155 @@
+'''
+Regression test of main.run_swr() over the bundled SWR.xlsx and recipe-bom in each mode, against the committed recipe-swr outputs
+Run from the project folder: python -m unittest discover tests
+'''
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import zipfile
+
+from main import read_swr, run_swr
+from utils.recipe_catalog import RecipeCatalog
+from utils.program_cache import ProgramCache
+from utils.swr_manifest import SWRManifest, MANIFEST_FILENAME
+from utils.swr_metrics import RunMetrics
+from utils.swr_store import STORE_FOLDER
+
+PATH_MAIN = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PATH_SWR = os.path.join(PATH_MAIN, 'SWR.xlsx')
+PATH_RECIPE_BOM = os.path.join(PATH_MAIN, 'recipe-bom')
+PATH_REFERENCE = os.path.join(PATH_MAIN, 'recipe-swr')
+
+STATUS = {'123456-EXTRAPLACE': 'failed', '123457-NOPLACE-ALL': 'generated', '123458-NOPLACE-PARTIAL': 'generated',
+          '123459-PARTSUB-ALL': 'generated', '123460-PARTSUB-PARTIAL': 'failed'}
+
+
+def _program_bytes(name, data):
+    '''Programs are written with the platform line ending, the committed ones are compared with LF line endings'''
+    return data.replace(b'\r\n', b'\n') if name.lower().endswith(('.pp', '.pp7')) else data
+
+
+def read_outputs(path_recipe_swr):
+    '''Return {output path relative to recipe-swr: bytes, or [(member name, bytes)] of a zip}, without the manifest and the output store'''
+    outputs = {}
+    for root, folders, files in os.walk(path_recipe_swr):
+        folders[:] = [folder for folder in folders if folder != STORE_FOLDER]
+        for name in files:
+            if name == MANIFEST_FILENAME:
+                continue
+            path = os.path.join(root, name)
+            if name.lower().endswith('.zip'):
+                with zipfile.ZipFile(path) as z:
+                    data = [(info.filename, _program_bytes(info.filename, z.read(info))) for info in z.infolist()]
+            else:
+                with open(path, 'rb') as f:
+                    data = _program_bytes(name, f.read())
+            outputs[os.path.relpath(path, path_recipe_swr)] = data
+    return outputs
+
+
+class RegressionTest(unittest.TestCase):
+    '''Each mode generates the committed recipe-swr outputs, the failed CBIDs leaving no output folder'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.reference = read_outputs(PATH_REFERENCE)
+        cls.log = logging.getLogger('swr_regression')
+        cls.log.addHandler(logging.NullHandler())
+        cls.log.propagate = False
+        cls.log.setLevel(logging.INFO)
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.path_recipe_swr = os.path.join(self.workspace, 'recipe-swr')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+    def run_swr(self, workers=1, stream=False, force=True, pipeline=False, max_memory=None, dedup=False, plans=None):
+        '''Run the bundled SWR.xlsx into the workspace as main.main() does, return {CBID: status}'''
+        metrics = RunMetrics()
+        settings = {'CACHE_MAX_MB': 1024, 'CATALOG_CACHE': False, 'PIPELINE_MAX_MB': 256}
+        rows = read_swr(self.log, PATH_SWR, metrics)
+        catalog = RecipeCatalog(PATH_RECIPE_BOM, None, self.log)
+        program_cache = ProgramCache(settings['CACHE_MAX_MB'], self.log)
+        manifest = SWRManifest(self.path_recipe_swr, self.log)
+
+        budget, store, io_pipeline = None, None, None
+        if max_memory is not None:
+            from utils.swr_memory import MemoryBudget
+            budget = MemoryBudget(max_memory, self.log)
+        if dedup:
+            from utils.swr_store import OutputStore
+            store = OutputStore(self.path_recipe_swr)
+        if pipeline:
+            from utils.swr_pipeline import IOPipeline
+            io_pipeline = IOPipeline(settings['PIPELINE_MAX_MB'])
+        try:
+            status = run_swr(self.log, rows, self.path_recipe_swr, catalog, program_cache, manifest, metrics, settings, workers, stream, force,
+                             io_pipeline, budget, plans, None, store)
+        finally:
+            if io_pipeline is not None:
+                io_pipeline.close()
+        if plans is None:
+            manifest.save()
+        if store is not None:
+            store.prune()
+        return status
+
+    def assertOutputs(self):
+        outputs = read_outputs(self.path_recipe_swr)
+        self.assertEqual(sorted(outputs), sorted(self.reference))
+        for relpath, data in self.reference.items():
+            self.assertTrue(outputs[relpath] == data, f"{relpath} differs from the committed output")
+
+    def test_default(self):
+        # The bom programs are shared by all CBIDs, so their outputs are spliced from the bom program bytes
+        self.assertEqual(self.run_swr(), STATUS)
+        self.assertOutputs()
+
+    def test_unchanged_rerun(self):
+        self.run_swr()
+        status = self.run_swr(force=False)
+        self.assertEqual(status, {cbid: 'skipped' if cbid_status == 'generated' else cbid_status for cbid, cbid_status in STATUS.items()})
+        self.assertOutputs()
+
+    def test_stream(self):
+        self.assertEqual(self.run_swr(stream=True), STATUS)
+        self.assertOutputs()
+
+    def test_pipeline(self):
+        self.assertEqual(self.run_swr(pipeline=True), STATUS)
+        self.assertOutputs()
+
+    def test_workers(self):
+        self.assertEqual(self.run_swr(workers=2), STATUS)
+        self.assertOutputs()
+
+    def test_dedup(self):
+        self.assertEqual(self.run_swr(dedup=True), STATUS)
+        self.assertOutputs()
+        # Regenerated unchanged, the outputs are linked to the stored ones again
+        self.assertEqual(self.run_swr(dedup=True), STATUS)
+        self.assertOutputs()
+
+    def test_max_memory(self):
+        self.assertEqual(self.run_swr(max_memory=512), STATUS)
+        self.assertOutputs()
+
+    def test_combined(self):
+        self.assertEqual(self.run_swr(pipeline=True, dedup=True, max_memory=512), STATUS)
+        self.assertOutputs()
+
+    def test_plan(self):
+        plans = {}
+        status = self.run_swr(plans=plans)
+        self.assertEqual(status, {cbid: 'valid' if cbid_status == 'generated' else 'rejected' for cbid, cbid_status in STATUS.items()})
+        self.assertEqual({cbid: plan['status'] for cbid, plan in plans.items()}, status)
+        self.assertEqual(read_outputs(self.path_recipe_swr), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+'''
+Tests of the line items applied by utils.swr_engine onto an indexed program
+Run from the project folder: python -m unittest discover tests
+'''
+
+import logging
+import unittest
+import xml.etree.ElementTree as ETree
+
+from utils.Common_Functions_64 import DesignatorRanges
+from utils.swr_engine import build_program_index, apply_swr, NO_PLACE, PP7_URL
+
+# U1 and U2 are picked from the lane of feeder slot 1, U3 from the lane of feeder slot 2, all of PART-A
+PP7_SHARED_FEEDER = '''<PlacementProgram xmlns="http://api.assembleon.com/pp7/v1">
+	<Board id="TEST-SD9">
+		<Component partNumber="PART-A" refDes="U1" circuitNumber="1"/>
+		<Component partNumber="PART-A" refDes="U2" circuitNumber="1"/>
+		<Component partNumber="PART-A" refDes="U3" circuitNumber="1"/>
+	</Board>
+	<Segment number="1">
+		<Processing>
+			<BoardLocation>
+				<Action><Pick refDes="U1" circuitNumber="1" feedSectionNumber="1" feederSlotNumber="1" feederLaneNumber="1" robotNumber="1" headNumber="1"/></Action>
+				<Action><Pick refDes="U2" circuitNumber="1" feedSectionNumber="1" feederSlotNumber="1" feederLaneNumber="1" robotNumber="1" headNumber="1"/></Action>
+				<Action><Pick refDes="U3" circuitNumber="1" feedSectionNumber="1" feederSlotNumber="2" feederLaneNumber="1" robotNumber="1" headNumber="2"/></Action>
+			</BoardLocation>
+		</Processing>
+		<Setup>
+			<FeedSection number="1">
+				<Feeder slotNumber="1"><FeederLane number="1" partNumber="PART-A"/></Feeder>
+				<Feeder slotNumber="2"><FeederLane number="1" partNumber="PART-A"/></Feeder>
+			</FeedSection>
+		</Setup>
+	</Segment>
+</PlacementProgram>'''
+
+
+class SharedFeederPP7Test(unittest.TestCase):
+    '''
+    A feeder lane is shared when it feeds a designator not impacted by the line item, read from the feeder of each Pick
+    (feedSectionNumber, feederSlotNumber, feederLaneNumber), not from the last feeder seen in the program
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.log = logging.getLogger('swr_engine_test')
+        cls.log.addHandler(logging.NullHandler())
+        cls.log.propagate = False
+
+    def setUp(self):
+        self.root = ETree.fromstring(PP7_SHARED_FEEDER)
+        self.index = build_program_index(self.root, 'pp7')
+
+    def find(self, tag, **attrib):
+        for node in self.root.iter(f"{PP7_URL}{tag}"):
+            if all(node.attrib.get(name) == value for name, value in attrib.items()):
+                return node
+        raise KeyError(tag)
+
+    def action(self, refDes):
+        '''Action of the Pick of refDes'''
+        for node in self.root.iter(f"{PP7_URL}Action"):
+            if node.find(f"{PP7_URL}Pick").attrib.get('refDes') == refDes:
+                return node
+        raise KeyError(refDes)
+
+    def apply(self, partIs, designators, validate=False):
+        return apply_swr(self.index, 'CB1', [(partIs, 'PART-A', DesignatorRanges(designators))], self.log, validate)
+
+    def test_part_sub_of_shared_feeder(self):
+        # Only the lane of slot 2 still feeds a designator not substituted (U3)
+        with self.assertRaises(AssertionError):
+            self.apply('PART-B', 'U1,U2')
+        plan = self.apply('PART-B', 'U1,U2', validate=True)
+        self.assertEqual(plan.details[0]['feeders_modified'], [('1', '1', '1', '1')])
+        self.assertEqual(plan.details[0]['conflicts'], [('1', '1', '2', '1')])
+        lanes = list(self.root.iter(f"{PP7_URL}FeederLane"))
+        self.assertEqual(plan.attrib[lanes[0]], {'partNumber': 'PART-B'})
+        self.assertNotIn(lanes[1], plan.attrib)
+
+    def test_part_sub_of_all_feeders(self):
+        plan = self.apply('PART-B', 'U1-U3')
+        for refDes in ('U1', 'U2', 'U3'):
+            self.assertEqual(plan.attrib[self.find('Component', refDes=refDes)], {'partNumber': 'PART-B'})
+        for lane in self.root.iter(f"{PP7_URL}FeederLane"):
+            self.assertEqual(plan.attrib[lane], {'partNumber': 'PART-B'})
+
+    def test_no_place_keeps_shared_feeder(self):
+        plan = self.apply(NO_PLACE, 'U1')
+        self.assertIn(self.find('Component', refDes='U1'), plan.removed)
+        self.assertIn(self.action('U1'), plan.removed)
+        self.assertNotIn(self.action('U2'), plan.removed)
+        self.assertNotIn(self.find('Feeder', slotNumber='1'), plan.removed)
+        # The lane of slot 2 feeds U3 only, which is not impacted either
+        self.assertNotIn(self.find('Feeder', slotNumber='2'), plan.removed)
+
+    def test_no_place_removes_unshared_feeder(self):
+        plan = self.apply(NO_PLACE, 'U3')
+        self.assertIn(self.find('Component', refDes='U3'), plan.removed)
+        self.assertIn(self.find('Feeder', slotNumber='2'), plan.removed)
+        self.assertNotIn(self.find('Feeder', slotNumber='1'), plan.removed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,8 @@ from datetime import datetime, timedelta
 import time
 import shutil
 
-import pandas as pd
-from smtplib import SMTP
 import uuid
+from functools import lru_cache
 
 
 def makeDirs(folder):
@@ -201,6 +200,7 @@ def snowflake_merge_statement(stage_table,table,columnListAll,columnListPrimary,
 
 def df_convert_datetime(dataframe,datetime_column_list):
     '''return dataframe with converted datetime'''
+    import pandas as pd
     for column in datetime_column_list:
         dataframe[column] = pd.to_datetime(dataframe[column], errors = 'coerce')
   
@@ -234,6 +234,7 @@ def convert_time(dt_in_Milliseconds):
 def send_email(content,sender,recipient,subject):
     server = 'mail.micron.com'
 
+    from smtplib import SMTP
     from email.mime.text import MIMEText
     from email.mime.multipart import MIMEMultipart
 
@@ -247,98 +248,119 @@ def send_email(content,sender,recipient,subject):
     conn.sendmail(sender, recipient, msg.as_string())
     conn.quit()
 
-def ExpandSeries(String, delimiter = ','):
-    '''Parse string (eg: AB1-AB3,AB6) and expand the alphanumeric series (eg: AB1,AB2,AB3,AB6)'''
-    S = String
-    expanded_S = ''
-    error = False
-    
-    '''skip function if string does not contains dash '''
-    if '-' not in S:
-        return S
-    
+def _SeriesParts(String):
+    '''Split string into its parts as ExpandSeries always did: trimmed, each part and each end of a range starting with chr(1)'''
+    S = String.replace(' ','').replace(',',' ').replace(' -','-').replace('- ','-')
+    S = S.replace(' ',' ' + chr(1)).replace('-','-' + chr(1))
+    return (chr(1) + S).split()
+
+def _ParseRange(Part):
+    '''
+    Parse a dashed part of _SeriesParts (eg: AB1-AB3, AB1-3, R1A-R3A) into (Letter, Letter_ending, Number_len, start, end),
+    Letter starting with chr(1), return None if it is not an ascending range
+    '''
+    First = Part.split('-', 1)[0]
+
+    '''ending letter is everything after the last digit, leading letter is everything up to the last alphabet before it'''
+    n = len(First)
+    while n > 0 and not First[n-1].isdigit():
+        n -= 1
+    m = n
+    while m > 0 and not First[m-1].isalpha():
+        m -= 1
+    if m == 0:
+        return None
+    Letter, Letter_ending = First[:m], First[n:]
+
+    '''remove the leading letter where the part and its last number start, and the ending letter anywhere'''
+    Numbers = Part.replace(Letter,'').replace(Letter_ending,'').split('-', 1)
+    Numbers[1] = Numbers[1].replace(chr(1),'')
     try:
-        '''replace and trim all dash and delimiter, then add special char(1) after each of them'''
-        S = S.replace(' ','').replace(',',' ').replace(' -','-').replace('- ','-')
-        S = S.replace(' ',' ' + chr(1)).replace('-','-' + chr(1))
-        S = chr(1) + S
-        # print(S)
-        
-        '''Split parts into list'''
-        Parts = S.split()
-        
-        '''for each of the splitted part'''
-        for Part in Parts:
-            '''if splitted part contains dash'''
-            if Part.find('-') > -1:
-                
-                '''split dash parts'''
-                DashParts = Part.split("-")
-                
-                '''taking the 1st dash part, reverse it'''
-                reversed_DashPart = DashParts[0][::-1]
-                
-                '''Loop to return ending letter'''
-                for char in range(0,len(reversed_DashPart)):
-                    
-                    ''' scan until it reaches 1st alphabet'''
-                    if (reversed_DashPart[char].isdigit()):
-                        
-                        ''' reverse back the string and return ending letter part '''
-                        Letter_ending = reversed_DashPart[:char][::-1]   
-                        reversed_DashPart_without_ending_letter = reversed_DashPart[char:]
-                        # print(Letter_ending)
-                        # print (reversed_DashPart_without_ending_letter)
-                        break     
-                    
-                '''Loop to return leading letter'''
-                for char in range(0,len(reversed_DashPart_without_ending_letter)):
-                    
-                    ''' scan until it reaches 1st alphabet'''
-                    if (reversed_DashPart_without_ending_letter[char].isalpha()):
-                        
-                        ''' reverse back the string and return leading letter part '''
-                        Letter = reversed_DashPart_without_ending_letter[char:][::-1]          
-                        # print(Letter)
-                        break
-                    
-                '''Remove letter from splitted part and split into list'''
-                Numbers = Part.replace(Letter,'').replace(Letter_ending,'').split('-',1)
-                # print(Numbers)
-                
-                '''Remove chr(1) after dash to handle AB1-3 into AB1,AB2,AB3'''
-                Numbers[1] = Numbers[1].replace(chr(1),'')
-                
-                ''' Get number str length before converting to int '''
-                Number_len = len(Numbers[0])
-                
-                '''it works only if number in ascending, else print error'''
-                if int(Numbers[1]) - int(Numbers[0]) >= 1:
-                    
-                    '''Expand the number series'''
-                    for Number in range(int(Numbers[0]), int(Numbers[1])+1):
-                        
-                        ''' Combining them into final expanded string'''
-                        expanded_S = expanded_S + delimiter + Letter + str(Number).zfill(Number_len) + Letter_ending
-                        
-                else:
-                    # print('Number not in ascending!!!')
-                    error = True
-                    print(f"Error expanding designator: {String}")
-    
-                    
+        start, end = int(Numbers[0]), int(Numbers[1])
+    except ValueError:
+        return None
+    if end - start < 1:
+        return None
+    return Letter, Letter_ending, len(Numbers[0]), start, end
+
+@lru_cache(maxsize=4096)
+def ExpandSeries(String, delimiter = ','):
+    '''
+    Parse string (eg: AB1-AB3,AB6) and expand the alphanumeric series (eg: AB1,AB2,AB3,AB6)
+    Each part is parsed once and the result joined once, so large ranges (eg: C1-C5000) expand in linear time
+    A string with any part not expandable is returned as is, after printing the error
+    '''
+    if '-' not in String:
+        return String
+
+    expanded = []
+    for Part in _SeriesParts(String):
+        if '-' not in Part:
+            expanded.append(Part)
+            continue
+        series = _ParseRange(Part)
+        if series is None:
+            print(f"Error expanding designator: {String}")
+            return String
+        Letter, Letter_ending, Number_len, start, end = series
+        expanded.extend(f"{Letter}{str(Number).zfill(Number_len)}{Letter_ending}" for Number in range(start, end + 1))
+    return delimiter.join(expanded).replace(chr(1),'')
+
+class DesignatorRanges:
+    '''
+    Designators of a designator string (eg: C1-C5000,R7) kept as its ranges, for membership tests without the full expansion
+    Iterating yields the designators of ExpandSeries(String) in order and len() counts them, raise ValueError if it cannot be expanded
+    '''
+
+    def __init__(self, String, delimiter = ','):
+        self.String = String
+        self.parts = []     # designators and (Letter, Letter_ending, Number_len, start, end) ranges, in order
+        self.singles = set()
+        self.ranges = {}    # (Letter, Letter_ending) -> [(Number_len, start, end)]
+        self.count = 0
+        if '-' not in String:
+            self.parts = String.split(delimiter)
+        else:
+            for Part in _SeriesParts(String):
+                if '-' not in Part:
+                    self.parts.append(Part.replace(chr(1),''))
+                    continue
+                series = _ParseRange(Part)
+                if series is None:
+                    raise ValueError(f"Designators {String} cannot be expanded")
+                Letter, Letter_ending, Number_len, start, end = series
+                series = (Letter.replace(chr(1),''), Letter_ending, Number_len, start, end)
+                self.parts.append(series)
+                self.ranges.setdefault(series[:2], []).append(series[2:])
+        for part in self.parts:
+            if isinstance(part, str):
+                self.singles.add(part)
+                self.count += 1
             else:
-                '''if splitted part does not contains dash and directly concat them'''
-                expanded_S = expanded_S + delimiter + Part
-    
-        '''Remove 1st delimter and Remove chr(1)'''
-        expanded_S = expanded_S[len(delimiter)+1:].replace(chr(1),'') 
-        
-    except Exception:
-        error = True
-        print(f"Error expanding designator: {String}")
+                self.count += part[4] - part[3] + 1
 
-    if error == True:
-        expanded_S = String
-    
-    return expanded_S
\ No newline at end of file
+    def __contains__(self, designator):
+        if designator in self.singles:
+            return True
+        for (Letter, Letter_ending), ranges in self.ranges.items():
+            if designator.startswith(Letter) and designator.endswith(Letter_ending) and len(designator) > len(Letter) + len(Letter_ending):
+                Number = designator[len(Letter):len(designator) - len(Letter_ending)]
+                for Number_len, start, end in ranges:
+                    if Number.isascii() and Number.isdigit() and start <= int(Number) <= end and str(int(Number)).zfill(Number_len) == Number:
+                        return True
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, str):
+                yield part
+            else:
+                Letter, Letter_ending, Number_len, start, end = part
+                for Number in range(start, end + 1):
+                    yield f"{Letter}{str(Number).zfill(Number_len)}{Letter_ending}"
+
+    def __repr__(self):
+        return f"DesignatorRanges({self.String!r})"
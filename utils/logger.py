@@ -1,11 +1,16 @@
 import os
+import queue
+import atexit
 import logging
+import logging.handlers
 
 
-def logger_init(filename, folder='logs', mode='a', loglevel='INFO'):
+def logger_init(filename, folder='logs', mode='a', loglevel='INFO', queued=False):
     '''
     init logger
     loglevel examples: ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL]
+    If queued, records are put into a queue and written into file and console by a background listener thread,
+    the listener is kept as logger.listener and stopped (flushing all queued records) at exit
     '''
 
     # Create logs folder if not exists
@@ -29,9 +34,17 @@ def logger_init(filename, folder='logs', mode='a', loglevel='INFO'):
     fh.setFormatter(formatter)
     ch.setFormatter(formatter)
 
-    # Add handler to logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    # Add handler to logger, or to the queue listener
+    if queued:
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, fh, ch, respect_handler_level=True)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        logger.listener = listener
+        listener.start()
+        atexit.register(listener.stop)
+    else:
+        logger.addHandler(fh)
+        logger.addHandler(ch)
 
     # Set loglevel
     if loglevel.upper() == 'DEBUG':
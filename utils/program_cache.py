@@ -0,0 +1,152 @@
+'''Parse-once cache of bom programs, shared across CBIDs of the same run'''
+
+import io
+import os
+from collections import OrderedDict
+import xml.etree.ElementTree as ETree
+
+from utils.swr_engine import build_program_index
+from utils.swr_memory import current_rss
+
+# Resident bytes of a parsed ElementTree and its program index per byte of program file, until measured by a ProgramCache
+# from the resident size grown by its first parse of a program of at least MEASURE_MIN_BYTES (smaller ones are too noisy)
+TREE_BYTES_PER_FILE_BYTE = 10
+MEASURE_MIN_BYTES = 256 * 1024
+
+
+class ProgramCache:
+    '''
+    LRU cache of parsed programs keyed by (path, mtime, size), evicted once max_mb is exceeded
+    get() returns (prstree, index): apply changes via apply_swr(index, ...) and ChangePlan.apply(),
+    then ChangePlan.revert() once written so the cached tree is handed out untouched to the next CBID
+    Cached programs cost their file size times tree_factor, measured once (measured is True) at the first large enough parse
+    The ProgramSplicer of a program splices its outputs without rendering the tree, but is built by rendering it once:
+    it is built at the first use of a program with uses still pending (see expect()), or at its first reuse if they are not known,
+    splicer() returns it if any, call release_splicers() to unmap the bom programs, the splicers are kept for their next uses
+    '''
+
+    def __init__(self, max_mb=1024, log=None):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.log = log
+        self.programs = OrderedDict()   # (path, mtime, size) -> (prstree, index, cost)
+        self.splicers = {}              # (path, mtime, size) -> ProgramSplicer
+        self.pending = None             # path -> uses pending after the current one, see expect()
+        self.total_bytes = 0
+        self.hits, self.misses = 0, 0
+        self.tree_factor, self.measured = TREE_BYTES_PER_FILE_BYTE, False
+
+    def is_cached(self, path):
+        '''True if the given program is cached and not modified since'''
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size) in self.programs
+
+    def get(self, path, file_ext, data=None):
+        '''Return (prstree, index) of the given program, parsing it (from data if already read) only if not cached or modified'''
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+
+        if key in self.programs:
+            self.hits += 1
+            self.programs.move_to_end(key)
+            prstree, index, cost = self.programs[key]
+            if self.log:
+                self.log.debug(f"Reusing cached program {path} ...")
+            if self._splices(key, file_ext, True):
+                self._add_splicer(key, file_ext)
+            return prstree, index
+
+        self.misses += 1
+        self.discard(path)
+        if self.log:
+            self.log.debug(f"Parsing program {path} ...")
+        rss = current_rss() if not self.measured and stat.st_size >= MEASURE_MIN_BYTES else None
+        prstree = ETree.parse(path if data is None else io.BytesIO(data))
+        index = build_program_index(prstree.getroot(), file_ext)
+        if rss is not None:
+            self._measure(current_rss() - rss, stat.st_size)
+
+        cost = int(stat.st_size * self.tree_factor)
+        self.programs[key] = (prstree, index, cost)
+        self.total_bytes += cost
+        if self._splices(key, file_ext, False):
+            self._add_splicer(key, file_ext)
+        self._evict()
+        return prstree, index
+
+    def _measure(self, grown, size):
+        '''Take the resident bytes grown by parsing and indexing a program of size bytes as tree_factor, unless the memory was already held'''
+        if grown <= 0:
+            return
+        self.tree_factor, self.measured = grown / size, True
+        if self.log:
+            self.log.debug(f"Measured {self.tree_factor:.1f} resident bytes of parsed program per byte of program file.")
+
+    def expect(self, pending):
+        '''
+        Set {path: uses pending after the current one} of the programs, kept up to date by the caller (None if not known)
+        The splicer of a program is then built at its first use only if it is used again, none is built for a single use
+        '''
+        self.pending = pending
+
+    def _splices(self, key, file_ext, hit):
+        '''True if the splicer of the program is to be built at this use'''
+        if key in self.splicers or file_ext.lower() not in ('pp', 'pp7'):
+            return False
+        if self.pending is None:
+            return hit
+        return self.pending.get(key[0], 0) > 0
+
+    def splicer(self, path):
+        '''Return the ProgramSplicer of the given cached program, None if not built'''
+        stat = os.stat(path)
+        return self.splicers.get((path, stat.st_mtime_ns, stat.st_size))
+
+    def _add_splicer(self, key, file_ext):
+        from utils.swr_splice import ProgramSplicer
+        prstree, index, cost = self.programs[key]
+        try:
+            splicer = ProgramSplicer(key[0], prstree.getroot(), file_ext)
+        except ValueError as e:
+            if self.log:
+                self.log.debug(f"Unable to splice {key[0]}, rendering its outputs instead: {str(e)}")
+            return
+        self.splicers[key] = splicer
+        self.programs[key] = (prstree, index, cost + splicer.nbytes)
+        self.total_bytes += splicer.nbytes
+        self._evict()
+
+    def _drop(self, key):
+        self.total_bytes -= self.programs.pop(key)[2]
+        splicer = self.splicers.pop(key, None)
+        if splicer is not None:
+            splicer.close()
+
+    def discard(self, path):
+        '''Drop the cached entries of the given path, outdated or changed by a failed CBID'''
+        for key in [key for key in self.programs if key[0] == path]:
+            self._drop(key)
+
+    def _evict(self):
+        '''Evict least recently used programs until within max_bytes, always keeping the latest one'''
+        while self.total_bytes > self.max_bytes and len(self.programs) > 1:
+            key = next(iter(self.programs))
+            self._drop(key)
+            if self.log:
+                self.log.debug(f"Evicting cached program {key[0]} ...")
+
+    def shrink(self, max_bytes):
+        '''Cap the cache to max_bytes, evicting least recently used programs, the latest one is kept'''
+        self.max_bytes = int(max_bytes)
+        self._evict()
+
+    def release_splicers(self):
+        '''Unmap all bom programs, so they can be updated, their splicers map them again at their next use without rendering them'''
+        for splicer in self.splicers.values():
+            splicer.unmap()
+
+    def clear(self):
+        for splicer in self.splicers.values():
+            splicer.close()
+        self.splicers.clear()
+        self.programs.clear()
+        self.total_bytes = 0
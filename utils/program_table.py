@@ -0,0 +1,87 @@
+'''Columnar tables of an indexed placement program, for the feeder and robot/head queries of the engine'''
+
+from array import array
+from bisect import bisect_left
+
+
+class ProgramTable:
+    '''
+    Picks and .pp7 Align/Place actions of a program as parallel int columns, their refDes, feeder and (robot, head) interned once
+    Rows are appended while the program is indexed, then freeze() groups the picks by feeder key and the actions by (robot, head)
+    and board location, so each query reads a contiguous range of rows instead of walking the elements
+    Rows are linked back to their XML nodes, the columns reflect the program as parsed
+    '''
+
+    def __init__(self):
+        self.codes = {}                 # interned value -> code
+        self.pick_feeder, self.pick_refdes = array('i'), array('i')
+        self.pick_nodes = []            # first node of each pick
+        self.action_head, self.action_location = array('i'), array('i')
+        self.action_nodes, self.action_parents = [], []
+        self.feeder_rows = {}           # feeder code -> (start, stop) of its picks, once frozen
+        self.head_rows = {}             # (robot, head) code -> (start, stop) of its actions by board location, once frozen
+
+    def intern(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+        return code
+
+    def add_pick(self, feeder, refDes, node):
+        self.pick_feeder.append(self.intern(feeder))
+        self.pick_refdes.append(self.intern(refDes))
+        self.pick_nodes.append(node)
+
+    def add_action(self, robotHead, location, node, parent):
+        self.action_head.append(self.intern(robotHead))
+        self.action_location.append(location)
+        self.action_nodes.append(node)
+        self.action_parents.append(parent)
+
+    @staticmethod
+    def _group(group, order, columns):
+        '''Reorder the columns by the sort key order and return {group code: (start, stop)} of the reordered group column'''
+        rows = sorted(range(len(group)), key=order)
+        for column in columns:
+            reordered = [column[row] for row in rows]
+            column[:] = array(column.typecode, reordered) if isinstance(column, array) else reordered
+        ranges = {}
+        start = 0
+        for row in range(1, len(group) + 1):
+            if row == len(group) or group[row] != group[start]:
+                ranges[group[start]] = (start, row)
+                start = row
+        return ranges
+
+    def freeze(self):
+        '''Group the rows appended, to be called once the program is indexed'''
+        feeder = self.pick_feeder
+        self.feeder_rows = self._group(feeder, feeder.__getitem__, (self.pick_feeder, self.pick_refdes, self.pick_nodes))
+        head, location = self.action_head, self.action_location
+        self.head_rows = self._group(head, lambda row: (head[row], location[row]), (self.action_head, self.action_location, self.action_nodes, self.action_parents))
+
+    def shared(self, keys, designators, removed=()):
+        '''Feeder keys among keys which feed any of the designators, through a pick whose first node is not in removed'''
+        shared = set()
+        refdes = {self.codes[designator] for designator in designators if designator in self.codes}
+        if len(refdes) < 1:
+            return shared
+        for key in keys:
+            rows = self.feeder_rows.get(self.codes.get(key))
+            if rows is None:
+                continue
+            for row in range(*rows):
+                if self.pick_refdes[row] in refdes and self.pick_nodes[row] not in removed:
+                    shared.add(key)
+                    break
+        return shared
+
+    def head_actions(self, first_locations):
+        '''Yield ((robot, head), action, board location node) of the actions on each (robot, head) of {(robot, head): board location} from that location onward'''
+        for robotHead, location in first_locations.items():
+            rows = self.head_rows.get(self.codes.get(robotHead))
+            if rows is None:
+                continue
+            start, stop = rows
+            for row in range(bisect_left(self.action_location, location, start, stop), stop):
+                yield robotHead, self.action_nodes[row], self.action_parents[row]
@@ -0,0 +1,129 @@
+'''Catalog of bom program files in recipe-bom, built once per run and optionally persisted across runs'''
+
+import os
+import json
+from bisect import bisect_right
+
+CATALOG_VERSION = 1
+
+
+def is_program_file(name):
+    '''.pp, .pp7 or .pp7.zip, in any case'''
+    return name[-3:].lower() == '.pp' or name[-4:].lower() == '.pp7' or name[-8:].lower() == '.pp7.zip'
+
+
+class RecipeCatalog:
+    '''
+    Map program file names to their paths under path_recipe_bom, resolved by substring of the name
+    If cache_path is given, the catalog is saved there and reused while none of the directories is modified
+    (a directory mtime changes whenever an entry is added, removed or renamed in it)
+    '''
+
+    def __init__(self, path_recipe_bom, cache_path=None, log=None):
+        self.path_recipe_bom = path_recipe_bom
+        self.cache_path = cache_path
+        self.log = log
+        self.files = []         # [(name, path)] sorted by name
+        self.dirs = {}          # directory path -> st_mtime_ns
+        self._names = ''        # all names joined by '\n', searched as one string
+        self._offsets = []      # start offset of each name in _names
+        self._matches = {}      # matcher -> [path]
+
+        if not self._load():
+            self._scan()
+            self._save()
+        self._build_index()
+
+    def _scan(self):
+        '''Recursively call scandir inclusive of subfolders'''
+        if self.log:
+            self.log.debug(f"Scanning {self.path_recipe_bom} for program files...")
+        files = []
+
+        def scan_dir_file(path):
+            self.dirs[path] = os.stat(path).st_mtime_ns
+            for f in os.scandir(path):
+                if f.is_file() and is_program_file(f.name):
+                    files.append((f.name, f.path))
+                elif f.is_dir():
+                    scan_dir_file(f.path)
+
+        self.dirs = {}
+        scan_dir_file(self.path_recipe_bom)
+        self.files = sorted(files)
+
+    def _load(self):
+        '''Load the persisted catalog, return False if missing, outdated or any directory is modified'''
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] != CATALOG_VERSION or data['root'] != self.path_recipe_bom:
+                return False
+            for path, mtime in data['dirs'].items():
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+
+        self.dirs = data['dirs']
+        self.files = [tuple(item) for item in data['files']]
+        if self.log:
+            self.log.debug(f"Reusing program catalog {self.cache_path} ...")
+        return True
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': CATALOG_VERSION, 'root': self.path_recipe_bom, 'dirs': self.dirs, 'files': self.files}, f)
+        except OSError as e:
+            if self.log:
+                self.log.warning(f"Unable to save program catalog {self.cache_path}: {str(e)}")
+
+    def _build_index(self):
+        offsets, offset = [], 0
+        for name, path in self.files:
+            offsets.append(offset)
+            offset += len(name) + 1
+        self._names = '\n'.join(name for name, path in self.files)
+        self._offsets = offsets
+        self._matches = {}
+        if self.log:
+            self.log.info(f"Program catalog: {len(self.files)} program file(s) in {len(self.dirs)} folder(s).")
+
+    def _find(self, matcher):
+        '''Return paths of all files whose name contains matcher'''
+        if matcher not in self._matches:
+            found = []
+            if matcher and '\n' not in matcher:
+                # Names have no '\n', so a match never spans two names; jump to the next name once found
+                start = self._names.find(matcher)
+                while start >= 0:
+                    n = bisect_right(self._offsets, start) - 1
+                    found.append(self.files[n][1])
+                    start = self._names.find(matcher, self._offsets[n] + len(self.files[n][0]) + 1)
+            elif matcher == '':
+                found = [path for name, path in self.files]
+            self._matches[matcher] = found
+        return self._matches[matcher]
+
+    def is_outdated(self):
+        '''True if any directory of the catalog is modified or removed since it was scanned'''
+        for path, mtime in self.dirs.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def match(self, matchers):
+        '''Return sorted paths of program files whose name contains any of the matchers'''
+        file_program = set()
+        for matcher in matchers:
+            if isinstance(matcher, str):
+                file_program.update(self._find(matcher))
+        return sorted(file_program)
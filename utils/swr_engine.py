@@ -0,0 +1,347 @@
+'''Indexed transform engine to apply all SWR line items of a CBID onto a parsed .pp/.pp7 program'''
+
+import logging
+
+from utils.program_table import ProgramTable
+
+
+PP_URL = '{http://api.assembleon.com/pp/v2}'
+PP7_URL = '{http://api.assembleon.com/pp7/v1}'
+NO_PLACE = 'NO PLACE'
+
+# Each .pp section has 4 robots, total 5 sections with 20 robots, each with 1 head
+ROBOTS_PER_SECTION = 4
+
+
+class Component:
+    '''Board/Component indexed by partNumber'''
+    __slots__ = ('node', 'parent', 'refDes', 'partNumber')
+
+    def __init__(self, node, parent, refDes, partNumber):
+        self.node, self.parent, self.refDes, self.partNumber = node, parent, refDes, partNumber
+
+
+class Pick:
+    '''Pick indexed by refDes, nodes are removed together with the pick (pp: Pick..Place group, pp7: enclosing Action)'''
+    __slots__ = ('nodes', 'parent', 'refDes', 'feeder', 'robotHead', 'location')
+
+    def __init__(self, nodes, parent, refDes, feeder, robotHead=None, location=None):
+        self.nodes, self.parent, self.refDes, self.feeder = nodes, parent, refDes, feeder
+        self.robotHead, self.location = robotHead, location
+
+
+class Lane:
+    '''Feeder lane indexed by partNumber, key is the (section, feeder, lane) it sits on'''
+    __slots__ = ('node', 'feeder', 'parent', 'key', 'partNumber')
+
+    def __init__(self, node, feeder, parent, key, partNumber):
+        self.node, self.feeder, self.parent, self.key, self.partNumber = node, feeder, parent, key, partNumber
+
+
+class ProgramIndex:
+    '''Indexes of a placement program, built once per parsed file'''
+
+    def __init__(self, file_ext):
+        self.file_ext = file_ext
+        self.boards = []            # [(node, id)]
+        self.components = {}        # partNumber -> [Component]
+        self.picks = {}             # refDes -> [Pick]
+        self.lanes = {}             # partNumber -> [Lane]
+        self.table = ProgramTable() # picks by feeder and .pp7 Align/Place actions by (robot, head), as parsed
+
+    def add_pick(self, pick):
+        self.picks.setdefault(pick.refDes, []).append(pick)
+        self.table.add_pick(pick.feeder, pick.refDes, pick.nodes[0])
+
+    def copy(self):
+        '''Return a copy sharing the indexed records and table, with its own partNumber lookups to be modified'''
+        index = ProgramIndex(self.file_ext)
+        index.boards, index.picks, index.table = self.boards, self.picks, self.table
+        index.components = {partNumber: list(components) for partNumber, components in self.components.items()}
+        index.lanes = {partNumber: list(lanes) for partNumber, lanes in self.lanes.items()}
+        return index
+
+
+class ChangePlan:
+    '''Attribute changes and removals to be applied onto the program'''
+
+    def __init__(self, details=False):
+        self.attrib = {}    # node -> {attribute: value}
+        self.removed = {}   # node -> parent
+        self.counts = {}    # kind -> number of changes, for reporting
+        self.details = [] if details else None  # per line item report, kept only if details
+        self._undo = None
+
+    def set(self, node, name, value, kind=None):
+        self.attrib.setdefault(node, {})[name] = value
+        if kind is not None:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def remove(self, node, parent, kind=None):
+        if node not in self.removed:
+            self.removed[node] = parent
+            if kind is not None:
+                self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def apply(self):
+        '''Apply the plan onto the indexed element tree, call revert() to restore the tree as parsed'''
+        undo_attrib = [(node, {name: node.attrib.get(name) for name in attrib}) for node, attrib in self.attrib.items()]
+        for node, attrib in self.attrib.items():
+            node.attrib.update(attrib)
+
+        # Rebuild the children of each parent once with all its removed nodes filtered out,
+        # instead of parent.remove(node) scanning the children for every node
+        removed_by_parent = {}
+        for node, parent in self.removed.items():
+            removed_by_parent.setdefault(parent, set()).add(node)
+        undo_children = {}
+        for parent, nodes in removed_by_parent.items():
+            children = list(parent)
+            undo_children[parent] = children
+            parent[:] = [child for child in children if child not in nodes]
+        self._undo = (undo_attrib, undo_children)
+
+    def revert(self):
+        '''Restore the attributes and children changed by apply()'''
+        if self._undo is None:
+            return
+        undo_attrib, undo_children = self._undo
+        for node, attrib in undo_attrib:
+            for name, value in attrib.items():
+                if value is None:
+                    node.attrib.pop(name, None)
+                else:
+                    node.attrib[name] = value
+        for parent, children in undo_children.items():
+            parent[:] = children
+        self._undo = None
+
+
+def build_program_index(root, file_ext):
+    '''Walk the parsed program once and return its ProgramIndex'''
+    index = ProgramIndex(file_ext.lower())
+    if index.file_ext == 'pp7':
+        _index_pp7(root, index)
+    elif index.file_ext == 'pp':
+        _index_pp(root, index)
+    index.table.freeze()
+    return index
+
+
+def _index_boards(root, index, pp_url):
+    for BoardInfo in root.iter(f"{pp_url}Board"):
+        index.boards.append((BoardInfo, BoardInfo.attrib.get('id')))
+        for ComponentInfo in BoardInfo.iter(f"{pp_url}Component"):
+            sPartNumber = ComponentInfo.attrib.get('partNumber')
+            component = Component(ComponentInfo, BoardInfo, ComponentInfo.attrib.get('refDes'), sPartNumber)
+            index.components.setdefault(sPartNumber, []).append(component)
+
+
+def _index_pp(root, index):
+    pp_url = PP_URL
+    _index_boards(root, index, pp_url)
+
+    for a, ActionInfo in enumerate(root.iter(f"{pp_url}Actions")):
+        sSectionNumber = str(a // ROBOTS_PER_SECTION + 1)
+        for IndexInfo in ActionInfo.iter(f"{pp_url}Index"):
+            # Sweep backward once to find the group from pick to place (Pick, Align, ReadFiducial, Place)
+            IndexInfoList = list(IndexInfo)
+            stop = len(IndexInfoList)
+            for k in range(len(IndexInfoList) - 1, -1, -1):
+                IndexItem = IndexInfoList[k]
+                if IndexItem.tag == f"{pp_url}Pick":
+                    sREFDES = IndexItem.attrib.get('refDes')
+                    feeder = (sSectionNumber, IndexItem.attrib.get('feederNumber'), IndexItem.attrib.get('laneNumber'))
+                    index.add_pick(Pick(IndexInfoList[k:stop], IndexInfo, sREFDES, feeder))
+                elif IndexItem.tag == f"{pp_url}Place":
+                    stop = k + 1
+
+    for SectionInfo in root.iter(f"{pp_url}Section"):
+        sSectionNumber = SectionInfo.attrib.get('number')
+        for TrolleyInfo in SectionInfo.iter(f"{pp_url}Trolley"):
+            for FeederInfo in TrolleyInfo.iter(f"{pp_url}Feeder"):
+                sFeederNumber = FeederInfo.attrib.get('number')
+                for LaneInfo in FeederInfo.iter(f"{pp_url}Lane"):
+                    sPartNumber = LaneInfo.attrib.get('partNumber')
+                    key = (sSectionNumber, sFeederNumber, LaneInfo.attrib.get('number'))
+                    index.lanes.setdefault(sPartNumber, []).append(Lane(LaneInfo, FeederInfo, TrolleyInfo, key, sPartNumber))
+
+
+def _index_pp7(root, index):
+    pp_url = PP7_URL
+    _index_boards(root, index, pp_url)
+    tag_pick, tags_head = f"{pp_url}Pick", (f"{pp_url}Align", f"{pp_url}Place")
+
+    location = -1
+    for SegmentInfo in root.iter(f"{pp_url}Segment"):
+        sSegmentNumber = SegmentInfo.attrib.get('number')
+        for ProcessingInfo in SegmentInfo.iter(f"{pp_url}Processing"):
+            for BoardLocationInfo in ProcessingInfo.iter(f"{pp_url}BoardLocation"):
+                location += 1
+                for ActionInfo in BoardLocationInfo.iter(f"{pp_url}Action"):
+                    # One walk of the action for its Pick, Align and Place
+                    for ActionItem in ActionInfo.iter():
+                        if ActionItem.tag == tag_pick:
+                            sREFDES = ActionItem.attrib.get('refDes')
+                            feeder = (sSegmentNumber, ActionItem.attrib.get('feedSectionNumber'), ActionItem.attrib.get('feederSlotNumber'), ActionItem.attrib.get('feederLaneNumber'))
+                            robotHead = (ActionItem.attrib.get('robotNumber'), ActionItem.attrib.get('headNumber'))
+                            index.add_pick(Pick([ActionInfo], BoardLocationInfo, sREFDES, feeder, robotHead, location))
+                        elif ActionItem.tag in tags_head:
+                            robotHead = (ActionItem.attrib.get('robotNumber'), ActionItem.attrib.get('headNumber'))
+                            index.table.add_action(robotHead, location, ActionInfo, BoardLocationInfo)
+
+        for SetupInfo in SegmentInfo.iter(f"{pp_url}Setup"):
+            for FeedSectionInfo in SetupInfo.iter(f"{pp_url}FeedSection"):
+                sSectionNumber = FeedSectionInfo.attrib.get('number')
+                for FeederInfo in FeedSectionInfo.iter(f"{pp_url}Feeder"):
+                    sFeederNumber = FeederInfo.attrib.get('slotNumber')
+                    for LaneInfo in FeederInfo.iter(f"{pp_url}FeederLane"):
+                        sPartNumber = LaneInfo.attrib.get('partNumber')
+                        key = (sSegmentNumber, sSectionNumber, sFeederNumber, LaneInfo.attrib.get('number'))
+                        index.lanes.setdefault(sPartNumber, []).append(Lane(LaneInfo, FeederInfo, FeedSectionInfo, key, sPartNumber))
+
+
+def apply_swr(index, cbid, lineItems, log, validate=False):
+    '''
+    Apply all line items [(partIs, partWas, designatorList)] of the given CBID onto the indexed program,
+    designatorList being any collection of refDes such as DesignatorRanges
+    Return the ChangePlan, raise AssertionError if the SWR cannot be handled
+    If validate, shared feeders are reported in plan.details with the impacted refDes and feeders of each line item, instead of raising
+    The given index is left untouched so it can be reused for other CBIDs
+    '''
+    index = index.copy()
+    plan = ChangePlan(details=validate)
+
+    # Modify program names
+    for BoardInfo, sPROGRAM_NAME in index.boards:
+        sPROGRAM_NAME_NEW = f"{sPROGRAM_NAME}-{cbid}"
+        log.info(f"Modifying program name from {sPROGRAM_NAME} to {sPROGRAM_NAME_NEW} ...")
+        plan.set(BoardInfo, 'id', sPROGRAM_NAME_NEW)
+
+    # Per element messages are logged at DEBUG only, summarized from plan.counts by the caller
+    debug = log.isEnabledFor(logging.DEBUG)
+    for partIs, partWas, designatorList in lineItems:
+        log.info('Processing partIs = %s, partWas = %s, %d designator(s) ...', partIs, partWas, len(designatorList))
+        _apply_line_item(index, plan, cbid, partIs, partWas, designatorList, log, debug)
+
+    return plan
+
+
+def _apply_line_item(index, plan, cbid, partIs, partWas, designators, log, debug=False):
+    components = index.components.get(partWas, [])
+
+    if 'ALL' in designators:
+        targets = components
+        check_designator = set()
+        all_designator = {component.refDes for component in components}
+        if len(all_designator) > 0:
+            log.info('Replacing designatorList with all %d designator(s) of %s ...', len(all_designator), partWas)
+            if debug:
+                log.debug('all_designator = %s', all_designator)
+            designators = all_designator
+    else:
+        targets = [component for component in components if component.refDes in designators]
+        check_designator = {component.refDes for component in components if component.refDes not in designators}
+        if len(check_designator) > 0:
+            log.info('Not all designators are included, non-impacted designator = %s', check_designator)
+
+    detail = None
+    if plan.details is not None:
+        detail = {'partIs': partIs, 'partWas': partWas, 'impacted': sorted({component.refDes for component in targets}),
+                  'missing': sorted(set(designators) - {component.refDes for component in components}) if 'ALL' not in designators else [],
+                  'feeders_modified': [], 'feeders_removed': [], 'feeders_kept': [], 'conflicts': []}
+        plan.details.append(detail)
+
+    # Handle part removal, delete the component of the given component PN & REFDES
+    if partIs == NO_PLACE:
+        for component in targets:
+            if debug:
+                log.debug('Deleting %s component ...', component.refDes)
+            plan.remove(component.node, component.parent, 'components_removed')
+
+    # Handle part sub, modify the component part number of the given REFDES
+    else:
+        for component in targets:
+            if debug:
+                log.debug('Modifying %s componenet part number from %s to %s ...', component.refDes, partWas, partIs)
+            plan.set(component.node, 'partNumber', partIs, 'components_modified')
+
+    if len(targets) > 0:
+        targetSet = set(targets)
+        index.components[partWas] = [component for component in components if component not in targetSet]
+        if partIs != NO_PLACE:
+            index.components.setdefault(partIs, []).extend(targets)
+
+    # Store feeder of partWas which is also used on any non-impacted designator into feeder_whitelist
+    lanes = index.lanes.get(partWas, [])
+    feeder_whitelist = index.table.shared({lane.key for lane in lanes}, check_designator, plan.removed) if len(check_designator) > 0 else set()
+
+    # Handle part removal, delete pick to place of the given REFDES
+    if partIs == NO_PLACE:
+        if index.file_ext == 'pp7':
+            _remove_pp7_actions(index, plan, designators, log, debug)
+        else:
+            for designator in designators:
+                for pick in index.picks.get(designator, ()):
+                    if debug:
+                        log.debug('Deleting %s pick to place ...', designator)
+                    plan.remove(pick.nodes[0], pick.parent, 'picks_removed')
+                    for node in pick.nodes[1:]:
+                        plan.remove(node, pick.parent)
+
+    remaining, moved = [], []
+    for lane in lanes:
+        if lane.feeder in plan.removed:
+            continue
+
+        # Handle part removal, delete the feeder unless it is used on any non-impacted designator
+        if partIs == NO_PLACE:
+            if len(check_designator) > 0 and lane.key in feeder_whitelist:
+                if debug:
+                    log.debug('Skipping %s, feeder %s to be deleted.', partWas, lane.key)
+                remaining.append(lane)
+                if detail is not None:
+                    detail['feeders_kept'].append(lane.key)
+            else:
+                if debug:
+                    log.debug('Deleting %s feeder %s ...', partWas, lane.key)
+                plan.remove(lane.feeder, lane.parent, 'feeders_removed')
+                if detail is not None:
+                    detail['feeders_removed'].append(lane.key)
+
+        # Handle part sub, modify the feeder lane part number unless it is used on any non-impacted designator
+        else:
+            if len(check_designator) > 0 and lane.key in feeder_whitelist:
+                if detail is None:
+                    raise AssertionError(f"Same feeder is sharing for impacted and non-impacted designators, unable to modify feeder, force skipping CBID = {cbid} !")
+                detail['conflicts'].append(lane.key)
+                remaining.append(lane)
+                continue
+            if debug:
+                log.debug('Modifying feeder %s from %s to %s ...', lane.key, partWas, partIs)
+            plan.set(lane.node, 'partNumber', partIs, 'feeders_modified')
+            moved.append(lane)
+            if detail is not None:
+                detail['feeders_modified'].append(lane.key)
+
+    if len(lanes) > 0:
+        index.lanes[partWas] = remaining
+        index.lanes.setdefault(partIs, []).extend(moved)
+
+
+def _remove_pp7_actions(index, plan, designators, log, debug=False):
+    '''Delete Pick actions of the given REFDES, then Align/Place actions sharing the same (robot, head)'''
+    # (robot, head) of removed picks are carried over to the following board locations
+    firstLocations = {}
+    for designator in designators:
+        for pick in index.picks.get(designator, ()):
+            if debug:
+                log.debug('Deleting %s pick action ...', pick.refDes)
+            plan.remove(pick.nodes[0], pick.parent, 'picks_removed')
+            if pick.location < firstLocations.get(pick.robotHead, pick.location + 1):
+                firstLocations[pick.robotHead] = pick.location
+
+    for robotHead, ActionInfo, BoardLocationInfo in index.table.head_actions(firstLocations):
+        if debug:
+            log.debug('Deleting action of (RobotNumber, HeadNumber) = %s ...', robotHead)
+        plan.remove(ActionInfo, BoardLocationInfo, 'actions_removed')
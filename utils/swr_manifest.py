@@ -0,0 +1,103 @@
+'''Content-addressed manifest of generated SWR programs, to skip CBIDs which are unchanged since the last run'''
+
+import os
+import json
+import hashlib
+
+# Bump whenever the generated programs may differ for the same SWR row and bom programs
+TOOL_VERSION = '2.0'
+MANIFEST_FILENAME = 'swr_manifest.json'
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SWRManifest:
+    '''
+    Keep in recipe-swr the key of each generated CBID: a hash of its normalized SWR row, the content hashes
+    of its matched bom programs and TOOL_VERSION, together with the size and mtime of its output files
+    Content hashes are reused while the bom program (path, mtime, size) is unchanged
+    '''
+
+    def __init__(self, path_recipe_swr, log=None):
+        self.path_recipe_swr = path_recipe_swr
+        self.path = os.path.join(path_recipe_swr, MANIFEST_FILENAME)
+        self.log = log
+        self.cbids = {}     # cbid -> {'key': key, 'outputs': {filename: [size, mtime_ns]}}
+        self.hashes = {}    # bom program path -> [mtime_ns, size, sha256]
+        self.skipped = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['version'] == TOOL_VERSION:
+                self.cbids, self.hashes = data['cbids'], data['hashes']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if self.log:
+                self.log.warning(f"Unable to read manifest {self.path}, regenerating all CBIDs: {str(e)}")
+
+    def save(self):
+        if not os.path.exists(self.path_recipe_swr):
+            os.makedirs(self.path_recipe_swr)
+        # Drop content hashes of bom programs which no longer exist
+        self.hashes = {path: cached for path, cached in self.hashes.items() if os.path.exists(path)}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': TOOL_VERSION, 'cbids': self.cbids, 'hashes': self.hashes}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def file_hash(self, path):
+        '''Content hash of the bom program, rehashed only if its mtime or size changed'''
+        stat = os.stat(path)
+        cached = self.hashes.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        sha = _sha256_file(path)
+        self.hashes[path] = [stat.st_mtime_ns, stat.st_size, sha]
+        return sha
+
+    def cbid_key(self, row, files):
+        '''Key of the CBID from its normalized SWR row (any json-serializable values) and matched bom programs'''
+        h = hashlib.sha256()
+        h.update(TOOL_VERSION.encode('utf-8'))
+        h.update(json.dumps(row, sort_keys=True).encode('utf-8'))
+        for file in sorted(files):
+            h.update(f"\n{os.path.basename(file)}:{self.file_hash(file)}".encode('utf-8'))
+        return h.hexdigest()
+
+    def _output_folder(self, cbid):
+        return os.path.join(self.path_recipe_swr, cbid)
+
+    def _outputs(self, cbid):
+        outputs = {}
+        output_folder = self._output_folder(cbid)
+        if os.path.isdir(output_folder):
+            for f in os.scandir(output_folder):
+                if f.is_file():
+                    stat = f.stat()
+                    outputs[f.name] = [stat.st_size, stat.st_mtime_ns]
+        return outputs
+
+    def is_current(self, cbid, key):
+        '''True if the CBID was generated with the same key and its output files are intact'''
+        entry = self.cbids.get(cbid)
+        if entry is None or entry['key'] != key or len(entry['outputs']) < 1:
+            return False
+        return self._outputs(cbid) == entry['outputs']
+
+    def record(self, cbid, key):
+        '''Record the CBID as generated with key, from its output files found now'''
+        self.cbids[cbid] = {'key': key, 'outputs': self._outputs(cbid)}
+
+    def discard(self, cbid):
+        self.cbids.pop(cbid, None)
@@ -0,0 +1,104 @@
+'''Resident memory of the running process and a memory budget to admit SWR jobs against, with the standard library only'''
+
+import os
+import gc
+import sys
+import ctypes
+
+if sys.platform == 'win32':
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+
+def _windows_counters():
+    counters = _ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+def current_rss():
+    '''Resident bytes of the running process, None if unknown on this platform'''
+    try:
+        if sys.platform == 'win32':
+            counters = _windows_counters()
+            return None if counters is None else counters.WorkingSetSize
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss():
+    '''Peak resident bytes of the running process, None if unknown on this platform'''
+    try:
+        if sys.platform == 'win32':
+            counters = _windows_counters()
+            return None if counters is None else counters.PeakWorkingSetSize
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (OSError, ValueError, AttributeError, ImportError):
+        return None
+
+
+class MemoryBudget:
+    '''
+    Resident memory budget of a process, checked before admitting each SWR job
+    Once the resident size is above high of the budget, the program cache is shrunk by the excess and capped there,
+    unless the process is above high even without its cached programs, as releasing them would only parse them again
+    The cache is shrunk again only once the resident size grows by more than rearm of the budget since,
+    as freed memory is mostly kept by the allocator for the next trees instead of being returned to the system
+    '''
+
+    def __init__(self, max_mb, log=None, high=0.8, rearm=0.05):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.high_bytes = int(self.max_bytes * high)
+        self.rearm_bytes = int(self.max_bytes * rearm)
+        self.log = log
+        self.releases = 0
+        self.checked_rss = None
+
+    def max_workers(self, workers, factor=1.5):
+        '''Number of worker processes fitting in the budget next to this process, each taking about factor times its current resident size'''
+        rss = current_rss()
+        if rss is None or rss <= 0:
+            return workers
+        return max(1, min(workers, int((self.max_bytes - rss) // (rss * factor))))
+
+    def over(self):
+        rss = current_rss()
+        if rss is None or rss <= self.high_bytes:
+            return None
+        if self.checked_rss is not None and rss <= self.checked_rss + self.rearm_bytes:
+            return None
+        return rss
+
+    def admit(self, program_cache=None):
+        '''Shrink the program cache if the resident size is near the budget and grew since last checked, before starting the next job'''
+        rss = self.over()
+        if rss is None:
+            return
+        self.checked_rss = rss
+        cached = 0 if program_cache is None else program_cache.total_bytes
+        if rss - cached > self.high_bytes:
+            if self.log:
+                self.log.warning(f"Resident memory {rss / 1024 / 1024:.0f} MB is near the budget of {self.max_bytes / 1024 / 1024:.0f} MB without the "
+                                 f"{cached / 1024 / 1024:.0f} MB of cached programs, keeping them.")
+            return
+        program_cache.shrink(cached - (rss - self.high_bytes))
+        gc.collect()
+        self.releases += 1
+        self.checked_rss = current_rss()
+        if self.log:
+            self.log.info(f"Resident memory near the budget of {self.max_bytes / 1024 / 1024:.0f} MB, program cache shrunk and capped to "
+                          f"{program_cache.max_bytes / 1024 / 1024:.0f} MB, now {self.checked_rss / 1024 / 1024:.0f} MB.")
@@ -0,0 +1,120 @@
+'''Per-stage timing spans and counters of a run, reported as json and as a summary table in the log'''
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+from utils.swr_memory import current_rss
+
+
+class RunMetrics:
+    '''
+    Timing spans and counters, in total and per CBID and program file
+    Metrics of pool workers are sent back with to_dict() and added into the main process with merge()
+    '''
+
+    def __init__(self):
+        self.stages = {}    # stage -> [calls, seconds]
+        self.counters = {}  # name -> count
+        self.cbids = {}     # cbid -> {'seconds': {stage: seconds}, 'counters': {name: count}}
+        self.files = {}     # (cbid, file) -> {'seconds': {stage: seconds}, 'counters': {name: count}}
+        self.rss = {}       # stage -> peak resident bytes, sampled at the end of its spans
+        self.started = time.perf_counter()
+
+    def _entries(self, cbid, file):
+        entries = []
+        if cbid is not None:
+            entries.append(self.cbids.setdefault(cbid, {'seconds': {}, 'counters': {}}))
+            if file is not None:
+                entries.append(self.files.setdefault((cbid, file), {'seconds': {}, 'counters': {}}))
+        return entries
+
+    def add_time(self, stage, seconds, cbid=None, file=None, calls=1):
+        total = self.stages.setdefault(stage, [0, 0.0])
+        total[0] += calls
+        total[1] += seconds
+        for entry in self._entries(cbid, file):
+            entry['seconds'][stage] = entry['seconds'].get(stage, 0.0) + seconds
+
+    def count(self, name, n=1, cbid=None, file=None):
+        self.counters[name] = self.counters.get(name, 0) + n
+        for entry in self._entries(cbid, file):
+            entry['counters'][name] = entry['counters'].get(name, 0) + n
+
+    def sample_rss(self, stage, rss=None):
+        '''Keep the peak resident bytes of stage, sampled now if not given'''
+        rss = current_rss() if rss is None else rss
+        if rss is not None and rss > self.rss.get(stage, 0):
+            self.rss[stage] = rss
+
+    @contextmanager
+    def span(self, stage, cbid=None, file=None):
+        '''Time the enclosed block into stage'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, cbid, file)
+            self.sample_rss(stage)
+
+    def to_dict(self):
+        return {
+            'stages': {stage: {'calls': calls, 'seconds': round(seconds, 6)} for stage, (calls, seconds) in self.stages.items()},
+            'counters': dict(self.counters),
+            'peak_rss_mb': {stage: round(rss / 1024 / 1024, 1) for stage, rss in self.rss.items()},
+            'cbids': {cbid: entry for cbid, entry in self.cbids.items()},
+            'files': [{'cbid': cbid, 'file': file, **entry} for (cbid, file), entry in self.files.items()],
+        }
+
+    def merge(self, data):
+        '''Add the metrics of to_dict() from another process'''
+        for stage, total in data['stages'].items():
+            self.add_time(stage, total['seconds'], calls=total['calls'])
+        for name, n in data['counters'].items():
+            self.count(name, n)
+        for stage, rss_mb in data.get('peak_rss_mb', {}).items():
+            self.sample_rss(stage, int(rss_mb * 1024 * 1024))
+        for cbid, entry in data['cbids'].items():
+            self._add_entry(self._entries(cbid, None)[0], entry)
+        for item in data['files']:
+            self._add_entry(self._entries(item['cbid'], item['file'])[-1], item)
+
+    @staticmethod
+    def _add_entry(entry, other):
+        for stage, seconds in other['seconds'].items():
+            entry['seconds'][stage] = entry['seconds'].get(stage, 0.0) + seconds
+        for name, n in other['counters'].items():
+            entry['counters'][name] = entry['counters'].get(name, 0) + n
+
+    def cbid_summary(self, cbid):
+        '''One line of the modifications and deletions counted for the CBID'''
+        counters = self.cbids.get(cbid, {}).get('counters', {})
+        summary = ', '.join(f"{n} {name.replace('_', ' ')}" for name, n in sorted(counters.items()) if not name.startswith('bytes_'))
+        return summary or 'no changes'
+
+    def write_report(self, path, **extra):
+        '''Write the metrics with the wall time of the run and any extra fields into a json report'''
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        report = {'wall_seconds': round(time.perf_counter() - self.started, 6), **extra, **self.to_dict()}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+    def log_summary(self, log):
+        '''Log the summary table of stages and counters'''
+        wall = time.perf_counter() - self.started
+        log.info(f"Run summary: {wall:.3f}s wall time, {len(self.cbids)} CBID(s), {len(self.files)} program file(s)")
+        log.info(f"{'stage':<12}{'calls':>8}{'seconds':>12}{'share':>8}{'peak MB':>10}")
+        # Share of the time spent in all stages, which may exceed the wall time with worker processes
+        busy = sum(seconds for calls, seconds in self.stages.values())
+        for stage, (calls, seconds) in sorted(self.stages.items(), key=lambda item: item[1][1], reverse=True):
+            share = seconds / busy * 100 if busy > 0 else 0.0
+            rss = f"{self.rss[stage] / 1024 / 1024:.0f}" if stage in self.rss else ''
+            log.info(f"{stage:<12}{calls:>8}{seconds:>12.3f}{share:>7.1f}%{rss:>10}")
+        for name, n in sorted(self.counters.items()):
+            if name.startswith('bytes_'):
+                log.info(f"{name:<20}{n / 1024 / 1024:>12.2f} MB ({n / wall / 1024 / 1024 if wall > 0 else 0.0:.2f} MB/s)")
+            else:
+                log.info(f"{name:<20}{n:>12}")
@@ -0,0 +1,111 @@
+'''Read-ahead and write-behind of program files, overlapping file I/O with parse, transform and serialize'''
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _read_file(path):
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, time.perf_counter() - start
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return None, time.perf_counter() - start
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class IOPipeline:
+    '''
+    Bounded I/O stages around the compute stage of process_files, run on threads as file and zip I/O release the GIL
+    prefetch() reads upcoming bom programs ahead on a reader thread, take() hands over their bytes for parsing,
+    discard() drops those no longer needed, as their CBID failed or was skipped
+    write() and submit() queue output files and .pp7.zip builds on writer threads, blocking while more than max_mb are in flight,
+    outputs are written through the OutputStore given to write(), if any
+    drain() waits for all queued writes, raising the first error, and adds the time spent into the given RunMetrics
+    '''
+
+    def __init__(self, max_mb=256, writers=2):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='swr_read')
+        self.writer = ThreadPoolExecutor(max_workers=writers, thread_name_prefix='swr_write')
+        self.reads = {}         # path -> (future, size)
+        self.read_bytes = 0
+        self.writes = deque()   # [(future, size, (stage, cbid, file))]
+        self.write_bytes = 0
+        self.timings = []       # [((stage, cbid, file), seconds)] of finished reads and writes
+
+    def prefetch(self, paths, sizes):
+        '''Start reading the given paths ahead, in order, as long as the read-ahead bytes stay within max_mb'''
+        for path, size in zip(paths, sizes):
+            if path in self.reads:
+                continue
+            if self.read_bytes + size > self.max_bytes and len(self.reads) > 0:
+                break
+            self.reads[path] = (self.reader.submit(_read_file, path), size)
+            self.read_bytes += size
+
+    def take(self, path, cbid=None, file=None):
+        '''Return the prefetched bytes of path, or None if it was not prefetched'''
+        if path not in self.reads:
+            return None
+        future, size = self.reads.pop(path)
+        self.read_bytes -= size
+        data, seconds = future.result()
+        self.timings.append((('read', cbid, file), seconds))
+        return data
+
+    def discard(self, keep=()):
+        '''Drop the read-ahead of the paths not in keep'''
+        for path in [path for path in self.reads if path not in keep]:
+            future, size = self.reads.pop(path)
+            future.cancel()
+            self.read_bytes -= size
+
+    def _finish_oldest(self):
+        future, size, timing = self.writes.popleft()
+        self.write_bytes -= size
+        result, seconds = future.result()
+        self.timings.append((timing, seconds))
+
+    def submit(self, func, *args, size=0, timing=('write', None, None)):
+        '''Queue func(*args) on a writer thread, size is the bytes it holds until done, timing is its (stage, cbid, file)'''
+        while self.write_bytes + size > self.max_bytes and len(self.writes) > 0:
+            self._finish_oldest()
+        self.writes.append((self.writer.submit(_timed, func, *args), size, timing))
+        self.write_bytes += size
+
+    def write(self, path, data, cbid=None, file=None, store=None):
+        self.submit(_write_file if store is None else store.write, path, data, size=len(data), timing=('write', cbid, file))
+
+    def drain(self, metrics=None):
+        '''Wait for all queued writes, then add the time of the finished reads and writes into metrics'''
+        try:
+            while len(self.writes) > 0:
+                self._finish_oldest()
+        finally:
+            # Wait for the other writes as well, so no output is written after the caller cleans up
+            for future, size, timing in self.writes:
+                future.exception()
+            self.writes.clear()
+            self.write_bytes = 0
+            if metrics is not None:
+                for (stage, cbid, file), seconds in self.timings:
+                    metrics.add_time(stage, seconds, cbid, file)
+            self.timings = []
+
+    def close(self):
+        for future, size in self.reads.values():
+            future.cancel()
+        self.reads.clear()
+        self.read_bytes = 0
+        self.reader.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
@@ -0,0 +1,171 @@
+'''Process-pool execution of (CBID, program files) jobs with size-aware scheduling'''
+
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.program_cache import ProgramCache, TREE_BYTES_PER_FILE_BYTE
+from utils.swr_metrics import RunMetrics
+from utils.swr_memory import MemoryBudget, current_rss, peak_rss
+from utils.swr_profile import SWRProfiler, profile_job
+
+# Per worker process state, set by _init_worker
+_worker = {}
+
+
+class _RecordBuffer(logging.Handler):
+    '''Keep log records of the running job, to be sent back and logged by the main process'''
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Render message now, so the record can be pickled back to the main process
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+class _CBIDAdapter(logging.LoggerAdapter):
+    '''Prefix every message with the CBID of the job'''
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['cbid']}] {msg}", kwargs
+
+
+def group_program_files(file_program):
+    '''
+    Group matched program files into jobs, a .pp7.zip is kept in the same job right after its .pp7
+    since the output .pp7 is packed into the output .pp7.zip
+    '''
+    groups = {}
+    for file in sorted(file_program):
+        key = file[:-4] if file[-8:].lower() == '.pp7.zip' else file
+        groups.setdefault(key, []).append(file)
+    return list(groups.values())
+
+
+def job_size(files):
+    '''Total bytes of the program files of a job, used to schedule large jobs first'''
+    size = 0
+    for file in files:
+        try:
+            size += os.path.getsize(file)
+        except OSError:
+            pass
+    return size
+
+
+def _init_worker(loglevel, cache_max_mb, profile=None, max_mb=None):
+    logger = logging.getLogger('swr_worker')
+    logger.setLevel(loglevel)
+    logger.propagate = False
+    buffer = _RecordBuffer()
+    logger.handlers = [buffer]
+    _worker['logger'], _worker['buffer'] = logger, buffer
+    _worker['cache'] = ProgramCache(cache_max_mb, logger)
+    # Share of the memory budget of the run, the worker releases its own cached programs once near it
+    _worker['budget'] = None if max_mb is None else MemoryBudget(max_mb, logger)
+    # Profiles of the previous run are cleaned by the main process
+    _worker['profiler'] = None if profile is None else SWRProfiler(profile[0], logger, profile[1], clean=False)
+
+
+def _run_job(func, cbid, args, part=None):
+    '''
+    Run func(log, program_cache, *args, metrics=metrics) in the worker
+    Return (error, records, metrics, (pid, resident bytes, peak resident bytes, tree factor measured by its program cache or None))
+    '''
+    buffer = _worker['buffer']
+    buffer.records = []
+    log = _CBIDAdapter(_worker['logger'], {'cbid': cbid})
+    metrics = RunMetrics()
+    error = None
+    if _worker['budget'] is not None:
+        _worker['budget'].admit(_worker['cache'])
+    try:
+        with profile_job(_worker['profiler'], cbid, part, log):
+            func(log, _worker['cache'], *args, metrics=metrics)
+    except AssertionError as e:
+        error = str(e)
+    cache = _worker['cache']
+    return error, buffer.records, metrics.to_dict(), (os.getpid(), current_rss(), peak_rss(), cache.tree_factor if cache.measured else None)
+
+
+def run_jobs(log, func, jobs, workers, cache_max_mb, on_failed, metrics=None, max_mb=None, profiler=None):
+    '''
+    Run jobs [(cbid, args, size)] as func(log, program_cache, *args, metrics=metrics) over a pool of worker processes
+    Largest jobs are scheduled first so small jobs fill in the gaps
+    Once all jobs of a CBID are done, on_failed(cbid, error) is called if any of them raised AssertionError
+    Metrics of the jobs are merged into the given RunMetrics
+    If max_mb is given, each worker keeps its program cache within its share of max_mb, and jobs are admitted only while
+    the parsed size of the running jobs plus the resident size of the workers and of this process stays within max_mb (at least one runs),
+    the parsed size of a job being its program bytes times the tree factor measured by the workers (TREE_BYTES_PER_FILE_BYTE until then)
+    With a SWRProfiler, each job is profiled in its worker as <CBID>-<job number of the CBID>
+    '''
+    jobs = sorted(jobs, key=lambda job: job[2], reverse=True)
+    pending, failed = {}, {}
+    for cbid, args, size in jobs:
+        pending[cbid] = pending.get(cbid, 0) + 1
+
+    max_bytes = None if max_mb is None else max_mb * 1024 * 1024
+    queued = list(jobs)
+    costs, running = {}, 0
+    resident, peaks = {}, {}    # pid -> last and peak resident bytes reported by the worker
+    tree_factor = TREE_BYTES_PER_FILE_BYTE
+    parts = {}
+    profile = None if profiler is None else (profiler.path_profile, profiler.top)
+
+    log.info(f"Running {len(jobs)} job(s) of {len(pending)} CBID(s) with {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log.getEffectiveLevel(), cache_max_mb, profile, None if max_mb is None else max_mb / workers)) as pool:
+        futures = {}
+
+        def admit():
+            nonlocal running
+            # Running jobs are those submitted and not done, the pool keeps the others queued
+            while len(queued) > 0 and (max_bytes is None or len(costs) == 0 or running + queued[0][2] * tree_factor + sum(resident.values()) + (current_rss() or 0) <= max_bytes):
+                cbid, args, size = queued.pop(0)
+                if cbid in failed:
+                    pending[cbid] -= 1
+                    if pending[cbid] <= 0:
+                        on_failed(cbid, failed[cbid])
+                    continue
+                parts[cbid] = parts.get(cbid, 0) + 1
+                future = pool.submit(_run_job, func, cbid, args, parts[cbid])
+                futures[future] = cbid
+                costs[future] = size * tree_factor
+                running += costs[future]
+
+        admit()
+        while len(costs) > 0:
+            future = next(as_completed(costs))
+            running -= costs.pop(future)
+            cbid = futures[future]
+            pending[cbid] -= 1
+
+            if future.cancelled():
+                error, records, job_metrics = None, [], None
+            else:
+                error, records, job_metrics, (pid, rss, peak, factor) = future.result()
+                resident[pid], peaks[pid] = rss or 0, max(peak or 0, peaks.get(pid, 0))
+                tree_factor = tree_factor if factor is None else factor
+            for record in records:
+                log.handle(record)
+            if metrics is not None and job_metrics is not None:
+                metrics.merge(job_metrics)
+
+            if error is not None and cbid not in failed:
+                failed[cbid] = error
+                # Skip jobs of the failed CBID which are not started yet
+                for other, other_cbid in futures.items():
+                    if other_cbid == cbid:
+                        other.cancel()
+
+            if pending[cbid] <= 0 and cbid in failed:
+                on_failed(cbid, failed[cbid])
+            admit()
+
+    if max_bytes is not None and len(peaks) > 0:
+        log.info(f"Worker memory: peak resident memory {sum(peaks.values()) / 1024 / 1024:.0f} MB summed over {len(peaks)} worker(s), {(peak_rss() or 0) / 1024 / 1024:.0f} MB in the main process.")
+    return failed
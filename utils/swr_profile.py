@@ -0,0 +1,132 @@
+'''Profiling of SWR jobs: cProfile statistics and sampled call stacks of each CBID, with hotspot tables in the log'''
+
+import os
+import sys
+import glob
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+class StackSampler:
+    '''Count the call stacks of a thread sampled every interval seconds, in the collapsed format of flame graph tools'''
+
+    def __init__(self, ident, interval=0.001):
+        self.ident, self.interval = ident, interval
+        self.stacks = {}    # 'outer;...;inner' -> samples
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='swr_sampler', daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if len(frames) > 0:
+                stack = ';'.join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def write_collapsed(path, stacks):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, samples in sorted(stacks.items()):
+            f.write(f"{stack} {samples}\n")
+
+
+def read_collapsed(path, stacks):
+    '''Add the samples of a collapsed stacks file into stacks'''
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            stack, samples = line.rstrip('\n').rsplit(' ', 1)
+            stacks[stack] = stacks.get(stack, 0) + int(samples)
+
+
+def hotspots(stats, top=20):
+    '''Return the top functions of the pstats.Stats by own time, [(function, calls, own seconds, cumulative seconds)]'''
+    rows = []
+    for (filename, line, name), (primitive_calls, calls, own, cumulative, callers) in stats.stats.items():
+        function = name if filename == '~' else f"{name} ({os.path.basename(filename)}:{line})"
+        rows.append((function, calls, own, cumulative))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+
+def log_hotspots(log, stats, top=20):
+    log.info(f"{'own s':>10}{'cum s':>10}{'calls':>10}  function")
+    for function, calls, own, cumulative in hotspots(stats, top):
+        log.info(f"{own:>10.3f}{cumulative:>10.3f}{calls:>10}  {function}")
+
+
+class SWRProfiler:
+    '''
+    Profile each SWR job with cProfile and a stack sampler, into path_profile:
+    <CBID>.pstats (open with pstats or snakeviz) and <CBID>.collapsed (feed to flamegraph.pl or speedscope),
+    suffixed with the job number for jobs run by worker processes
+    The top functions by own time of each job are logged, log_summary() logs them for all jobs of the run
+    '''
+
+    def __init__(self, path_profile, log, top=20, interval=0.001, clean=True):
+        self.path_profile, self.log, self.top, self.interval = path_profile, log, top, interval
+        if not os.path.exists(path_profile):
+            os.makedirs(path_profile)
+        elif clean:
+            # Profiles of the previous run are replaced, log_summary() covers the profiles found in path_profile
+            for path in glob.glob(os.path.join(path_profile, '*.pstats')) + glob.glob(os.path.join(path_profile, '*.collapsed')):
+                os.remove(path)
+
+    @contextmanager
+    def job(self, cbid, part=None, log=None):
+        log = self.log if log is None else log
+        name = f"{cbid}" if part is None else f"{cbid}-{part}"
+        profile = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            seconds = time.perf_counter() - start
+            path_stats = os.path.join(self.path_profile, f"{name}.pstats")
+            profile.dump_stats(path_stats)
+            write_collapsed(os.path.join(self.path_profile, f"{name}.collapsed"), sampler.stacks)
+            log.info(f"Profile of CBID = {cbid}: {seconds:.3f}s, {sum(sampler.stacks.values())} stack samples, written into {path_stats}")
+            log_hotspots(log, pstats.Stats(profile), self.top)
+
+    def log_summary(self, log):
+        '''Merge the profiles of all jobs into SWR_PROGRAM_CREATE.pstats and .collapsed, and log their top functions'''
+        paths = sorted(glob.glob(os.path.join(self.path_profile, '*.pstats')))
+        paths = [path for path in paths if not path.endswith('SWR_PROGRAM_CREATE.pstats')]
+        if len(paths) == 0:
+            return
+        stats = pstats.Stats(*paths)
+        path_summary = os.path.join(self.path_profile, 'SWR_PROGRAM_CREATE')
+        stats.dump_stats(f"{path_summary}.pstats")
+        stacks = {}
+        for path in glob.glob(os.path.join(self.path_profile, '*.collapsed')):
+            if not path.endswith('SWR_PROGRAM_CREATE.collapsed'):
+                read_collapsed(path, stacks)
+        write_collapsed(f"{path_summary}.collapsed", stacks)
+        log.info(f"Profile summary of {len(paths)} job(s), written into {path_summary}.pstats and .collapsed")
+        log_hotspots(log, stats, self.top)
+
+
+def profile_job(profiler, cbid, part=None, log=None):
+    '''Context of a profiled job, doing nothing if profiler is None'''
+    if profiler is None:
+        return nullcontext()
+    return profiler.job(cbid, part, log)
@@ -0,0 +1,206 @@
+'''Vendor-exact .pp/.pp7 formatting, as written by ElementTree and fixed up for the placement machines'''
+
+import io
+import os
+import xml.etree.ElementTree as ETree
+
+PP_NAMESPACE = 'http://api.assembleon.com/pp/v2'
+PP7_NAMESPACE = 'http://api.assembleon.com/pp7/v1'
+
+# Lines end as in the text mode writes of the original tool, CRLF on Windows
+NEWLINE = os.linesep
+
+# .pp starts with this declaration, .pp7 has none
+XML_DECLARATION = '<?xml version="1.0"?>\n'
+
+# The un-namespaced Model inside .pp Board/Model keeps its namespace declarations
+MODEL_PATTERN = '<Model>\n\t\t\t\t<General>'
+MODEL_REPLACEMENT = f'<Model xmlns="" xmlns:ns2="{PP_NAMESPACE}">\n\t\t\t\t<General>'
+
+
+def program_namespace(file_ext):
+    return PP7_NAMESPACE if file_ext.lower() == 'pp7' else PP_NAMESPACE
+
+
+def program_encoding(file_ext):
+    '''.pp is written in utf-8, .pp7 in ascii with non-ascii characters as character references'''
+    return 'us-ascii' if file_ext.lower() == 'pp7' else 'utf-8'
+
+
+def escape_cdata(text):
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def escape_attrib(text):
+    text = escape_cdata(text)
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if '\r' in text:
+        text = text.replace('\r', '&#13;')
+    if '\n' in text:
+        text = text.replace('\n', '&#10;')
+    if '\t' in text:
+        text = text.replace('\t', '&#09;')
+    return text
+
+
+def local_name(tag, namespace):
+    '''Return tag without the program namespace, raise ValueError for any other namespace'''
+    if tag[:1] == '{':
+        uri, name = tag[1:].split('}', 1)
+        if uri != namespace:
+            raise ValueError(f"Namespace {uri} is not supported, only {namespace} is expected")
+        return name
+    return tag
+
+
+def start_tag(tag, attrib, namespace, root=False):
+    '''Return the start tag without its closing bracket'''
+    parts = ['<', local_name(tag, namespace)]
+    if root and tag[:1] == '{':
+        parts.append(f' xmlns="{escape_attrib(namespace)}"')
+    for key, value in attrib.items():
+        parts.append(f' {local_name(key, namespace)}="{escape_attrib(value)}"')
+    return ''.join(parts)
+
+
+class PatternReplacer:
+    '''Replace a fixed pattern in text written in pieces, holding back any tail which may start a match'''
+
+    def __init__(self, write, pattern, replacement):
+        self.write, self.pattern, self.replacement = write, pattern, replacement
+        self.pending = ''
+
+    def __call__(self, text):
+        text = self.pending + text
+        if self.pattern in text:
+            text = text.replace(self.pattern, self.replacement)
+        hold = 0
+        for n in range(min(len(self.pattern) - 1, len(text)), 0, -1):
+            if self.pattern.startswith(text[-n:]):
+                hold = n
+                break
+        if hold:
+            self.pending = text[-hold:]
+            text = text[:-hold]
+        else:
+            self.pending = ''
+        if text:
+            self.write(text)
+
+    def flush(self):
+        if self.pending:
+            self.write(self.pending)
+            self.pending = ''
+
+
+class ProgramWriter:
+    '''
+    Buffered writer of program text pieces into a binary file, in the program encoding and with NEWLINE line ends
+    The .pp declaration and Model namespace fixup are applied on the fly
+    '''
+
+    BATCH_PIECES = 4096
+
+    def __init__(self, fout, file_ext):
+        self.fout = fout
+        self.encoding = program_encoding(file_ext)
+        self.pieces = []
+        self.write = self._write_bytes
+        if file_ext.lower() == 'pp':
+            self.write = PatternReplacer(self._write_bytes, MODEL_PATTERN, MODEL_REPLACEMENT)
+            self.pieces.append(XML_DECLARATION)
+
+    def _write_bytes(self, text):
+        if NEWLINE != '\n':
+            text = text.replace('\n', NEWLINE)
+        self.fout.write(text.encode(self.encoding, 'xmlcharrefreplace'))
+
+    def append(self, piece):
+        self.pieces.append(piece)
+        if len(self.pieces) > self.BATCH_PIECES:
+            self.write(''.join(self.pieces))
+            self.pieces = []
+
+    def close(self):
+        self.write(''.join(self.pieces))
+        self.pieces = []
+        if isinstance(self.write, PatternReplacer):
+            self.write.flush()
+
+
+def _element_pieces(elem, namespace, root=False):
+    '''Yield the text pieces of the element and its subtree, without its tail'''
+    tag = start_tag(elem.tag, elem.attrib, namespace, root)
+    if elem.text or len(elem) > 0:
+        yield tag + '>'
+        if elem.text:
+            yield escape_cdata(elem.text)
+        for child in elem:
+            yield from _element_pieces(child, namespace)
+            if child.tail:
+                yield escape_cdata(child.tail)
+        yield f"</{local_name(elem.tag, namespace)}>"
+    else:
+        yield tag + '/>'
+
+
+def _render_program_etree(root, file_ext):
+    '''Fallback for programs with other namespaces: ElementTree output with the fixups applied in memory'''
+    buffer = io.BytesIO()
+    if file_ext.lower() == 'pp':
+        ETree.ElementTree(root).write(buffer, method='xml', xml_declaration=True, encoding='utf-8')
+        data = buffer.getvalue().decode('utf-8').replace(' />', '/>').replace('''<?xml version='1.0' encoding='utf-8'?>''', '''<?xml version="1.0"?>''').replace(MODEL_PATTERN, MODEL_REPLACEMENT)
+    else:
+        ETree.ElementTree(root).write(buffer, method='xml', xml_declaration=False)
+        data = buffer.getvalue().decode('us-ascii').replace(' />', '/>')
+    data = data.replace('</PlacementProgram>', '</PlacementProgram>\n')
+    if NEWLINE != '\n':
+        data = data.replace('\n', NEWLINE)
+    return data.encode(program_encoding(file_ext), 'xmlcharrefreplace')
+
+
+def _write_pieces(f, root, file_ext):
+    namespace = program_namespace(file_ext)
+    writer = ProgramWriter(f, file_ext)
+    for piece in _element_pieces(root, namespace, root=True):
+        writer.append(piece)
+    if local_name(root.tag, namespace) == 'PlacementProgram':
+        writer.append('\n')
+    writer.close()
+
+
+def render_program(root, file_ext):
+    '''Return the bytes of the program tree in vendor-exact format'''
+    try:
+        with io.BytesIO() as f:
+            _write_pieces(f, root, file_ext)
+            return f.getvalue()
+    except ValueError:
+        return _render_program_etree(root, file_ext)
+
+
+def write_program(root, output_path, file_ext, keep=False):
+    '''
+    Write the program tree into output_path in vendor-exact format, with a single buffered pass
+    If keep, the output is rendered in memory first and its bytes are returned, for packing without reading it back
+    '''
+    if keep:
+        data = render_program(root, file_ext)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return data
+    try:
+        with open(output_path, 'wb') as f:
+            _write_pieces(f, root, file_ext)
+    except ValueError:
+        data = _render_program_etree(root, file_ext)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+    return None
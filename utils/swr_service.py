@@ -0,0 +1,182 @@
+'''Long-running SWR service keeping the recipe catalog and parsed bom programs warm, taking SWR jobs over a local HTTP API'''
+
+import os
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.program_cache import ProgramCache
+from utils.recipe_catalog import RecipeCatalog
+from utils.swr_manifest import SWRManifest
+from utils.swr_metrics import RunMetrics
+
+SWR_COLUMNS = ['CBID', 'PNP_PROGRAM_SIDE1', 'PNP_PROGRAM_SIDE2', 'PART NUMBER (IS)', 'PART NUMBER (WAS)', 'DESIGNATOR']
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SWRService:
+    '''
+    Run SWR jobs against a warm RecipeCatalog, ProgramCache and SWRManifest, one job at a time
+    Jobs are run by the given read_swr, normalize_swr and run_swr of main.py, so results are the same as a batch run
+    watch() polls recipe-bom and the swr file: the catalog is rescanned once any of its folders is modified,
+    and the SWR rows are run again once the swr file is saved (unchanged CBIDs are skipped by the manifest)
+    '''
+
+    def __init__(self, log, path_log, path_recipe_bom, path_recipe_swr, path_swr, settings, read_swr, normalize_swr, run_swr, stream=False):
+        self.log = log
+        self.path_log, self.path_recipe_bom, self.path_recipe_swr, self.path_swr = path_log, path_recipe_bom, path_recipe_swr, path_swr
+        self.settings = settings
+        self.read_swr, self.normalize_swr, self.run_swr = read_swr, normalize_swr, run_swr
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.program_cache = ProgramCache(settings['CACHE_MAX_MB'], log)
+        self.catalog = self._scan()
+        self.manifest = SWRManifest(path_recipe_swr, log)
+        self.swr_mtime = _mtime(path_swr)
+        self.jobs = 0
+
+    def _scan(self):
+        return RecipeCatalog(self.path_recipe_bom, os.path.join(self.path_log, 'recipe_catalog.json') if self.settings['CATALOG_CACHE'] else None, self.log)
+
+    def _outputs(self, cbid):
+        output_folder = os.path.join(self.path_recipe_swr, cbid)
+        if not os.path.isdir(output_folder):
+            return []
+        return sorted(f.path for f in os.scandir(output_folder) if f.is_file())
+
+    def run(self, rows, force=False):
+        '''Run the normalized SWR rows, return {CBID: {'status': status, 'outputs': [output paths]}} and the RunMetrics'''
+        with self.lock:
+            if self.catalog.is_outdated():
+                self.log.info(f"{self.path_recipe_bom} is modified, rescanning program catalog...")
+                self.catalog = self._scan()
+            metrics = RunMetrics()
+            try:
+                status = self.run_swr(self.log, rows, self.path_recipe_swr, self.catalog, self.program_cache, self.manifest, metrics, self.settings, 1, self.stream, force)
+            except Exception:
+                # Programs of the failed job may be left changed, they are parsed again by the next job
+                self.log.warning('Dropping all cached programs after the failed job...')
+                self.program_cache.clear()
+                raise
+            finally:
+                # Unmap the bom programs between jobs, so recipe-bom can be updated while serving
+                self.program_cache.release_splicers()
+            self.manifest.save()
+            self.jobs += 1
+            self.log.info(f"Program cache: {self.program_cache.misses} program(s) parsed, {self.program_cache.hits} reused.")
+        results = {cbid: {'status': cbid_status, 'outputs': self._outputs(cbid) if cbid_status in ('generated', 'skipped') else []} for cbid, cbid_status in status.items()}
+        return results, metrics
+
+    def run_rows(self, rows, force=False):
+        '''Run SWR rows given as {column: value}, multi line items given as lists or joined by new lines, raise ValueError on malformed rows'''
+        if not isinstance(rows, list) or len(rows) == 0:
+            raise ValueError('rows must be a non-empty list of json objects')
+        records = []
+        for row in rows:
+            if not isinstance(row, dict):
+                raise ValueError(f"Each row must be a json object of {SWR_COLUMNS}, got {json.dumps(row)}")
+            records.append({column: '\n'.join(str(value) for value in row[column]) if isinstance(row.get(column), list) else row.get(column, '') for column in SWR_COLUMNS})
+        return self.run(self.normalize_swr(self.log, records), force)
+
+    def run_workbook(self, force=False):
+        '''Run all SWR rows of the swr file'''
+        self.swr_mtime = _mtime(self.path_swr)
+        return self.run(self.read_swr(self.log, self.path_swr, RunMetrics()), force)
+
+    def status(self):
+        return {'jobs': self.jobs, 'catalog_files': len(self.catalog.files), 'programs_cached': len(self.program_cache.programs),
+                'cache_mb': round(self.program_cache.total_bytes / 1024 / 1024, 1), 'cache_hits': self.program_cache.hits, 'cache_misses': self.program_cache.misses}
+
+    def watch(self, interval, stop):
+        '''Poll recipe-bom and the swr file every interval seconds until stop is set'''
+        while not stop.wait(interval):
+            try:
+                if self.catalog.is_outdated():
+                    with self.lock:
+                        self.log.info(f"{self.path_recipe_bom} is modified, rescanning program catalog...")
+                        self.catalog = self._scan()
+                if _mtime(self.path_swr) != self.swr_mtime:
+                    self.log.info(f"{self.path_swr} is modified, running SWR rows...")
+                    self.run_workbook()
+            except ConnectionAbortedError as e:
+                self.log.warning(f"{str(e)}")
+            except Exception as e:
+                # Keep watching, the swr file may be saved again while being edited
+                self.log.exception(f"Unable to run {self.path_swr}: {str(e)}")
+
+
+def _handler(service):
+
+    class SWRRequestHandler(BaseHTTPRequestHandler):
+        '''
+        GET /status: cache and catalog state
+        POST /swr: run the posted rows, {"rows": [{column: value}], "force": false} or a single row
+        POST /run: run all rows of the swr file, {"force": false}
+        '''
+
+        def _reply(self, code, body):
+            data = json.dumps(body, indent=1).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length)) if length > 0 else {}
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/status':
+                self._reply(200, service.status())
+            else:
+                self._reply(404, {'error': f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            try:
+                body = self._body()
+                if not isinstance(body, dict):
+                    raise ValueError('Request body must be a json object')
+                if self.path.rstrip('/') == '/swr':
+                    rows = body.get('rows', [body])
+                    results, metrics = service.run_rows(rows, bool(body.get('force', False)))
+                elif self.path.rstrip('/') == '/run':
+                    results, metrics = service.run_workbook(bool(body.get('force', False)))
+                else:
+                    self._reply(404, {'error': f"Unknown path {self.path}"})
+                    return
+            except (ValueError, KeyError, TypeError, ConnectionAbortedError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            except Exception as e:
+                service.log.exception(f"Unexpected Error: {str(e)}")
+                self._reply(500, {'error': str(e)})
+                return
+            self._reply(200, {'cbids': results, 'seconds': {stage: round(seconds, 6) for stage, (calls, seconds) in metrics.stages.items()}})
+
+        def log_message(self, format, *args):
+            service.log.debug(f"{self.address_string()} {format % args}")
+
+    return SWRRequestHandler
+
+
+def serve(service, port, interval=2.0):
+    '''Serve the SWR service on localhost:port, watching for changes every interval seconds, until interrupted'''
+    stop = threading.Event()
+    watcher = threading.Thread(target=service.watch, args=(interval, stop), name='swr_watch', daemon=True)
+    watcher.start()
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(service))
+    service.log.info(f"Serving SWR jobs on http://127.0.0.1:{port}, POST /swr or /run, GET /status, press Ctrl+C to stop...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        service.log.info('Stopping SWR service...')
+    finally:
+        stop.set()
+        server.server_close()
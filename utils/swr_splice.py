@@ -0,0 +1,197 @@
+'''
+Byte-splicing writer of SWR programs, deriving each CBID output from the bytes of its bom program
+The bom program is memory-mapped once and indexed by the byte spans of its elements in document order,
+each output is then the unchanged byte ranges with only the changed attribute values spliced in and the removed elements left out
+'''
+
+import re
+import mmap
+from array import array
+
+from utils.swr_serializer import render_program, program_encoding, escape_attrib
+
+# Serialized programs have no comments, CDATA nor '>' inside attribute values or text
+TAG_PATTERN = re.compile(rb'<[^>]*>')
+
+SLASH, QUESTION, EXCLAMATION = ord('/'), ord('?'), ord('!')
+
+
+class ProgramSplicer:
+    '''
+    Byte spans of every element of a parsed bom program, in the bytes it is written as by render_program()
+    The bom program is memory-mapped if it is already in vendor-exact format, else its rendered bytes are kept instead,
+    so spliced outputs are always byte-identical to the outputs rendered from the changed tree
+    splice(plan) returns the output pieces of a ChangePlan, without applying it onto the tree
+    unmap() releases the bom program between runs, it is mapped again by the next splice() without being verified again
+    '''
+
+    def __init__(self, path, root, file_ext):
+        self.path = path
+        self.encoding = program_encoding(file_ext)
+        self.file, self.map = None, None
+
+        data = render_program(root, file_ext)
+        try:
+            self.file = open(path, 'rb')
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(self.map) == len(data) and self.map[:] == data:
+                data = self.map
+            else:
+                self._close_map()
+        except (OSError, ValueError):
+            self._close_map()
+        self.data = data
+        self.mapped = data is self.map
+        self.size = len(data)
+
+        self.position = {elem: i for i, elem in enumerate(root.iter())}
+        self.start, self.tag_end, self.end, self.tail_end = self._scan(data)
+        if len(self.start) != len(self.position):
+            self.close()
+            raise ValueError(f"{len(self.start)} elements found in {path}, {len(self.position)} expected")
+
+    @staticmethod
+    def _scan(data):
+        '''Return the start, start tag end, end and tail end offsets of all elements, in document order'''
+        start, tag_end, end, tail_end = array('q'), array('q'), array('q'), array('q')
+        stack = []
+        ended = None    # element whose tail ends at the next tag
+        for match in TAG_PATTERN.finditer(data):
+            s, e = match.span()
+            if ended is not None:
+                tail_end[ended] = s
+                ended = None
+            kind = data[s + 1]
+            if kind == QUESTION or kind == EXCLAMATION:
+                continue
+            if kind == SLASH:
+                ended = stack.pop()
+                end[ended] = e
+                continue
+            i = len(start)
+            start.append(s)
+            tag_end.append(e)
+            tail_end.append(e)
+            if data[e - 2] == SLASH:
+                end.append(e)
+                ended = i
+            else:
+                end.append(0)
+                stack.append(i)
+        if ended is not None:
+            tail_end[ended] = len(data)
+        return start, tag_end, end, tail_end
+
+    @property
+    def nbytes(self):
+        '''Memory held besides the mapped bom program'''
+        return (0 if self.mapped else len(self.data)) + len(self.position) * 128
+
+    def _attribute_edits(self, node, attrib):
+        i = self.position[node]
+        s, e = self.start[i], self.tag_end[i]
+        tag = self.data[s:e]
+        edits = []
+        for name, value in attrib.items():
+            value = escape_attrib(value).encode(self.encoding, 'xmlcharrefreplace')
+            key = f' {name}="'.encode(self.encoding)
+            found = tag.find(key)
+            if found < 0:
+                # New attributes are written after the existing ones
+                close = e - 2 if tag[-2:] == b'/>' else e - 1
+                edits.append((close, close, key + value + b'"'))
+            else:
+                value_start = s + found + len(key)
+                edits.append((value_start, s + tag.index(b'"', found + len(key)), value))
+        return edits
+
+    def splice(self, plan):
+        '''
+        Return the output of the program with the ChangePlan applied as a list of bytes-like pieces,
+        or None if the plan changes the layout beyond the spliced byte ranges (an emptied element written as <tag/>)
+        '''
+        if self.data is None:
+            self._remap()
+
+        # Only the direct children of their recorded parent are removed, as by ChangePlan.apply()
+        removed_by_parent = {}
+        for node, parent in plan.removed.items():
+            removed_by_parent.setdefault(parent, []).append(node)
+        removed = set()
+        for parent, nodes in removed_by_parent.items():
+            children = set(parent)
+            removed_by_parent[parent] = [node for node in nodes if node in children]
+            removed.update(removed_by_parent[parent])
+        for parent, nodes in removed_by_parent.items():
+            if len(nodes) > 0 and len(nodes) == len(parent) and not parent.text and parent not in removed:
+                return None
+
+        edits = []
+        for node in removed:
+            i = self.position[node]
+            edits.append((self.start[i], self.tail_end[i], b''))
+        for node, attrib in plan.attrib.items():
+            edits.extend(self._attribute_edits(node, attrib))
+        edits.sort(key=lambda edit: edit[0])
+
+        view = memoryview(self.data)
+        pieces = []
+        cursor = 0
+        for edit_start, edit_end, value in edits:
+            # Edits nested in an element already removed
+            if edit_start < cursor:
+                continue
+            pieces.append(view[cursor:edit_start])
+            if value:
+                pieces.append(value)
+            cursor = edit_end
+        pieces.append(view[cursor:])
+        return pieces
+
+    def _remap(self):
+        '''Map the bom program again after unmap(), raise ValueError if it was changed since verified'''
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) != self.size:
+            self._close_map()
+            raise ValueError(f"{self.path} is changed since verified")
+        self.data = self.map
+
+    def unmap(self):
+        '''Release the mapped bom program, so it can be modified or deleted, the rendered bytes kept instead are left as they are'''
+        if self.mapped:
+            self.data = None
+            self._release_map()
+
+    def _close_map(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        '''Unmap the bom program, so it can be modified or deleted again'''
+        self.data = None
+        self.position = {}
+        self._release_map()
+
+    def _release_map(self):
+        try:
+            self._close_map()
+        except BufferError:
+            # Pieces of the map still referenced, it is unmapped once they are released
+            self.map, self.file = None, None
+
+
+def write_spliced(pieces, output_path, keep=False):
+    '''Write the spliced pieces into output_path, if keep their joined bytes are returned, for packing without reading it back'''
+    if keep:
+        data = b''.join(pieces)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return data
+    with open(output_path, 'wb') as f:
+        f.writelines(pieces)
+    return None
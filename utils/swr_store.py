@@ -0,0 +1,247 @@
+'''Content-addressed store of generated SWR programs, exposed in the CBID folders by hard links'''
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, no reflink
+    fcntl = None
+
+from utils.swr_zip import FILE_MODE
+
+STORE_FOLDER = '.store'
+REFS_FILENAME = 'refs.json'
+HASH_CHUNK_SIZE = 1 << 20
+
+# Linux ioctl sharing all the blocks of a file with another one (reflink), on btrfs and XFS
+FICLONE = 0x40049409
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _clone_block(path):
+    '''Block size of the filesystem of folder path if files there can share blocks (reflink), else 0'''
+    if fcntl is None or not hasattr(os, 'copy_file_range'):
+        return 0
+    block = os.statvfs(path).f_bsize
+    src_fd, src_path = tempfile.mkstemp(suffix='.tmp', dir=path)
+    dst_fd, dst_path = tempfile.mkstemp(suffix='.tmp', dir=path)
+    try:
+        os.write(src_fd, bytes(block))
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return block
+    except OSError:
+        return 0
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+        os.remove(src_path)
+        os.remove(dst_path)
+
+
+class OutputStore:
+    '''
+    Keep each distinct output file once in recipe-swr/.store, named by its sha256, and hard link it into the CBID folders
+    Outputs identical to a stored one, such as the outputs of a CBID regenerated unchanged, are linked without being written,
+    outputs are copied instead where hard links are not supported
+    Outputs must be replaced and not edited in place, as all their links share the same bytes
+    Where the filesystem can share blocks between files (clone_block > 0), payloads shared by outputs, such as the unchanged
+    .pp7.zip members, are also stored once by put() and cloned into each output by clone()
+    Each linked output is recorded with its size, mtime and payloads into a references log of the process, merged into refs.json
+    by prune(), which removes the stored files no longer referenced by an unchanged output
+    '''
+
+    def __init__(self, path_recipe_swr):
+        self.root = path_recipe_swr
+        self.path = os.path.join(path_recipe_swr, STORE_FOLDER)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.clone_block = _clone_block(self.path)
+        self._init_state()
+
+    def _init_state(self):
+        self.lock = threading.Lock()
+        self.refs_log = os.path.join(self.path, f"refs.{os.getpid()}.log")
+        self.bytes_new, self.bytes_linked = 0, 0
+
+    def __getstate__(self):
+        # Sent to worker processes, which keep their own counters and references log
+        return {'root': self.root, 'path': self.path, 'clone_block': self.clone_block}
+
+    def __setstate__(self, state):
+        self.root, self.path, self.clone_block = state['root'], state['path'], state['clone_block']
+        self._init_state()
+
+    def _object(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def _count(self, new, size):
+        with self.lock:
+            if new:
+                self.bytes_new += size
+            else:
+                self.bytes_linked += size
+
+    def _link(self, digest, path, payloads=()):
+        '''Replace path by a hard link to the stored file, or a copy of it, and record the reference with the payloads cloned into it'''
+        stored = self._object(digest)
+        if not (os.path.exists(path) and os.path.samefile(stored, path)):
+            tmp_path = f"{path}.link.tmp"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            try:
+                os.link(stored, tmp_path)
+            except OSError:
+                shutil.copyfile(stored, tmp_path)
+            os.replace(tmp_path, path)
+        stat = os.stat(path)
+        with self.lock, open(self.refs_log, 'a', encoding='utf-8') as f:
+            f.write(f"{os.path.relpath(path, self.root)}\t{digest}\t{stat.st_size}\t{stat.st_mtime_ns}\t{','.join(payloads)}\n")
+
+    def _add(self, digest, src_path):
+        '''Move src_path into the store as digest, unless stored already, return True if it is new'''
+        stored = self._object(digest)
+        if os.path.exists(stored):
+            os.remove(src_path)
+            return False
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        os.chmod(src_path, FILE_MODE)
+        os.replace(src_path, stored)
+        return True
+
+    def _store(self, data, digest):
+        '''Store data as digest unless stored already, return True if it is new'''
+        stored = self._object(digest)
+        if os.path.exists(stored):
+            return False
+        os.makedirs(os.path.dirname(stored), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(stored))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self._add(digest, tmp_path)
+
+    def write(self, path, data):
+        '''Write data as the output at path, only stored if no identical output is stored yet'''
+        digest = hashlib.sha256(data).hexdigest()
+        new = self._store(data, digest)
+        self._link(digest, path)
+        self._count(new, len(data))
+
+    def adopt(self, path, src_path=None, payloads=(), cloned=0):
+        '''
+        Store the output written at src_path (path itself by default) and link it as path
+        payloads are the digests of the stored payloads cloned into it, cloned their bytes already counted by clone()
+        '''
+        src_path = path if src_path is None else src_path
+        size = os.path.getsize(src_path)
+        digest = _file_digest(src_path)
+        new = self._add(digest, src_path)
+        self._link(digest, path, payloads)
+        self._count(new, size - cloned)
+
+    def has(self, digest):
+        return os.path.exists(self._object(digest))
+
+    def put(self, data, digest=None):
+        '''Store the payload data once, by its sha256 digest if already known, and return the digest'''
+        digest = hashlib.sha256(data).hexdigest() if digest is None else digest
+        if self._store(data, digest):
+            self._count(True, len(data))
+        return digest
+
+    def clone(self, digest, fout):
+        '''
+        Append the stored payload to the binary file fout, from the current position which should be on a clone_block boundary,
+        copied with copy_file_range() so the filesystem shares its blocks with the store, return its size
+        '''
+        fout.flush()
+        offset = fout.tell()
+        with open(self._object(digest), 'rb') as fin:
+            size = os.fstat(fin.fileno()).st_size
+            done = 0
+            while done < size:
+                n = os.copy_file_range(fin.fileno(), fout.fileno(), size - done, done, offset + done)
+                if n < 1:
+                    raise OSError(f"Stored payload {digest} is truncated")
+                done += n
+        fout.seek(offset + size)
+        self._count(False, size)
+        return size
+
+    def _load_refs(self):
+        '''Return {output path relative to recipe-swr: [sha256, size, mtime, payloads]} of refs.json and the references logs, and the logs read'''
+        refs, logs = {}, []
+        path_refs = os.path.join(self.path, REFS_FILENAME)
+        if os.path.exists(path_refs):
+            try:
+                with open(path_refs, 'r', encoding='utf-8') as f:
+                    # References recorded before payloads were cloned have none
+                    refs = {relpath: ref if len(ref) > 3 else ref + [[]] for relpath, ref in json.load(f).items()}
+            except (OSError, ValueError):
+                refs = {}
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.startswith('refs.') and entry.name.endswith('.log'):
+                logs.append(entry.path)
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        relpath, digest, size, mtime, payloads = line.rstrip('\n').split('\t')
+                        refs[relpath] = [digest, int(size), int(mtime), payloads.split(',') if payloads else []]
+        return refs, logs
+
+    def prune(self):
+        '''
+        Merge the references into refs.json, keeping those whose output is unchanged since linked,
+        and remove the stored files not referenced, return (files kept, bytes kept, files removed)
+        '''
+        with self.lock:
+            refs, logs = self._load_refs()
+            referenced = set()
+            for relpath, (digest, size, mtime, payloads) in list(refs.items()):
+                try:
+                    stat = os.stat(os.path.join(self.root, relpath))
+                except OSError:
+                    stat = None
+                if stat is None or stat.st_size != size or stat.st_mtime_ns != mtime:
+                    del refs[relpath]
+                else:
+                    referenced.add(digest)
+                    referenced.update(payloads)
+
+            kept, kept_bytes, removed = 0, 0, 0
+            for folder in os.scandir(self.path):
+                if not folder.is_dir():
+                    continue
+                for entry in os.scandir(folder.path):
+                    if entry.name in referenced:
+                        kept += 1
+                        kept_bytes += entry.stat().st_size
+                    else:
+                        os.remove(entry.path)
+                        removed += 1
+
+            path_refs = os.path.join(self.path, REFS_FILENAME)
+            with open(f"{path_refs}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(refs, f)
+            os.replace(f"{path_refs}.tmp", path_refs)
+            for path in logs:
+                os.remove(path)
+        return kept, kept_bytes, removed
+
+    def log_summary(self, log, counted=True):
+        '''Prune the store and log its state, with the bytes written and linked by this process if counted'''
+        kept, kept_bytes, removed = self.prune()
+        if counted:
+            log.info(f"Output store: {self.bytes_new / 1024 / 1024:.2f} MB written, {self.bytes_linked / 1024 / 1024:.2f} MB linked to identical outputs.")
+        log.info(f"Output store: {kept} stored file(s) of {kept_bytes / 1024 / 1024:.2f} MB, {removed} unreferenced file(s) removed.")
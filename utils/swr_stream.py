@@ -0,0 +1,225 @@
+'''
+Constant-memory streaming rewriter for .pp/.pp7 programs
+A pre-scan pass indexes only the records relevant to the SWR (for the feeder-sharing checks),
+then the rewrite pass writes the output while the program is read, without keeping the tree in memory
+Elements are identified by their document order (ordinal of the start event) in both passes
+'''
+
+import xml.etree.ElementTree as ETree
+
+from utils.swr_engine import ProgramIndex, Component, Pick, Lane, ROBOTS_PER_SECTION, apply_swr
+from utils.swr_serializer import program_namespace, escape_cdata, local_name, start_tag, ProgramWriter
+
+CHUNK_SIZE = 1 << 16
+
+
+def _iter_events(path):
+    '''Yield (event, elem) of the program read in chunks, dropping ended elements from the tree being built'''
+    parser = ETree.XMLPullParser(events=('start', 'end'))
+    parents = []
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.close()
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    parents.append(elem)
+                    yield event, elem
+                else:
+                    parents.pop()
+                    yield event, elem
+                    # Events are read a chunk behind the parser, so later siblings may be appended already, but as children
+                    # end in order and are dropped as they end, the ended element is always the first child left in its parent
+                    if len(parents) > 0:
+                        del parents[-1][0]
+            if not chunk:
+                break
+
+
+def scan_program(path, file_ext, lineItems):
+    '''
+    Pre-scan the program and return its ProgramIndex with element ordinals as nodes
+    Only components and lanes of the SWR part numbers and picks of the relevant designators are kept
+    '''
+    file_ext = file_ext.lower()
+    namespace = program_namespace(file_ext)
+    prefix = f"{{{namespace}}}"
+
+    relevant_parts = {partIs for partIs, partWas, designatorList in lineItems} | {partWas for partIs, partWas, designatorList in lineItems}
+    relevant_refdes = {designator for partIs, partWas, designatorList in lineItems for designator in designatorList}
+
+    index = ProgramIndex(file_ext)
+    current = {}        # local tag -> (ordinal, attrib) of the nearest open element
+    stack = []          # [(local tag, ordinal, previous current)]
+    index_children = [] # .pp direct children of the open Index, [(ordinal, local tag, attrib)]
+    picks_seen = False
+    actions_count = 0
+    location = -1       # .pp7 board location
+    ordinal = -1
+
+    def add_pick(nodes, parent, attrib, feeder, robotHead=None, location=None):
+        sREFDES = attrib.get('refDes')
+        if sREFDES in relevant_refdes:
+            index.add_pick(Pick(nodes, parent, sREFDES, feeder, robotHead, location))
+
+    for event, elem in _iter_events(path):
+        if event == 'start':
+            ordinal += 1
+            tag, attrib = elem.tag, elem.attrib
+            if tag.startswith(prefix):
+                local = tag[len(prefix):]
+            else:
+                # Raise ValueError on any other namespace, un-namespaced elements are not indexed
+                local_name(tag, namespace)
+                local = None
+            for key in attrib:
+                local_name(key, namespace)
+
+            if file_ext == 'pp' and stack and 'Index' in current and stack[-1][1] == current['Index'][0]:
+                index_children.append((ordinal, local, attrib))
+
+            if local == 'Board':
+                if picks_seen:
+                    raise ValueError('Board is found after Actions, unable to pre-scan in streaming mode')
+                index.boards.append((ordinal, attrib.get('id')))
+            elif local == 'Component' and 'Board' in current:
+                sPartNumber = attrib.get('partNumber')
+                if sPartNumber in relevant_parts:
+                    sREFDES = attrib.get('refDes')
+                    relevant_refdes.add(sREFDES)
+                    index.components.setdefault(sPartNumber, []).append(Component(ordinal, current['Board'][0], sREFDES, sPartNumber))
+
+            elif file_ext == 'pp':
+                if local == 'Actions':
+                    picks_seen = True
+                    actions_count += 1
+                elif local == 'Index' and 'Actions' in current:
+                    index_children = []
+                elif local == 'Lane' and 'Section' in current and 'Trolley' in current and 'Feeder' in current:
+                    sPartNumber = attrib.get('partNumber')
+                    if sPartNumber in relevant_parts:
+                        key = (current['Section'][1].get('number'), current['Feeder'][1].get('number'), attrib.get('number'))
+                        index.lanes.setdefault(sPartNumber, []).append(Lane(ordinal, current['Feeder'][0], current['Trolley'][0], key, sPartNumber))
+
+            elif file_ext == 'pp7':
+                if local == 'BoardLocation' and 'Segment' in current and 'Processing' in current:
+                    picks_seen = True
+                    location += 1
+                elif 'Action' in current and 'BoardLocation' in current and 'Segment' in current and 'Processing' in current:
+                    ActionInfo, BoardLocationInfo = current['Action'][0], current['BoardLocation'][0]
+                    if local == 'Pick':
+                        feeder = (current['Segment'][1].get('number'), attrib.get('feedSectionNumber'), attrib.get('feederSlotNumber'), attrib.get('feederLaneNumber'))
+                        robotHead = (attrib.get('robotNumber'), attrib.get('headNumber'))
+                        add_pick([ActionInfo], BoardLocationInfo, attrib, feeder, robotHead, location)
+                    elif local in ('Align', 'Place'):
+                        index.table.add_action((attrib.get('robotNumber'), attrib.get('headNumber')), location, ActionInfo, BoardLocationInfo)
+                elif local == 'FeederLane' and 'Segment' in current and 'Setup' in current and 'FeedSection' in current and 'Feeder' in current:
+                    sPartNumber = attrib.get('partNumber')
+                    if sPartNumber in relevant_parts:
+                        key = (current['Segment'][1].get('number'), current['FeedSection'][1].get('number'), current['Feeder'][1].get('slotNumber'), attrib.get('number'))
+                        index.lanes.setdefault(sPartNumber, []).append(Lane(ordinal, current['Feeder'][0], current['FeedSection'][0], key, sPartNumber))
+
+            stack.append((local, ordinal, current.get(local)))
+            if local is not None:
+                current[local] = (ordinal, attrib)
+
+        else:
+            local, node, previous = stack.pop()
+            if local is None:
+                continue
+            if previous is None:
+                del current[local]
+            else:
+                current[local] = previous
+
+            # Sweep backward once to find the group from pick to place (Pick, Align, ReadFiducial, Place)
+            if file_ext == 'pp' and local == 'Index' and 'Actions' in current:
+                sSectionNumber = str((actions_count - 1) // ROBOTS_PER_SECTION + 1)
+                stop = len(index_children)
+                for k in range(len(index_children) - 1, -1, -1):
+                    child, child_tag, child_attrib = index_children[k]
+                    if child_tag == 'Pick':
+                        feeder = (sSectionNumber, child_attrib.get('feederNumber'), child_attrib.get('laneNumber'))
+                        add_pick([item[0] for item in index_children[k:stop]], node, child_attrib, feeder)
+                    elif child_tag == 'Place':
+                        stop = k + 1
+                index_children = []
+
+    index.table.freeze()
+    return index
+
+
+def rewrite_program(path, output_path, file_ext, plan):
+    '''Stream the program into output_path with the ChangePlan (keyed by element ordinal) applied, in vendor-exact format'''
+    file_ext = file_ext.lower()
+    namespace = program_namespace(file_ext)
+    removed, changed = plan.removed, plan.attrib
+
+    with open(output_path, 'wb') as fout:
+        writer = ProgramWriter(fout, file_ext)
+        frames = []         # [[elem, start tag or None once written, skipped]]
+        last_ended = None   # element whose tail is written at the next event
+        skip_depth = 0
+        ordinal = -1
+
+        for event, elem in _iter_events(path):
+            if last_ended is not None:
+                if last_ended.tail:
+                    writer.append(escape_cdata(last_ended.tail))
+                last_ended = None
+
+            if event == 'start':
+                ordinal += 1
+                if skip_depth > 0 or ordinal in removed:
+                    skip_depth += 1
+                    frames.append([elem, None, True])
+                    continue
+
+                # Open the parent once its first kept child is found
+                if len(frames) > 0 and frames[-1][1] is not None:
+                    parent = frames[-1]
+                    writer.append(parent[1] + '>')
+                    if parent[0].text:
+                        writer.append(escape_cdata(parent[0].text))
+                    parent[1] = None
+
+                attrib = elem.attrib
+                if ordinal in changed:
+                    attrib = dict(attrib)
+                    attrib.update(changed[ordinal])
+                frames.append([elem, start_tag(elem.tag, attrib, namespace, root=len(frames) == 0), False])
+
+            else:
+                elem, pending, skipped = frames.pop()
+                if skipped:
+                    skip_depth -= 1
+                    continue
+
+                tag = local_name(elem.tag, namespace)
+                if pending is not None:
+                    if elem.text:
+                        writer.append(f"{pending}>{escape_cdata(elem.text)}</{tag}>")
+                    else:
+                        writer.append(f"{pending}/>")
+                else:
+                    writer.append(f"</{tag}>")
+
+                if len(frames) > 0:
+                    last_ended = elem
+                elif tag == 'PlacementProgram':
+                    writer.append('\n')
+
+        writer.close()
+
+
+def plan_stream(path, file_ext, cbid, lineItems, log):
+    '''
+    Pre-scan the program and apply all line items of the CBID, return the ChangePlan to be written by rewrite_program()
+    Raise ValueError if the program cannot be streamed, AssertionError if the SWR cannot be handled
+    '''
+    log.debug(f"Pre-scanning {path} ...")
+    index = scan_program(path, file_ext, lineItems)
+    return apply_swr(index, cbid, lineItems, log)
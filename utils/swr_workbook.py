@@ -0,0 +1,136 @@
+'''
+Reader of .xlsx sheets into rows of {column: value}, with the standard library only
+Values are as pandas.read_excel() would give them: empty and NA-like cells are None, and numeric columns with any
+empty or fractional cell are floats. Dates are read as their serial numbers, since cell styles are not read
+'''
+
+import re
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ETree
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Strings read as NaN by pandas.read_excel() by default
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+
+CELL_REF = re.compile(r'([A-Z]+)')
+
+
+def _column_index(ref):
+    '''Zero-based column index of a cell reference such as AB12'''
+    index = 0
+    for letter in CELL_REF.match(ref).group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _text(elem):
+    '''Text of a shared or inline string, joining rich text runs and leaving out phonetic runs'''
+    phonetic = {t for rph in elem.iter(f"{MAIN_NS}rPh") for t in rph.iter(f"{MAIN_NS}t")}
+    return ''.join(t.text or '' for t in elem.iter(f"{MAIN_NS}t") if t not in phonetic)
+
+
+def _sheet_paths(archive):
+    '''Return {sheet name: path of its xml in the archive}'''
+    targets = {}
+    rels = ETree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f"{PACKAGE_REL_NS}Relationship"):
+        target = rel.get('Target')
+        targets[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    workbook = ETree.fromstring(archive.read('xl/workbook.xml'))
+    return {sheet.get('name'): targets[sheet.get(f"{REL_NS}id")] for sheet in workbook.iter(f"{MAIN_NS}sheet")}
+
+
+def _shared_strings(archive):
+    try:
+        data = archive.read('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    return [_text(si) for si in ETree.fromstring(data).iter(f"{MAIN_NS}si")]
+
+
+def _cell_value(cell, shared):
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        value = _text(cell)
+    else:
+        v = cell.find(f"{MAIN_NS}v")
+        if v is None or v.text is None:
+            return None
+        value = v.text
+        if kind == 's':
+            value = shared[int(value)]
+        elif kind == 'b':
+            return value == '1'
+        elif kind == 'n':
+            return float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+    return None if value in NA_VALUES else value
+
+
+def _read_rows(archive, path, shared):
+    '''Return the rows of the sheet as lists of values, without the trailing empty rows'''
+    rows = []
+    for row in ETree.fromstring(archive.read(path)).iter(f"{MAIN_NS}row"):
+        values = []
+        for cell in row.iter(f"{MAIN_NS}c"):
+            ref = cell.get('r')
+            index = _column_index(ref) if ref else len(values)
+            values.extend([None] * (index - len(values)))
+            values.append(_cell_value(cell, shared))
+        rows.append(values)
+    while len(rows) > 0 and all(value is None for value in rows[-1]):
+        rows.pop()
+    return rows
+
+
+def _columns(header):
+    '''Column names of the header row, as named by pandas for empty and duplicated names'''
+    columns, seen = [], {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else name
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def _numeric_columns(columns, records):
+    '''Turn the values of numeric columns into floats if any of them is empty or fractional, as typed by pandas'''
+    for column in columns:
+        values = [record[column] for record in records]
+        present = [value for value in values if value is not None]
+        if len(present) == 0 or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+            continue
+        if len(present) < len(values) or any(isinstance(value, float) for value in present):
+            for record in records:
+                if record[column] is not None:
+                    record[column] = float(record[column])
+
+
+def read_workbook(path, sheet_names):
+    '''Read the given sheets of the .xlsx file at once, return {sheet name: [{column: value}]} of the sheets found'''
+    with zipfile.ZipFile(path) as archive:
+        paths = _sheet_paths(archive)
+        shared = _shared_strings(archive)
+        sheets = {}
+        for sheet_name in sheet_names:
+            if sheet_name not in paths:
+                continue
+            rows = _read_rows(archive, paths[sheet_name], shared)
+            # The header is the first row which is not empty
+            while len(rows) > 0 and all(value is None for value in rows[0]):
+                rows.pop(0)
+            if len(rows) == 0:
+                sheets[sheet_name] = []
+                continue
+            columns = _columns(rows[0])
+            records = [{column: (row[i] if i < len(row) else None) for i, column in enumerate(columns)} for row in rows[1:]]
+            _numeric_columns(columns, records)
+            sheets[sheet_name] = records
+    return sheets
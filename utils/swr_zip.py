@@ -0,0 +1,267 @@
+'''
+Single-pass .pp7.zip builder, unchanged members are copied as raw compressed bytes
+and renamed .PRT members are reused from the PRTLibrary across bundles and CBIDs
+'''
+
+import os
+import copy
+import time
+import zlib
+import struct
+import shutil
+import hashlib
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+NO_PLACE = 'NO PLACE'
+
+# Local file header: signature, versions, flags, method, time, date, crc, sizes, name and extra lengths
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_HEADER_NAME_LENGTH = 10
+_LOCAL_HEADER_EXTRA_LENGTH = 11
+_USE_DATA_DESCRIPTOR = 0x08
+# Extra field padding a local header so the member data starts on a block boundary, as written by zipalign
+_ALIGNMENT_EXTRA_ID = 0xD935
+
+COPY_CHUNK_SIZE = 1 << 20
+PRT_LIBRARY_MAX_MB = 64
+
+
+def _file_mode():
+    '''Mode of the files created by open() under the process umask, as tempfile.mkstemp() creates them owner only'''
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+FILE_MODE = _file_mode()
+
+
+def _seek_data(zin, item):
+    '''Seek zin to the compressed bytes of item, past its local header'''
+    zin.fp.seek(item.header_offset)
+    header = _LOCAL_HEADER.unpack(zin.fp.read(_LOCAL_HEADER.size))
+    zin.fp.seek(header[_LOCAL_HEADER_NAME_LENGTH] + header[_LOCAL_HEADER_EXTRA_LENGTH], os.SEEK_CUR)
+
+
+def _read_raw(zin, item):
+    '''Return the compressed bytes of item'''
+    _seek_data(zin, item)
+    data = zin.fp.read(item.compress_size)
+    if len(data) < item.compress_size:
+        raise zipfile.BadZipFile(f"{item.filename} is truncated")
+    return data
+
+
+def _copy_raw(zin, zout, item):
+    '''Copy the compressed bytes of item from zin into zout, without inflating and deflating again'''
+    _seek_data(zin, item)
+
+    zinfo = copy.copy(item)
+    # Sizes and crc are known, so they are written in the local header instead of a data descriptor
+    zinfo.flag_bits &= ~_USE_DATA_DESCRIPTOR
+    zinfo.header_offset = zout.fp.tell()
+    zout.fp.write(zinfo.FileHeader())
+
+    remaining = item.compress_size
+    while remaining > 0:
+        chunk = zin.fp.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"{item.filename} is truncated")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    zout.start_dir = zout.fp.tell()
+
+
+def _write_cloned(zout, zinfo, store, digest):
+    '''
+    Write zinfo with the payload digest of the OutputStore as its data, cloned from the store so the bundles share its blocks
+    The local header is padded for the data to start on a block boundary, the central directory keeps the extra fields unpadded
+    '''
+    extra = zinfo.extra
+    zinfo.flag_bits &= ~_USE_DATA_DESCRIPTOR
+    zinfo.header_offset = zout.fp.tell()
+    alignment = min(store.clone_block, 0xFFFF)
+    zinfo.extra = extra + struct.pack('<HHH', _ALIGNMENT_EXTRA_ID, 2, alignment)
+    padding = -(zinfo.header_offset + len(zinfo.FileHeader())) % store.clone_block
+    zinfo.extra = extra + struct.pack('<HHH', _ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + bytes(padding)
+    zout.fp.write(zinfo.FileHeader())
+    zinfo.extra = extra
+    size = store.clone(digest, zout.fp)
+
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    zout.start_dir = zout.fp.tell()
+    return size
+
+
+def _new_info(filename, date_time=None):
+    '''ZipInfo of a member written now, or at date_time if given, as by ZipFile.writestr()'''
+    zinfo = zipfile.ZipInfo(filename=filename, date_time=date_time or time.localtime(time.time())[:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = 0o600 << 16
+    return zinfo
+
+
+def _write_deflated(zout, filename, member, date_time=None):
+    '''Write the deflated member (crc, size, compressed bytes) into zout as filename, as ZipFile.writestr() would'''
+    crc, size, compressed = member
+    zinfo = _new_info(filename, date_time)
+    zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc, size, len(compressed)
+    zinfo.header_offset = zout.fp.tell()
+    zout.fp.write(zinfo.FileHeader())
+    zout.fp.write(compressed)
+    zout.filelist.append(zinfo)
+    zout.NameToInfo[zinfo.filename] = zinfo
+    zout.start_dir = zout.fp.tell()
+
+
+def _deflate(data):
+    '''Return (crc, size, compressed bytes) of data, deflated as by ZipFile.writestr()'''
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return zlib.crc32(data), len(data), compressor.compress(data) + compressor.flush()
+
+
+class PRTLibrary:
+    '''
+    Library of the .PRT part definitions of the bom .pp7.zip bundles, shared by the builds of a process
+    digests indexes the members of each bundle by the sha256 of their compressed bytes, hashed once per bundle version,
+    so bundles with the same part definition share its rewritten payloads, and the OutputStore its stored payloads
+    payloads is an LRU cache of the deflated partWas -> partIs rewrite of each part definition, evicted once max_mb is exceeded
+    '''
+
+    def __init__(self, max_mb=PRT_LIBRARY_MAX_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.digests = {}               # (path, mtime, size) -> {member name: sha256}
+        self.payloads = OrderedDict()   # (sha256, partWas, partIs) -> (crc, size, compressed bytes)
+        self.total_bytes = 0
+        self.hits, self.misses = 0, 0
+
+    def bundle(self, file):
+        '''Return the {member name: sha256} index of the bundle, emptied once the bundle is modified'''
+        stat = os.stat(file)
+        key = (file, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if key not in self.digests:
+                for old_key in [k for k in self.digests if k[0] == file]:
+                    del self.digests[old_key]
+                self.digests[key] = {}
+            return self.digests[key]
+
+    def digest(self, digests, zin, item):
+        '''Return the sha256 of the compressed bytes of item, indexed into digests of its bundle'''
+        digest = digests.get(item.filename)
+        if digest is None:
+            digest = hashlib.sha256(_read_raw(zin, item)).hexdigest()
+            digests[item.filename] = digest
+        return digest
+
+    def payload(self, zin, name, digest, partWas, partIs):
+        '''Return the deflated rewrite of member name (with content digest) from partWas to partIs, rewritten only if not cached'''
+        key = (digest, partWas, partIs)
+        with self.lock:
+            member = self.payloads.get(key)
+            if member is not None:
+                self.hits += 1
+                self.payloads.move_to_end(key)
+                return member
+        member = _deflate(zin.read(name).decode(encoding='utf-8').replace(partWas, partIs).encode(encoding='utf-8'))
+        with self.lock:
+            self.misses += 1
+            if key not in self.payloads:
+                self.payloads[key] = member
+                self.total_bytes += len(member[2])
+            while self.total_bytes > self.max_bytes and len(self.payloads) > 1:
+                _, evicted = self.payloads.popitem(last=False)
+                self.total_bytes -= len(evicted[2])
+        return member
+
+
+PRT_LIBRARY = PRTLibrary()
+
+
+def build_pp7_zip(file, output_path, partIsList, partWasList, pp7_data=None, store=None, library=None):
+    '''
+    Write output_path from the bom .pp7.zip file in a single pass, into a unique temp file next to it
+    .PRT members of subbed parts are renamed and rewritten, those of removed parts are dropped,
+    other members are copied raw and the .pp7 member is replaced by the output .pp7 (pp7_data if given, else read from disk)
+    With an OutputStore, the output is stored and linked as output_path, its written members are dated as their bom members
+    so the output of an unchanged bundle is identical from run to run, and its .PRT and other unchanged members are cloned
+    from payloads stored once if the store filesystem can share blocks
+    Rewritten .PRT members are taken from library (the PRT_LIBRARY of the process by default)
+    '''
+    old_filename_set = {partWas + '.PRT' for partWas in partWasList}
+    # Subbed part numbers, {PARTWAS.PRT: [line item numbers]}, only upper case names can be matched
+    renames = {}
+    for n in range(len(partWasList)):
+        if partWasList[n].upper() != NO_PLACE and partIsList[n].upper() != NO_PLACE:
+            renames.setdefault(partWasList[n] + '.PRT', []).append(n)
+    pp7_path = output_path.replace('.zip', '')
+    pp7_name = os.path.basename(pp7_path)
+
+    if pp7_data is None and not os.path.exists(pp7_path):
+        raise AssertionError ('.pp7.zip files are provided, but .pp7 files are missing. Do extract and provide .pp7 together with .pp7.zip files.')
+
+    # Unchanged and rewritten .PRT members are stored once and cloned into the bundles where the store filesystem can
+    cloning = store is not None and store.clone_block > 0
+    payloads, cloned = [], 0
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=f"{pp7_name}.", dir=os.path.dirname(output_path) or None)
+    try:
+        os.chmod(tmp_path, FILE_MODE)
+        with os.fdopen(fd, 'wb') as ftmp:
+            with zipfile.ZipFile(file, mode='r') as zin, zipfile.ZipFile(ftmp, mode='w', compression=zipfile.ZIP_DEFLATED) as zout:
+                zout.comment = zin.comment # preserve the comment
+                library = PRT_LIBRARY if library is None else library
+                digests = library.bundle(file)
+                data_dict = {}
+                pp7_time = None
+                for item in zin.infolist():
+                    if item.filename[-4:].lower() == '.pp7':
+                        pp7_time = item.date_time
+                    elif item.filename not in old_filename_set:
+                        # copy the unchanged file as is
+                        if cloning:
+                            digest = library.digest(digests, zin, item)
+                            if not store.has(digest):
+                                store.put(_read_raw(zin, item), digest)
+                            payloads.append(digest)
+                            cloned += _write_cloned(zout, copy.copy(item), store, digest)
+                        else:
+                            _copy_raw(zin, zout, item)
+                    elif item.filename.upper() in renames:
+                        # take the rewritten old to new text from the library
+                        digest = library.digest(digests, zin, item)
+                        for n in renames[item.filename.upper()]:
+                            data_dict[partIsList[n] + '.PRT'] = (library.payload(zin, item.filename, digest, partWasList[n], partIsList[n]), item.date_time)
+
+                for f, (d, date_time) in data_dict.items():
+                    if cloning:
+                        crc, size, compressed = d
+                        zinfo = _new_info(f, date_time)
+                        zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc, size, len(compressed)
+                        digest = store.put(compressed)
+                        payloads.append(digest)
+                        cloned += _write_cloned(zout, zinfo, store, digest)
+                    else:
+                        _write_deflated(zout, f, d, date_time if store is not None else None)
+                pp7_info = _new_info(pp7_name, pp7_time if store is not None else None)
+                if pp7_data is not None:
+                    zout.writestr(pp7_info, pp7_data)
+                else:
+                    with open(pp7_path, 'rb') as fpp7, zout.open(pp7_info, mode='w') as fout:
+                        shutil.copyfileobj(fpp7, fout, COPY_CHUNK_SIZE)
+        if store is not None:
+            store.adopt(output_path, tmp_path, payloads, cloned)
+        else:
+            os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise